@@ -0,0 +1,99 @@
+'''
+
+pixel_pipeline.py
+
+Reads the pixels of a Blender image (e.g. bpy.data.images['Viewer Node'])
+into numpy without going through python floats. np.array(image.pixels)
+converts every value of the 640x480x4 image through Blender's sequence
+protocol; PixelReader instead copies all values at once with
+image.pixels.foreach_get into a float32 buffer that is allocated once and
+reused for every frame.
+
+The (H, W, C) result is post-processed by a chain of processors that return
+views wherever possible:
+
+    DepthChannel: the depth pass stored in one channel (alpha of the viewer node)
+    FlipVertical: Blender stores images bottom row first
+    Downsample:   every factor-th pixel (view), or the mean of factor x factor blocks (copy)
+
+    reader = PixelReader(480, 640)
+    depth_pipeline = ProcessorChain(DepthChannel(), FlipVertical())
+    depth = depth_pipeline(reader.read(bpy.data.images['Viewer Node']))
+
+The returned arrays share the reader's buffer, so they are only valid until
+the next read; copy them (np.array, DepthStoreWriter.append, ...) to keep
+them.
+
+'''
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class PixelReader:
+    def __init__(self, height, width, channels=4):
+        self.shape = (height, width, channels)
+        self.buffer = np.empty(height * width * channels, dtype=np.float32)
+
+    def read(self, image):
+        # (H, W, C) view of the reused buffer, rows in Blender order (bottom first)
+        pixels = image.pixels
+        if len(pixels) != self.buffer.size:
+            raise ValueError('image has {} values, expected {} for {}'.format(len(pixels), self.buffer.size, self.shape))
+        if hasattr(pixels, 'foreach_get'):
+            pixels.foreach_get(self.buffer)
+        else:
+            self.buffer[:] = pixels
+        return self.buffer.reshape(self.shape)
+
+
+class PixelProcessor(ABC):
+    # processors map (H, W, ...) pixels to a view (or copy) of them
+    @abstractmethod
+    def __call__(self, pixels):
+        pass
+
+
+class DepthChannel(PixelProcessor):
+    # (H, W) view of one channel, the viewer node of the render scripts carries the depth in alpha
+    def __init__(self, channel=3):
+        self.channel = channel
+
+    def __call__(self, pixels):
+        return pixels[..., self.channel]
+
+
+class FlipVertical(PixelProcessor):
+    # top row first, as the images written to disk
+    def __call__(self, pixels):
+        return pixels[::-1]
+
+
+class Downsample(PixelProcessor):
+    # mode 'stride' keeps every factor-th pixel (a view), 'mean' averages factor x factor blocks (a copy)
+    def __init__(self, factor, mode='stride'):
+        if mode not in ('stride', 'mean'):
+            raise ValueError('unknown downsampling mode: {}'.format(mode))
+        self.factor = factor
+        self.mode = mode
+
+    def __call__(self, pixels):
+        f = self.factor
+        if self.mode == 'stride':
+            return pixels[::f, ::f]
+        height, width = pixels.shape[0] // f * f, pixels.shape[1] // f * f
+        blocks = pixels[:height, :width].reshape((height // f, f, width // f, f) + pixels.shape[2:])
+        return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+class ProcessorChain(PixelProcessor):
+    # applies the processors in order
+    def __init__(self, *processors):
+        self.processors = processors
+
+    def __call__(self, pixels):
+        for processor in self.processors:
+            pixels = processor(pixels)
+        return pixels
+
@@ -1,10 +1,9 @@
 ## NOTE: parts of this code are inspired by Yujie's codes
 
 import os
+import sys
 import openpyxl as opx
-from scipy.spatial.transform import Rotation as R
 
-import json
 import bpy
 import math
 import numpy as np
@@ -18,6 +17,11 @@ SET UP PORTION
 # provide an excel file with camera info
 XLSX_PATH = '/Downloads/nerf_related/results/custom_frames_camera_info.xlsx'
 CONVERT2LST = True
+
+# folder with the shared pose modules (train_test_nerf), the excel file is read through its pose cache
+TRAIN_TEST_NERF_PATH = '/Downloads/EndoscopyWithNerf/train_test_nerf'
+USE_POSE_CACHE = True
+REBUILD_POSE_CACHE = False
 CAMERA_INFO = []    # if a file is not provided, replace this with camera info
 
 # update camera (i.e. flip upside_down & shift up via z-axis)
@@ -43,29 +47,28 @@ RENDER_DEPTH = True
 
 DEBUG = False
 
-def readXlsxInfo2Lst():
-    workbook = opx.load_workbook(XLSX_PATH)
-    sheet = workbook.active
+sys.path.append(TRAIN_TEST_NERF_PATH)
+from pose_cache import load_pose_table
+from pose_transforms import FlipShift
 
-    for row in sheet.iter_rows(min_row=2, max_row=FRAMES+1):
-        # [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w]
-        CAMERA_INFO.append([row[3].value, row[4].value, row[5].value, row[6].value, row[7].value, row[8].value, row[9].value])
+# folder with transforms_writer.py, frames are written to FRAMES_PATH/all.frames.jsonl while rendering
+RENDER_SCRIPTS_PATH = '/Downloads/EndoscopyWithNerf/render_custom_frames_blender'
+sys.path.append(RENDER_SCRIPTS_PATH)
+from transforms_writer import TransformsWriter, finalize_transforms
 
-    workbook.close()
+def readXlsxInfo2Lst():
+    table = load_pose_table(XLSX_PATH, useCache=USE_POSE_CACHE, rebuild=REBUILD_POSE_CACHE)
+
+    # [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w]
+    CAMERA_INFO.extend(table[:FRAMES, 3:10].tolist())
 
 if CONVERT2LST:
     readXlsxInfo2Lst()
 
 def updateCamera(deltaDeg, deltaZ):
-    for i in range(len(CAMERA_INFO)):
-        cameraInfo = CAMERA_INFO[i]
-        rEuler = R.from_quat([cameraInfo[3], cameraInfo[4], cameraInfo[5], cameraInfo[6]]).as_euler('xyz', degrees=True)
-        rFlipped = R.from_euler('xyz', [rEuler[0], rEuler[1]+deltaDeg, rEuler[2]], degrees=True).as_quat()
-
-        newCameraInfo = CAMERA_INFO[i][:2]
-        newCameraInfo.extend([CAMERA_INFO[i][2] + deltaZ])
-        newCameraInfo.extend(rFlipped)
-        CAMERA_INFO[i] = newCameraInfo
+    # flip/shift all cameras at once, see train_test_nerf/pose_transforms.py
+    tranQuots = FlipShift(deltaDeg, deltaZ)(np.array(CAMERA_INFO, dtype=float))
+    CAMERA_INFO[:] = tranQuots.tolist()
 
 if UPDATE_CAMERA:
     updateCamera(180, 37)
@@ -162,6 +165,12 @@ bpy.context.scene.render.film_transparent = True
 objs = [ob for ob in bpy.context.scene.objects if ob.type in ('EMPTY') and 'Empty' in ob.name]
 bpy.ops.object.delete({"selected_objects": objs})
 
+def listify_matrix(matrix):
+    matrix_list = []
+    for row in matrix:
+        matrix_list.append(list(row))
+    return matrix_list
+
 def parent_obj_to_camera(b_camera):
     origin = (0, 0, 0)
     b_empty = bpy.data.objects.new("Empty", None)
@@ -194,13 +203,14 @@ if not DEBUG:
     if RENDER_DEPTH:
         depth_file_output.base_path = ''
 
-out_data['frames'] = []
-
 # set up path to store rendered frames
 fp = bpy.path.abspath(f"//{FRAMES_PATH}")
 if not os.path.exists(fp):
     os.makedirs(fp)
 
+frames_path = fp + '/all.frames.jsonl'
+frames_writer = TransformsWriter(frames_path, header=out_data, resume=False)
+
 for i in range(0, FRAMES):
     cam.location = (CAMERA_INFO[i][0], CAMERA_INFO[i][1], CAMERA_INFO[i][2])
     cam.rotation_quaternion = (CAMERA_INFO[i][3], CAMERA_INFO[i][4], CAMERA_INFO[i][5], CAMERA_INFO[i][6]) # (w,x,y,z)
@@ -240,13 +250,14 @@ for i in range(0, FRAMES):
     
     frame_data = {
         'file_path': scene.render.filepath,
-        'rotation (quaternion wxyz)': cam.rotation_quaternion,
+        'rotation (quaternion wxyz)': list(cam.rotation_quaternion),
         'transform_matrix': listify_matrix(cam.matrix_world)
     }
-    out_data['frames'].append(frame_data)
+    frames_writer.append(frame_data, 'r_{0:03d}'.format(i), i)
+
+frames_writer.close()
    
 print('b_empty.location is ', b_empty.location)
 
 if not DEBUG:
-    with open(fp + '/' + 'transforms.json', 'w') as out_file:
-        json.dump(out_data, out_file, indent=4)
+    finalize_transforms([frames_path], fp + '/' + 'transforms.json')
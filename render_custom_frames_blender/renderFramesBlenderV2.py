@@ -1,9 +1,9 @@
 ## NOTE: parts of this code are inspired by Yujie's codes
 
 import os
-#from scipy.spatial.transform import Rotation as R
+import sys
+import argparse
 
-import json
 import bpy
 import math
 import numpy as np
@@ -22,6 +22,30 @@ CAMERA_INFO = []    # if a file is not provided, replace this with camera info
 # update camera (i.e. flip upside_down & shift up via z-axis)
 UPDATE_CAMERA = False
 
+# folder with the shared pose modules (train_test_nerf)
+TRAIN_TEST_NERF_PATH = '/Downloads/EndoscopyWithNerf/train_test_nerf'
+sys.path.append(TRAIN_TEST_NERF_PATH)
+from pose_transforms import FlipShift
+from depth_store import DepthStoreWriter
+
+# folder with render_planner.py; the cameras are read from RENDER_MANIFEST (written by
+# render_planner.py), or the serpentine grid of Nrows x Ncols is planned if it is None
+RENDER_SCRIPTS_PATH = '/Downloads/EndoscopyWithNerf/render_custom_frames_blender'
+RENDER_MANIFEST = None
+sys.path.append(RENDER_SCRIPTS_PATH)
+from render_planner import load_manifest, plan_path
+from render_shards import depth_store_path, merge_shards, render_shard, resume_depth_store, shard_name
+from pixel_pipeline import DepthChannel, FlipVertical, PixelReader, ProcessorChain
+
+# render_shards.py passes the shard manifest and the frames directory after '--', and --resume to skip
+# frames rendered by an earlier (e.g. interrupted) run, see render_shards.py:
+#   blender -b scene.blend --python renderFramesBlenderV2.py -- --manifest shard.json --frames-path frames --resume
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument('--manifest', type=str, default=RENDER_MANIFEST)
+arg_parser.add_argument('--frames-path', type=str, default=None)
+arg_parser.add_argument('--resume', action='store_true')
+script_args = arg_parser.parse_args(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+
 # FRAMES = 20
 FRAMES = 70
 
@@ -37,6 +61,14 @@ Ncols = 6
 RESULTS_PATH = '/Downloads/frames2_wball_llff'
 FRAMES_PATH = '/Downloads/frames2_wball_llff'
 
+# save all depth maps into one depth store (FRAMES_PATH/depth.depthstore, see train_test_nerf/depth_store.py)
+# instead of one r_XXX_depth92.npz per frame; DEPTH_COMPRESSION is None, 'zlib' or 'lz4'
+DEPTH_STORE = False
+DEPTH_COMPRESSION = None
+# the depth store index is written every DEPTH_FLUSH_FRAMES frames (one compressed chunk) and at the end,
+# on resume the frames after the last flush are rendered again
+DEPTH_FLUSH_FRAMES = 16
+
 # create excel with camera information
 CREATE_EXCEL = False
 bpy.context.scene.use_nodes = True
@@ -98,15 +130,9 @@ def listify_matrix(matrix):
 #    readXlsxInfo2Lst()
 
 def updateCamera(deltaDeg, deltaZ):
-    for i in range(len(CAMERA_INFO)):
-        cameraInfo = CAMERA_INFO[i]
-        rEuler = R.from_quat([cameraInfo[3], cameraInfo[4], cameraInfo[5], cameraInfo[6]]).as_euler('xyz', degrees=True)
-        rFlipped = R.from_euler('xyz', [rEuler[0], rEuler[1]+deltaDeg, rEuler[2]], degrees=True).as_quat()
-
-        newCameraInfo = CAMERA_INFO[i][:2]
-        newCameraInfo.extend([CAMERA_INFO[i][2] + deltaZ])
-        newCameraInfo.extend(rFlipped)
-        CAMERA_INFO[i] = newCameraInfo
+    # flip/shift all cameras at once, see train_test_nerf/pose_transforms.py
+    tranQuots = FlipShift(deltaDeg, deltaZ)(np.array(CAMERA_INFO, dtype=float))
+    CAMERA_INFO[:] = tranQuots.tolist()
 
 if UPDATE_CAMERA:
     updateCamera(180, 37)
@@ -184,72 +210,85 @@ scene.render.image_settings.file_format = FORMAT
 
 
 
-out_data['frames'] = []
-
 # set up path to store rendered frames
-fp = bpy.path.abspath(f"//{FRAMES_PATH}")
+fp = script_args.frames_path or bpy.path.abspath(f"//{FRAMES_PATH}")
 if not os.path.exists(fp):
     os.makedirs(fp)
 
-x_arr = np.linspace(-0.3, 0.3, Nrows)
-y_arr = np.linspace(-0.3, 0.3, Ncols)
-z_arr = np.linspace(8.2, 8.4, Ncols)
-
-
-for row_idx in range(Nrows):
-    for col_idx in range(Ncols):
-        
-        i = row_idx * Ncols + col_idx # calculate the frame_idx
-        
-        cur_y = y_arr[col_idx]
-        if row_idx %2 == 0:
-            cur_x = x_arr[row_idx]
-            cur_z = z_arr[col_idx]
-        else:
-            cur_x = x_arr[row_idx] - col_idx * (x_arr[1]- x_arr[0])
-            cur_z = z_arr[col_idx]
-        
-        
-        cam.location = (cur_x, cur_y, cur_z)
-    #    cam.rotation_quaternion = (CAMERA_INFO[i][6], CAMERA_INFO[i][3], CAMERA_INFO[i][4], CAMERA_INFO[i][5]) # (w,x,y,z)
-
-        print("Rendering Frame {}...".format(i))
-        #print("\tRotation in quaternion (x,y,z,w):\n\t{}\n".format(CAMERA_INFO[i][3:]))
-        scene.render.filepath = fp + '/r_{0:03d}'.format(i)
-        bpy.ops.render.render(write_still=True)  # render still
-        
-        
-        #render original depth values to npy file.
-        
-        pixels = np.array(bpy.data.images['Viewer Node'].pixels)
-        width = bpy.context.scene.render.resolution_x 
-        height = bpy.context.scene.render.resolution_y
-        
-        #reshaping into image array 4 channel (rgbz)
-        image = pixels.reshape(height,width,4)
-        
-        #depth analysis...
-        depth_array = np.asarray(image[:,:,3])
-        print(np.max(depth_array), np.min(depth_array))
-        
-        print(depth_array.shape)
-        #np_depth_path = dir_cur + dir_dataset + str(s_iter).zfill(6)+"_"+ str(f_iter).zfill(2) + 'Depth.npy'
+if script_args.manifest:
+    manifest = load_manifest(script_args.manifest)
+else:
+    manifest = plan_path('serpentine', Nrows, Ncols)
+shard = shard_name(manifest)
+
+# the viewer node pixels are copied into one reused float32 buffer, the depth (alpha) is a flipped view of it
+pixel_reader = PixelReader(resolution_y, resolution_x)
+depth_pipeline = ProcessorChain(DepthChannel(), FlipVertical())
+
+if DEPTH_STORE:
+    depth_writer = DepthStoreWriter(depth_store_path(fp, shard), resolution_y, resolution_x, compression=DEPTH_COMPRESSION,
+                                    chunkFrames=DEPTH_FLUSH_FRAMES, append=script_args.resume)
+    if script_args.resume:
+        # keep the depth maps of finished frames, frames after them are rendered again
+        resume_depth_store(depth_writer, fp, shard)
+
+
+def render_frame(job):
+    i = job['index']
+
+    cam.location = job['location']
+    if job['rotation_quaternion'] is not None:
+        # posed camera (e.g. from a pose file), not aimed by the constraint
+        cam_constraint.mute = True
+        cam.rotation_mode = 'QUATERNION'
+        cam.rotation_quaternion = job['rotation_quaternion'] # (w,x,y,z)
+    else:
+        cam_constraint.mute = False
+
+    print("Rendering Frame {}...".format(i))
+    #print("\tRotation in quaternion (x,y,z,w):\n\t{}\n".format(CAMERA_INFO[i][3:]))
+    scene.render.filepath = fp + '/' + job['name']
+    bpy.ops.render.render(write_still=True)  # render still
+
+    #render original depth values to npy file.
+
+    depth_array = depth_pipeline(pixel_reader.read(bpy.data.images['Viewer Node']))
+
+    #depth analysis...
+    print(np.max(depth_array), np.min(depth_array))
+
+    print(depth_array.shape)
+    #np_depth_path = dir_cur + dir_dataset + str(s_iter).zfill(6)+"_"+ str(f_iter).zfill(2) + 'Depth.npy'
+    if DEPTH_STORE:
+        # the flipped view is copied once, into the store
+        depth_writer.append(depth_array, job['name'])
+        if len(depth_writer.names) % DEPTH_FLUSH_FRAMES == 0:
+            depth_writer.flush()
+    else:
         np_depth_path = scene.render.filepath + '_depth92.npz'
-        depth_array = np.array(depth_array[::-1, ...])
+        depth_array = np.array(depth_array)
         np.savez_compressed(np_depth_path, depth=depth_array)
-        
-        
-        #saving the camera parameters
-        quat = cam.rotation_quaternion
-        print(quat)
-
-        frame_data = {
-            'file_path': scene.render.filepath,
-            'transform_matrix': listify_matrix(cam.matrix_world)
-        }
-    
 
-        out_data['frames'].append(frame_data)
+    #saving the camera parameters
+    quat = cam.rotation_quaternion
+    print(quat)
+
+    frame_data = {
+        'file_path': scene.render.filepath,
+        'transform_matrix': listify_matrix(cam.matrix_world)
+    }
+
+    return frame_data
+
+
+try:
+    rendered, skipped = render_shard(manifest, fp, render_frame, header=out_data, resume=script_args.resume)
+finally:
+    # also keeps the depth maps of the frames rendered before a failure
+    if DEPTH_STORE:
+        depth_writer.close()
+print("Rendered {} frames, skipped {} finished frames".format(rendered, skipped))
 
-with open(fp + '/' + 'transforms.json', 'w') as out_file:
-         json.dump(out_data, out_file, indent=4)
+# a sharded render is merged by render_shards.py once all shards are done
+if 'shard' not in manifest:
+    merge_shards(fp, [shard])
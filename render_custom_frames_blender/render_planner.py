@@ -0,0 +1,305 @@
+'''
+
+render_planner.py
+
+Plans the camera path of a Blender render job without Blender. The planner
+only needs numpy: it computes every camera location (and rotation, for poses
+imported from a pose file), writes them to a job manifest, and
+renderFramesBlenderV2.py renders the frames listed in the manifest. Large
+jobs can so be checked, deduplicated and split before Blender is started.
+
+Camera paths:
+
+    grid:       Nrows x Ncols raster, x over the rows, y and z over the columns
+    serpentine: the grid of renderFramesBlenderV2.py, where the odd rows step
+                back in x along the columns
+    spline:     --frames cameras spaced evenly along a Catmull-Rom spline
+                through the control points of --control-points
+    pose_file:  the poses of an EndoSLAM .xlsx/.csv file (read through its
+                pose cache), with their rotations
+
+grid, serpentine and spline cameras are aimed by the TRACK_TO constraint of
+the Blender script, pose_file cameras carry a rotation_quaternion (w, x, y, z).
+
+A manifest is a json file:
+
+    {"version": 1, "path": "serpentine", "params": {...},
+     "frames": [{"index": 0, "name": "r_000", "location": [x, y, z],
+                 "rotation_quaternion": null}, ...]}
+
+Flags:
+    --path (grid, serpentine, spline or pose_file)
+    --rows, --cols (Size of grid and serpentine paths)
+    --x-range, --y-range, --z-range (Ranges of grid and serpentine paths)
+    --control-points (Text file with one x y z control point per line, spline path)
+    --frames (Number of spline cameras)
+    --xlsx / --csv (Pose file of the pose_file path)
+    --start, --stop, --step (Poses of the pose file to render)
+    --flip-shift (Degrees and z shift applied to the pose file poses, as updateCamera)
+    --dedupe (Drop cameras within this distance of an earlier camera with the same rotation)
+    --shards (Split the manifest into this many manifests)
+    --output (Manifest file to write, shards are written as <name>_shardXX.json)
+
+'''
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+TRAIN_TEST_NERF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train_test_nerf')
+
+MANIFEST_VERSION = 1
+PATHS = ('grid', 'serpentine', 'spline', 'pose_file')
+
+# defaults of renderFramesBlenderV2.py
+NROWS = 5
+NCOLS = 6
+X_RANGE = (-0.3, 0.3)
+Y_RANGE = (-0.3, 0.3)
+Z_RANGE = (8.2, 8.4)
+NAME_FORMAT = 'r_{0:03d}'
+
+
+def _grid_axes(Nrows, Ncols, xRange, yRange, zRange):
+    x_arr = np.linspace(xRange[0], xRange[1], Nrows)
+    y_arr = np.linspace(yRange[0], yRange[1], Ncols)
+    z_arr = np.linspace(zRange[0], zRange[1], Ncols)
+    row_idx, col_idx = np.meshgrid(np.arange(Nrows), np.arange(Ncols), indexing='ij')
+    return x_arr, y_arr, z_arr, row_idx.ravel(), col_idx.ravel()
+
+def grid_path(Nrows=NROWS, Ncols=NCOLS, xRange=X_RANGE, yRange=Y_RANGE, zRange=Z_RANGE):
+    # (Nrows*Ncols, 3) locations, frame i = row_idx * Ncols + col_idx
+    x_arr, y_arr, z_arr, row_idx, col_idx = _grid_axes(Nrows, Ncols, xRange, yRange, zRange)
+    return np.stack((x_arr[row_idx], y_arr[col_idx], z_arr[col_idx]), axis=1)
+
+def serpentine_path(Nrows=NROWS, Ncols=NCOLS, xRange=X_RANGE, yRange=Y_RANGE, zRange=Z_RANGE):
+    # same locations as the loop of renderFramesBlenderV2.py
+    x_arr, y_arr, z_arr, row_idx, col_idx = _grid_axes(Nrows, Ncols, xRange, yRange, zRange)
+    dx = x_arr[1] - x_arr[0] if Nrows > 1 else 0.
+    cur_x = np.where(row_idx % 2 == 0, x_arr[row_idx], x_arr[row_idx] - col_idx * dx)
+    return np.stack((cur_x, y_arr[col_idx], z_arr[col_idx]), axis=1)
+
+def spline_path(controlPoints, numFrames, samplesPerSegment=64):
+    '''
+    numFrames locations spaced evenly (by arc length) along a uniform
+    Catmull-Rom spline through the (K, 3) control points.
+    '''
+    points = np.asarray(controlPoints, dtype=float).reshape(-1, 3)
+    if len(points) < 2:
+        raise ValueError('a spline needs at least 2 control points, got {}'.format(len(points)))
+
+    # repeat the end points so the spline passes through all control points
+    padded = np.concatenate((points[:1], points, points[-1:]))
+    p0, p1, p2, p3 = (padded[k:k + len(points) - 1] for k in range(4))
+
+    t = np.linspace(0., 1., samplesPerSegment, endpoint=False)[None, :, None]
+    dense = 0.5 * (2 * p1[:, None] + (p2 - p0)[:, None] * t
+                   + (2 * p0 - 5 * p1 + 4 * p2 - p3)[:, None] * t ** 2
+                   + (3 * p1 - p0 - 3 * p2 + p3)[:, None] * t ** 3)
+    dense = np.concatenate((dense.reshape(-1, 3), points[-1:]))
+
+    arcLength = np.concatenate(([0.], np.cumsum(np.linalg.norm(np.diff(dense, axis=0), axis=1))))
+    targets = np.linspace(0., arcLength[-1], numFrames)
+    return np.stack([np.interp(targets, arcLength, dense[:, k]) for k in range(3)], axis=1)
+
+def pose_file_path(posePath, start=0, stop=None, step=1, flipShift=None, useCache=True):
+    '''
+    Locations, Blender (w, x, y, z) quaternions and row indices of the poses
+    start:stop:step (python slice semantics, negative values count from the
+    end) of an EndoSLAM pose file. flipShift=(deltaDeg, deltaZ) applies
+    updateCamera first.
+    '''
+    sys.path.append(TRAIN_TEST_NERF_PATH)
+    from convert2npy import CSV_POSE_COLS, XLSX_POSE_COLS
+    from pose_cache import load_pose_table
+
+    table = load_pose_table(posePath, useCache=useCache)
+    poseCols = CSV_POSE_COLS if posePath.lower().endswith('.csv') else XLSX_POSE_COLS
+    indices = np.array(range(len(table))[start:stop:step], dtype=int)
+    tranQuots = np.asarray(table[indices, poseCols], dtype=float).reshape(-1, 7)
+
+    if flipShift is not None:
+        from pose_transforms import FlipShift
+        tranQuots = FlipShift(*flipShift)(tranQuots)
+
+    # (x, y, z, w) -> (w, x, y, z)
+    return tranQuots[:, :3], tranQuots[:, [6, 3, 4, 5]], indices
+
+def make_manifest(locations, quaternions=None, path='custom', params=None, indices=None, nameFormat=NAME_FORMAT):
+    locations = np.asarray(locations, dtype=float).reshape(-1, 3)
+    indices = np.arange(len(locations)) if indices is None else np.asarray(indices, dtype=int)
+
+    frames = []
+    for k, i in enumerate(indices.tolist()):
+        frames.append({
+            'index': i,
+            'name': nameFormat.format(i),
+            'location': locations[k].tolist(),
+            'rotation_quaternion': None if quaternions is None else np.asarray(quaternions[k], dtype=float).tolist(),
+        })
+    return {'version': MANIFEST_VERSION, 'path': path, 'params': params or {}, 'frames': frames}
+
+def plan_path(path, Nrows=NROWS, Ncols=NCOLS, xRange=X_RANGE, yRange=Y_RANGE, zRange=Z_RANGE,
+              controlPoints=None, numFrames=None, posePath=None, start=0, stop=None, step=1, flipShift=None):
+    if path not in PATHS:
+        raise ValueError('unknown camera path: {}'.format(path))
+
+    if path in ('grid', 'serpentine'):
+        params = {'rows': Nrows, 'cols': Ncols, 'x_range': list(xRange), 'y_range': list(yRange), 'z_range': list(zRange)}
+        pathFn = grid_path if path == 'grid' else serpentine_path
+        return make_manifest(pathFn(Nrows, Ncols, xRange, yRange, zRange), path=path, params=params)
+
+    if path == 'spline':
+        if controlPoints is None or not numFrames:
+            raise ValueError('the spline path needs control points and a number of frames')
+        params = {'control_points': np.asarray(controlPoints, dtype=float).tolist(), 'frames': numFrames}
+        return make_manifest(spline_path(controlPoints, numFrames), path=path, params=params)
+
+    if posePath is None:
+        raise ValueError('the pose_file path needs a pose file')
+    locations, quaternions, indices = pose_file_path(posePath, start, stop, step, flipShift)
+    params = {'pose_file': posePath, 'start': start, 'stop': stop, 'step': step,
+              'flip_shift': list(flipShift) if flipShift is not None else None}
+    # frames keep the index of their pose in the file
+    return make_manifest(locations, quaternions, path=path, params=params, indices=indices)
+
+def frame_arrays(manifest):
+    # (N, 3) locations and (N, 4) quaternions (nan for TRACK_TO cameras) of a manifest
+    frames = manifest['frames']
+    locations = np.array([frame['location'] for frame in frames], dtype=float).reshape(-1, 3)
+    quaternions = np.full((len(frames), 4), np.nan)
+    for k, frame in enumerate(frames):
+        if frame['rotation_quaternion'] is not None:
+            quaternions[k] = frame['rotation_quaternion']
+    return locations, quaternions
+
+def validate_manifest(manifest):
+    # raises ValueError on a manifest the Blender script cannot render
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError('unsupported manifest version {}'.format(manifest.get('version')))
+    frames = manifest['frames']
+    names = [frame['name'] for frame in frames]
+    if len(set(names)) != len(names):
+        raise ValueError('frame names are not unique')
+
+    locations, quaternions = frame_arrays(manifest)
+    if not np.isfinite(locations).all():
+        raise ValueError('frames with non-finite locations: {}'.format(np.flatnonzero(~np.isfinite(locations).all(axis=1)).tolist()))
+    hasRotation = ~np.isnan(quaternions).all(axis=1)
+    norms = np.linalg.norm(quaternions[hasRotation], axis=1)
+    if not np.allclose(norms, 1., atol=1e-3):
+        raise ValueError('frames with non-unit quaternions: {}'.format(np.flatnonzero(hasRotation)[np.abs(norms - 1.) > 1e-3].tolist()))
+
+def _same_rotation(q, others, atol=1e-6):
+    # (K,) True where others hold the rotation of q (q and -q are the same), nan rows are TRACK_TO cameras
+    tracked = np.isnan(others).all(axis=1)
+    if np.isnan(q).all():
+        return tracked
+    return ~tracked & (np.abs(np.nan_to_num(others) @ q) >= 1. - atol)
+
+def dedupe_manifest(manifest, tolerance=1e-6):
+    '''
+    Drops every camera within tolerance (euclidean distance) of an earlier
+    kept camera with the same rotation. Kept frames keep their index and
+    name, so outputs match those of the full job.
+    '''
+    locations, quaternions = frame_arrays(manifest)
+    # kept cameras by grid cell of size tolerance, a camera only has to be compared with the 27 cells around it
+    cells = np.floor(locations / tolerance).astype(np.int64)
+    keptByCell = {}
+    keep = []
+    for k, cell in enumerate(map(tuple, cells)):
+        duplicate = False
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            kept = keptByCell.get((cell[0] + offset[0], cell[1] + offset[1], cell[2] + offset[2]))
+            if kept is None:
+                continue
+            close = np.linalg.norm(locations[kept] - locations[k], axis=1) <= tolerance
+            if np.any(close & _same_rotation(quaternions[k], quaternions[kept])):
+                duplicate = True
+                break
+        if not duplicate:
+            keptByCell.setdefault(cell, []).append(k)
+            keep.append(k)
+
+    deduped = dict(manifest)
+    deduped['frames'] = [manifest['frames'][k] for k in keep]
+    deduped['params'] = dict(manifest['params'], dedupe_tolerance=tolerance)
+    return deduped
+
+def split_manifest(manifest, numShards):
+    # numShards manifests of consecutive frames, sizes differ by at most one
+    shards = []
+    for shardIdx, frameIdx in enumerate(np.array_split(np.arange(len(manifest['frames'])), numShards)):
+        shard = dict(manifest)
+        shard['frames'] = [manifest['frames'][k] for k in frameIdx]
+        shard['shard'] = [shardIdx, numShards]
+        shards.append(shard)
+    return shards
+
+def save_manifest(manifest, manifestPath):
+    tmpPath = manifestPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmpPath, manifestPath)
+
+def load_manifest(manifestPath):
+    with open(manifestPath) as f:
+        manifest = json.load(f)
+    validate_manifest(manifest)
+    return manifest
+
+def shard_path(manifestPath, shardIdx):
+    root, ext = os.path.splitext(manifestPath)
+    return '{}_shard{:02d}{}'.format(root, shardIdx, ext or '.json')
+
+def main(args):
+    if args.path is None:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    controlPoints = np.loadtxt(args.control_points, ndmin=2) if args.control_points else None
+    manifest = plan_path(args.path, args.rows, args.cols, args.x_range, args.y_range, args.z_range,
+                         controlPoints, args.frames, args.xlsx or args.csv, args.start, args.stop, args.step,
+                         args.flip_shift)
+    numPlanned = len(manifest['frames'])
+    if args.dedupe:
+        manifest = dedupe_manifest(manifest, args.dedupe)
+    validate_manifest(manifest)
+    print('planned {} frames, {} after dedupe'.format(numPlanned, len(manifest['frames'])))
+
+    if args.shards > 1:
+        for shardIdx, shard in enumerate(split_manifest(manifest, args.shards)):
+            save_manifest(shard, shard_path(args.output, shardIdx))
+            print('shard {}: {} frames -> {}'.format(shardIdx, len(shard['frames']), shard_path(args.output, shardIdx)))
+    else:
+        save_manifest(manifest, args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str, choices=PATHS, help='Camera path to plan')
+    parser.add_argument('--rows', type=int, default=NROWS, help='Number of rows of grid and serpentine paths')
+    parser.add_argument('--cols', type=int, default=NCOLS, help='Number of columns of grid and serpentine paths')
+    parser.add_argument('--x-range', type=float, nargs=2, default=X_RANGE, help='x range over the rows')
+    parser.add_argument('--y-range', type=float, nargs=2, default=Y_RANGE, help='y range over the columns')
+    parser.add_argument('--z-range', type=float, nargs=2, default=Z_RANGE, help='z range over the columns')
+    parser.add_argument('--control-points', type=str, help='Text file with one x y z control point per line')
+    parser.add_argument('--frames', type=int, default=None, help='Number of spline cameras')
+    parser.add_argument('--xlsx', type=str, help='Path to poses excel file')
+    parser.add_argument('--csv', type=str, help='Path to poses csv file')
+    parser.add_argument('--start', type=int, default=0, help='Index of the first pose to render')
+    parser.add_argument('--stop', type=int, default=None, help='Index after the last pose to render')
+    parser.add_argument('--step', type=int, default=1, help='Render every step-th pose')
+    parser.add_argument('--flip-shift', type=float, nargs=2, default=None, help='Degrees and z shift of updateCamera')
+    parser.add_argument('--dedupe', type=float, default=None, help='Drop cameras within this distance of an earlier camera')
+    parser.add_argument('--shards', type=int, default=1, help='Split the manifest into this many manifests')
+    parser.add_argument('--output', type=str, default='render_manifest.json', help='Manifest file to write')
+
+    args = parser.parse_args()
+
+    main(args)
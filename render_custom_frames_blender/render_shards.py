@@ -0,0 +1,265 @@
+'''
+
+render_shards.py
+
+Renders a job manifest (see render_planner.py) with several Blender
+processes at once, and makes rendering resumable.
+
+The manifest is split into --shards shard manifests and one Blender process
+renders each of them (renderFramesBlenderV2.py, with the shard manifest
+passed after '--'). Every finished frame is checkpointed by appending its
+transforms.json entry to <frames>/<shard>.frames.jsonl (see
+transforms_writer.py).
+Frames that are in the checkpoint and whose image exists are skipped, so a
+failed or killed render is resumed by running the same command again with
+--resume (forwarded to renderFramesBlenderV2.py and to the fake workers). When
+all shards are done, the checkpoints are merged into one transforms.json
+(frames in index order) and the per-shard depth stores into
+depth.depthstore.
+
+The rendering of a frame is passed to render_shard as a function, so the
+orchestration does not need Blender: with --fake the workers are python
+processes writing empty images (FakeRenderer).
+
+Flags:
+    --manifest (Job manifest written by render_planner.py)
+    --shards (Number of Blender processes)
+    --output (Frames directory, FRAMES_PATH of the Blender script)
+    --blender (Blender executable)
+    --blend-file (Scene to render)
+    --script (Render script, default renderFramesBlenderV2.py next to this file)
+    --resume (Skip the frames finished by an earlier run)
+    --merge-only (Only merge the checkpoints of a previous run, the shards of
+                  --manifest/--shards or else of the last launch)
+    --fake (Use fake python workers instead of Blender)
+    --worker (Render one shard manifest in this process with the fake renderer)
+
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from render_planner import load_manifest, save_manifest, shard_path, split_manifest
+from transforms_writer import FRAMES_SUFFIX, TransformsWriter, finalize_transforms, read_frames, rewrite_frames
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SCRIPT_DIR, '..', 'train_test_nerf'))
+from depth_store import merge_depth_stores
+
+CHECKPOINT_SUFFIX = FRAMES_SUFFIX
+IMAGE_EXT = '.png'
+UNSHARDED = 'all'
+SHARDS_FILE = 'shards.json'
+
+
+def shard_name(manifest):
+    return 'shard_{:02d}'.format(manifest['shard'][0]) if 'shard' in manifest else UNSHARDED
+
+def shard_names(manifest, numShards):
+    # names of the shards launch_shards renders manifest in
+    return [shard_name(shard) for shard in split_manifest(manifest, numShards)]
+
+def save_shard_names(outputDir, shardNames):
+    # the shards of the last launch, --merge-only merges these
+    shardDir = os.path.join(outputDir, 'shards')
+    os.makedirs(shardDir, exist_ok=True)
+    tmpPath = os.path.join(shardDir, SHARDS_FILE + '.tmp')
+    with open(tmpPath, 'w') as f:
+        json.dump(shardNames, f)
+    os.replace(tmpPath, os.path.join(shardDir, SHARDS_FILE))
+
+def load_shard_names(outputDir):
+    shardsPath = os.path.join(outputDir, 'shards', SHARDS_FILE)
+    if not os.path.exists(shardsPath):
+        raise IOError('no shard list at {}, pass --manifest and --shards of the render'.format(shardsPath))
+    with open(shardsPath) as f:
+        return json.load(f)
+
+def checkpoint_path(outputDir, shardName):
+    return os.path.join(outputDir, shardName + CHECKPOINT_SUFFIX)
+
+def depth_store_path(outputDir, shardName):
+    if shardName == UNSHARDED:
+        return os.path.join(outputDir, 'depth.depthstore')
+    return os.path.join(outputDir, 'depth_{}.depthstore'.format(shardName))
+
+def load_checkpoint(checkpointPath):
+    # {'header': {...}, 'frames': {name: {'index': i, 'frame': transforms.json entry}}}
+    if not os.path.exists(checkpointPath):
+        return {'header': {}, 'frames': {}}
+    header, entries = read_frames(checkpointPath)
+    return {'header': header, 'frames': entries}
+
+def _image_exists(outputDir, name, imageExt=IMAGE_EXT):
+    return os.path.exists(os.path.join(outputDir, name + imageExt))
+
+def is_done(job, checkpoint, outputDir, imageExt=IMAGE_EXT):
+    return job['name'] in checkpoint['frames'] and _image_exists(outputDir, job['name'], imageExt)
+
+def resume_depth_store(depthWriter, outputDir, shardName, imageExt=IMAGE_EXT):
+    '''
+    Keeps the depth maps of the finished frames at the start of a reopened
+    depth store (DepthStoreWriter(..., append=True)) and drops the rest. Frames
+    whose depth map was dropped are removed from the checkpoint, so they are
+    rendered (and appended) again. The store can only be cut between chunks,
+    so the finished frames of a partly finished chunk are rendered again too.
+    '''
+    checkpointPath = checkpoint_path(outputDir, shardName)
+    checkpoint = load_checkpoint(checkpointPath)
+
+    numFinished = 0
+    while numFinished < len(depthWriter.names) and depthWriter.names[numFinished] in checkpoint['frames'] \
+            and _image_exists(outputDir, depthWriter.names[numFinished], imageExt):
+        numFinished += 1
+    numKept = 0
+    for _, _, count in depthWriter.chunks:
+        if numKept + count > numFinished:
+            break
+        numKept += count
+    depthWriter.truncate(numKept)
+
+    kept = set(depthWriter.names)
+    if os.path.exists(checkpointPath) and len(kept) < len(checkpoint['frames']):
+        rewrite_frames(checkpointPath, checkpoint['header'],
+                       {name: entry for name, entry in checkpoint['frames'].items() if name in kept})
+    return numKept
+
+def render_shard(manifest, outputDir, renderFrame, header=None, resume=True, imageExt=IMAGE_EXT):
+    '''
+    Renders the frames of manifest that are not done yet. renderFrame(job)
+    renders one frame and returns its transforms.json entry.
+
+    Outputs:
+        (number of rendered frames, number of skipped frames)
+    '''
+    checkpointPath = checkpoint_path(outputDir, shard_name(manifest))
+    checkpoint = load_checkpoint(checkpointPath) if resume else {'header': {}, 'frames': {}}
+
+    rendered = skipped = 0
+    with TransformsWriter(checkpointPath, header, resume) as writer:
+        for job in manifest['frames']:
+            if resume and is_done(job, checkpoint, outputDir, imageExt):
+                skipped += 1
+                continue
+            writer.append(renderFrame(job), job['name'], job['index'])
+            rendered += 1
+    return rendered, skipped
+
+def merge_shards(outputDir, shardNames, transformsPath=None):
+    '''
+    One transforms.json from the checkpoints of shardNames (the shards of one
+    render, other checkpoints in outputDir, e.g. of an earlier shard count,
+    are ignored), plus one depth store if the shards wrote them. A frame in
+    more than one checkpoint raises ValueError.
+    '''
+    checkpointPaths = [checkpoint_path(outputDir, name) for name in shardNames]
+    missing = [path for path in checkpointPaths if not os.path.exists(path)]
+    if missing:
+        raise IOError('missing render checkpoints: {}'.format(', '.join(missing)))
+
+    out_data, names = finalize_transforms(checkpointPaths, transformsPath or os.path.join(outputDir, 'transforms.json'))
+
+    storePaths = [depth_store_path(outputDir, name) for name in shardNames if name != UNSHARDED]
+    if storePaths and all(os.path.exists(path) for path in storePaths):
+        merge_depth_stores(storePaths, depth_store_path(outputDir, UNSHARDED), names)
+    return out_data
+
+
+class FakeRenderer:
+    # stands in for Blender: writes an empty image and returns the transforms.json entry of the camera location
+    def __init__(self, outputDir, failAfter=None):
+        self.outputDir = outputDir
+        self.failAfter = failAfter
+        self.rendered = []
+
+    def __call__(self, job):
+        if self.failAfter is not None and len(self.rendered) == self.failAfter:
+            raise RuntimeError('fake render failure at {}'.format(job['name']))
+        filePath = os.path.join(self.outputDir, job['name'])
+        open(filePath + IMAGE_EXT, 'wb').close()
+        self.rendered.append(job['name'])
+
+        x, y, z = job['location']
+        return {'file_path': filePath,
+                'transform_matrix': [[1., 0., 0., x], [0., 1., 0., y], [0., 0., 1., z], [0., 0., 0., 1.]]}
+
+
+def blender_command(blender, blendFile, script, manifestPath, outputDir, resume=False):
+    command = [blender, '-b', blendFile, '--python', script, '--', '--manifest', manifestPath, '--frames-path', outputDir]
+    return command + ['--resume'] if resume else command
+
+def fake_command(manifestPath, outputDir, resume=False):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', manifestPath, '--output', outputDir]
+    return command + ['--resume'] if resume else command
+
+def launch_shards(manifest, numShards, outputDir, workerCommand):
+    '''
+    Writes the shard manifests to <outputDir>/shards and runs
+    workerCommand(shardManifestPath, outputDir) for all of them in parallel.
+
+    Outputs:
+        return code of every shard
+    '''
+    shardDir = os.path.join(outputDir, 'shards')
+    os.makedirs(shardDir, exist_ok=True)
+    save_shard_names(outputDir, shard_names(manifest, numShards))
+
+    processes = []
+    for shardIdx, shard in enumerate(split_manifest(manifest, numShards)):
+        path = shard_path(os.path.join(shardDir, 'manifest.json'), shardIdx)
+        save_manifest(shard, path)
+        processes.append(subprocess.Popen(workerCommand(path, outputDir)))
+    return [process.wait() for process in processes]
+
+def main(args):
+    if args.worker:
+        rendered, skipped = render_shard(load_manifest(args.worker), args.output, FakeRenderer(args.output),
+                                         resume=args.resume)
+        print('{}: rendered {}, skipped {}'.format(args.worker, rendered, skipped))
+        return
+
+    if not args.merge_only:
+        if not args.manifest or not (args.fake or args.blend_file):
+            parser.print_help(sys.stderr)
+            sys.exit(1)
+        if args.fake:
+            workerCommand = lambda path, outputDir: fake_command(path, outputDir, args.resume)
+        else:
+            workerCommand = lambda path, outputDir: blender_command(args.blender, args.blend_file, args.script, path, outputDir,
+                                                                    args.resume)
+
+        os.makedirs(args.output, exist_ok=True)
+        returnCodes = launch_shards(load_manifest(args.manifest), args.shards, args.output, workerCommand)
+        failed = [shardIdx for shardIdx, code in enumerate(returnCodes) if code != 0]
+        if failed:
+            print('shards {} failed, run the same command with --resume to resume them'.format(failed))
+            sys.exit(1)
+
+    if args.manifest:
+        shardNames = shard_names(load_manifest(args.manifest), args.shards)
+    else:
+        shardNames = load_shard_names(args.output)
+    out_data = merge_shards(args.output, shardNames)
+    print('merged {} frames into {}'.format(len(out_data['frames']), os.path.join(args.output, 'transforms.json')))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--manifest', type=str, help='Job manifest written by render_planner.py')
+    parser.add_argument('--shards', type=int, default=os.cpu_count(), help='Number of Blender processes')
+    parser.add_argument('--output', type=str, default=os.getcwd(), help='Frames directory')
+    parser.add_argument('--blender', type=str, default='blender', help='Blender executable')
+    parser.add_argument('--blend-file', type=str, help='Scene to render')
+    parser.add_argument('--script', type=str, default=os.path.join(SCRIPT_DIR, 'renderFramesBlenderV2.py'),
+                        help='Render script run by Blender')
+    parser.add_argument('--resume', action='store_true', help='Skip the frames finished by an earlier run')
+    parser.add_argument('--merge-only', action='store_true', help='Only merge the checkpoints of a previous run')
+    parser.add_argument('--fake', action='store_true', help='Use fake python workers instead of Blender')
+    parser.add_argument('--worker', type=str, help='Render one shard manifest with the fake renderer')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,113 @@
+'''
+
+test_pixel_pipeline.py
+
+PixelReader and the pixel processors of pixel_pipeline.py against plain
+numpy on the pixels of a fake Blender image.
+
+    python -m pytest -q test_pixel_pipeline.py
+
+'''
+
+import numpy as np
+import pytest
+
+from pixel_pipeline import DepthChannel, Downsample, FlipVertical, PixelProcessor, PixelReader, ProcessorChain
+
+HEIGHT = 12
+WIDTH = 16
+
+
+class FakePixels:
+    # the part of Blender's pixel array interface used by PixelReader
+    def __init__(self, values, foreachGet=True):
+        self.values = np.asarray(values, dtype=np.float32).ravel()
+        if foreachGet:
+            self.foreach_get = self._foreach_get
+
+    def __len__(self):
+        return self.values.size
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def _foreach_get(self, out):
+        out[:] = self.values
+
+
+class FakeImage:
+    # stands in for a bpy.types.Image with (H, W, C) pixels, stored bottom row first like Blender
+    def __init__(self, pixels, foreachGet=True):
+        pixels = np.asarray(pixels, dtype=np.float32)
+        self.size = (pixels.shape[1], pixels.shape[0])
+        self.pixels = FakePixels(pixels, foreachGet)
+
+
+def synthetic_pixels(seed=0, height=HEIGHT, width=WIDTH):
+    return np.random.default_rng(seed).random((height, width, 4)).astype(np.float32)
+
+
+@pytest.mark.parametrize('foreachGet', [True, False])
+def test_reader(foreachGet):
+    pixels = synthetic_pixels()
+    reader = PixelReader(HEIGHT, WIDTH)
+    read = reader.read(FakeImage(pixels, foreachGet))
+    assert read.shape == (HEIGHT, WIDTH, 4) and read.dtype == np.float32
+    np.testing.assert_array_equal(read, pixels)
+
+def test_reader_reuses_buffer():
+    reader = PixelReader(HEIGHT, WIDTH)
+    buffer = reader.buffer
+    first = reader.read(FakeImage(synthetic_pixels(0)))
+    second = reader.read(FakeImage(synthetic_pixels(1)))
+    assert reader.buffer is buffer
+    assert np.shares_memory(first, buffer) and np.shares_memory(second, buffer)
+    # the first frame is overwritten by the next read
+    np.testing.assert_array_equal(first, synthetic_pixels(1))
+
+def test_reader_wrong_size():
+    with pytest.raises(ValueError):
+        PixelReader(HEIGHT, WIDTH).read(FakeImage(synthetic_pixels(height=HEIGHT + 1)))
+
+def test_depth_channel():
+    pixels = synthetic_pixels()
+    np.testing.assert_array_equal(DepthChannel()(pixels), pixels[:, :, 3])
+    np.testing.assert_array_equal(DepthChannel(0)(pixels), pixels[:, :, 0])
+    assert np.shares_memory(DepthChannel()(pixels), pixels)
+
+def test_flip_vertical():
+    pixels = synthetic_pixels()
+    np.testing.assert_array_equal(FlipVertical()(pixels), np.flipud(pixels))
+    assert np.shares_memory(FlipVertical()(pixels), pixels)
+
+@pytest.mark.parametrize('factor', [2, 3, 5])
+def test_downsample(factor):
+    pixels = synthetic_pixels()
+    strided = Downsample(factor)(pixels)
+    np.testing.assert_array_equal(strided, pixels[::factor, ::factor])
+    assert np.shares_memory(strided, pixels)
+
+    # mean of each full factor x factor block, the ragged border is dropped
+    rows, cols = HEIGHT // factor, WIDTH // factor
+    expected = np.empty((rows, cols, 4), dtype=np.float32)
+    for i in range(rows):
+        for j in range(cols):
+            expected[i, j] = pixels[i*factor:(i+1)*factor, j*factor:(j+1)*factor].mean(axis=(0, 1))
+    np.testing.assert_allclose(Downsample(factor, mode='mean')(pixels), expected, rtol=1e-6)
+
+def test_downsample_mode():
+    with pytest.raises(ValueError):
+        Downsample(2, mode='max')
+
+def test_chain():
+    pixels = synthetic_pixels()
+    reader = PixelReader(HEIGHT, WIDTH)
+    chain = ProcessorChain(DepthChannel(), FlipVertical(), Downsample(2))
+    depth = chain(reader.read(FakeImage(pixels)))
+    np.testing.assert_array_equal(depth, np.flipud(pixels[:, :, 3])[::2, ::2])
+    assert np.shares_memory(depth, reader.buffer)
+    np.testing.assert_array_equal(ProcessorChain()(pixels), pixels)
+
+def test_processor_needs_call():
+    with pytest.raises(TypeError):
+        PixelProcessor()
@@ -0,0 +1,205 @@
+'''
+
+test_render_planner.py
+
+Planning, validating, deduplicating and splitting render manifests, and
+rendering a planned manifest with renderFramesBlenderV2.py against a stub
+bpy module (no Blender needed).
+
+    python -m pytest -q test_render_planner.py
+
+'''
+
+import csv
+import json
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from render_planner import (MANIFEST_VERSION, dedupe_manifest, frame_arrays, grid_path, load_manifest, make_manifest,
+                            plan_path, save_manifest, serpentine_path, split_manifest, validate_manifest)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+POSE_HEADER = ['trans_x', 'trans_y', 'trans_z', 'quot_x', 'quot_y', 'quot_z', 'quot_w']
+
+
+def serpentine_loop(Nrows, Ncols, xRange, yRange, zRange):
+    # camera locations of the original nested loop of renderFramesBlenderV2.py
+    x_arr = np.linspace(xRange[0], xRange[1], Nrows)
+    y_arr = np.linspace(yRange[0], yRange[1], Ncols)
+    z_arr = np.linspace(zRange[0], zRange[1], Ncols)
+    locations = []
+    for row in range(Nrows):
+        cur_x = x_arr[row]
+        for col in range(Ncols):
+            locations.append([cur_x, y_arr[col], z_arr[col]])
+            if row % 2 == 1:
+                cur_x -= x_arr[1] - x_arr[0]
+    return np.array(locations)
+
+@pytest.fixture
+def pose_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    quots = rng.normal(size=(20, 4))
+    quots /= np.linalg.norm(quots, axis=1, keepdims=True)
+    tranQuots = np.concatenate((np.arange(60, dtype=float).reshape(20, 3), quots), axis=1)
+    csvPath = os.path.join(str(tmp_path), 'poses.csv')
+    with open(csvPath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(POSE_HEADER)
+        writer.writerows(tranQuots.tolist())
+    return csvPath, tranQuots
+
+
+def test_grid_path():
+    locations = grid_path(3, 4, (0., 1.), (-1., 1.), (8., 9.))
+    assert locations.shape == (12, 3)
+    np.testing.assert_allclose(locations[4], [0.5, -1., 8.])
+    np.testing.assert_allclose(locations[-1], [1., 1., 9.])
+
+@pytest.mark.parametrize('rows, cols', [(5, 6), (4, 3), (1, 5)])
+def test_serpentine_path_matches_loop(rows, cols):
+    ranges = ((-0.3, 0.3), (-0.3, 0.3), (8.2, 8.4))
+    np.testing.assert_allclose(serpentine_path(rows, cols, *ranges), serpentine_loop(rows, cols, *ranges))
+
+def test_plan_spline():
+    controlPoints = [[0., 0., 0.], [1., 1., 0.], [2., 0., 1.]]
+    manifest = plan_path('spline', controlPoints=controlPoints, numFrames=25)
+    locations, quaternions = frame_arrays(manifest)
+    assert len(locations) == 25 and np.isnan(quaternions).all()
+    np.testing.assert_allclose(locations[0], controlPoints[0], atol=1e-9)
+    np.testing.assert_allclose(locations[-1], controlPoints[-1], atol=1e-9)
+    # evenly spaced along the spline
+    steps = np.linalg.norm(np.diff(locations, axis=0), axis=1)
+    assert steps.max() / steps.min() < 1.05
+
+def test_plan_errors():
+    with pytest.raises(ValueError):
+        plan_path('circle')
+    with pytest.raises(ValueError):
+        plan_path('spline', controlPoints=[[0., 0., 0.]], numFrames=5)
+    with pytest.raises(ValueError):
+        plan_path('pose_file')
+
+@pytest.mark.parametrize('start, stop, step', [(0, None, 1), (2, 11, 3), (-5, None, 1), (-8, -2, 2), (3, 100, 4)])
+def test_plan_pose_file(pose_csv, start, stop, step):
+    csvPath, tranQuots = pose_csv
+    manifest = plan_path('pose_file', posePath=csvPath, start=start, stop=stop, step=step)
+    validate_manifest(manifest)
+
+    expected = np.arange(len(tranQuots))[start:stop:step]
+    assert [frame['index'] for frame in manifest['frames']] == expected.tolist()
+    assert [frame['name'] for frame in manifest['frames']] == ['r_{0:03d}'.format(i) for i in expected]
+    locations, quaternions = frame_arrays(manifest)
+    np.testing.assert_allclose(locations, tranQuots[expected, :3])
+    np.testing.assert_allclose(quaternions, tranQuots[expected][:, [6, 3, 4, 5]])
+
+def test_validate_manifest():
+    manifest = make_manifest(grid_path(2, 2), path='grid')
+    validate_manifest(manifest)
+
+    broken = [dict(manifest, version=MANIFEST_VERSION + 1),
+              dict(manifest, frames=manifest['frames'] + manifest['frames'][:1]),
+              make_manifest([[0., 0., 0.], [np.nan, 0., 0.]]),
+              make_manifest([[0., 0., 0.]], [[1., 1., 0., 0.]])]
+    for bad in broken:
+        with pytest.raises(ValueError):
+            validate_manifest(bad)
+
+def test_save_load_manifest(tmp_path):
+    manifestPath = os.path.join(str(tmp_path), 'manifest.json')
+    manifest = plan_path('serpentine', 3, 3)
+    save_manifest(manifest, manifestPath)
+    assert load_manifest(manifestPath) == json.loads(json.dumps(manifest))
+
+def test_dedupe_by_distance():
+    tolerance = 0.1
+    # the first two cameras are 0.004 apart but in different tolerance cells
+    locations = [[0.098, 0., 0.], [0.102, 0., 0.], [0.5, 0., 0.], [0.5, 0.09, 0.], [0.5, 0.2, 0.]]
+    deduped = dedupe_manifest(make_manifest(locations, path='custom'), tolerance)
+    assert [frame['name'] for frame in deduped['frames']] == ['r_000', 'r_002', 'r_004']
+    assert [frame['index'] for frame in deduped['frames']] == [0, 2, 4]
+    assert deduped['params']['dedupe_tolerance'] == tolerance
+
+def test_dedupe_rotations():
+    quaternions = [[1., 0., 0., 0.], [-1., 0., 0., 0.], [0., 1., 0., 0.], [1., 0., 0., 0.]]
+    deduped = dedupe_manifest(make_manifest(np.zeros((4, 3)), quaternions), 0.1)
+    # -q is the same rotation as q
+    assert [frame['index'] for frame in deduped['frames']] == [0, 2]
+
+    # aimed (TRACK_TO) cameras are never the same as posed ones
+    manifest = make_manifest(np.zeros((2, 3)))
+    manifest['frames'][1]['rotation_quaternion'] = [1., 0., 0., 0.]
+    assert len(dedupe_manifest(manifest, 0.1)['frames']) == 2
+    assert len(dedupe_manifest(make_manifest(np.zeros((3, 3))), 0.1)['frames']) == 1
+
+@pytest.mark.parametrize('numShards', [1, 3, 7])
+def test_split_manifest(numShards):
+    manifest = plan_path('serpentine', 4, 5)
+    shards = split_manifest(manifest, numShards)
+    assert len(shards) == numShards
+    sizes = [len(shard['frames']) for shard in shards]
+    assert sum(sizes) == 20 and max(sizes) - min(sizes) <= 1
+    assert [shard['shard'] for shard in shards] == [[k, numShards] for k in range(numShards)]
+    assert [frame for shard in shards for frame in shard['frames']] == manifest['frames']
+    assert 'shard' not in manifest
+
+
+def stub_bpy(H, W, renders):
+    # the parts of bpy renderFramesBlenderV2.py touches, a render records the camera location and writes an empty image
+    bpy = mock.MagicMock()
+    bpy.context.scene.render.resolution_x = W
+    bpy.context.scene.render.resolution_y = H
+    viewer = mock.MagicMock()
+    viewer.pixels = np.random.default_rng(0).random(H * W * 4).astype(np.float32)
+    bpy.data.images = {'Viewer Node': viewer}
+    cam = mock.MagicMock()
+    cam.matrix_world = np.eye(4)
+    cam.data.angle_x = 0.69
+    cam.rotation_mode = 'XYZ'
+    bpy.data.objects.__getitem__.side_effect = lambda key: cam
+    bpy.context.scene.objects.__getitem__.side_effect = lambda key: cam
+
+    def render(**kwargs):
+        renders.append(list(cam.location))
+        open(bpy.context.scene.render.filepath + '.png', 'wb').close()
+    bpy.ops.render.render = render
+    return bpy
+
+def run_blender_script(manifestPath, framesPath, renders, extraArgs=()):
+    scriptPath = os.path.join(SCRIPT_DIR, 'renderFramesBlenderV2.py')
+    with open(scriptPath) as f:
+        source = f.read()
+    source = source.replace("'/Downloads/EndoscopyWithNerf/train_test_nerf'",
+                            repr(os.path.join(SCRIPT_DIR, '..', 'train_test_nerf')))
+    source = source.replace("'/Downloads/EndoscopyWithNerf/render_custom_frames_blender'", repr(SCRIPT_DIR))
+    source = source.replace('resolution_x = 640', 'resolution_x = 16').replace('resolution_y = 480', 'resolution_y = 12')
+
+    argv = ['blender', '--', '--manifest', manifestPath, '--frames-path', framesPath] + list(extraArgs)
+    with mock.patch.dict(sys.modules, {'bpy': stub_bpy(12, 16, renders)}), mock.patch.object(sys, 'argv', argv):
+        exec(compile(source, scriptPath, 'exec'), {'__name__': '__main__'})
+
+def test_blender_script_renders_manifest(tmp_path):
+    # the serpentine loop visits one camera location twice
+    manifest = dedupe_manifest(plan_path('serpentine', 3, 4), 1e-6)
+    assert len(manifest['frames']) == 11
+    manifestPath = os.path.join(str(tmp_path), 'manifest.json')
+    framesPath = os.path.join(str(tmp_path), 'frames')
+    save_manifest(manifest, manifestPath)
+
+    renders = []
+    run_blender_script(manifestPath, framesPath, renders)
+    locations, _ = frame_arrays(manifest)
+    np.testing.assert_allclose(renders, locations)
+    with open(os.path.join(framesPath, 'transforms.json')) as f:
+        frames = json.load(f)['frames']
+    assert [os.path.basename(frame['file_path']) for frame in frames] == [frame['name'] for frame in manifest['frames']]
+    assert len([name for name in os.listdir(framesPath) if name.endswith('_depth92.npz')]) == 11
+
+    # a resumed run skips the finished frames
+    renders = []
+    run_blender_script(manifestPath, framesPath, renders, ['--resume'])
+    assert renders == []
@@ -0,0 +1,123 @@
+'''
+
+transforms_writer.py
+
+Writes the frame metadata of a render while it is rendering, instead of
+collecting out_data['frames'] and dumping transforms.json after the last
+frame. Every frame is appended as one json line to a <name>.frames.jsonl
+file and flushed right away, so a crash loses at most the frame that was
+being rendered, and the writer keeps nothing in memory.
+
+    {"header": {"camera_fov_radians": ..., ...}}
+    {"name": "r_000", "index": 0, "frame": {"file_path": ..., "transform_matrix": ...}}
+    ...
+
+finalize_transforms turns one or more of these files into the NeRF
+transforms.json (header keys plus 'frames' in index order). It writes a
+temporary file first and renames it, so transforms.json is either the old or
+the complete new file. When a frame appears more than once (it was rendered
+again), the last line wins; a line cut off by a crash is ignored.
+
+Example:
+    with TransformsWriter(fp + '/all.frames.jsonl', header=out_data) as writer:
+        for i in ...:
+            writer.append(frame_data, 'r_{0:03d}'.format(i), i)
+    finalize_transforms([fp + '/all.frames.jsonl'], fp + '/transforms.json')
+
+'''
+
+import json
+import os
+
+FRAMES_SUFFIX = '.frames.jsonl'
+
+
+def _trim_partial_line(jsonlPath):
+    # drop a last line without newline, left by a crash in the middle of a write
+    with open(jsonlPath, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+class TransformsWriter:
+    def __init__(self, jsonlPath, header=None, resume=True, fsync=False):
+        # resume=True appends to the frames of an earlier run, fsync=True also survives power loss
+        if resume and os.path.exists(jsonlPath):
+            _trim_partial_line(jsonlPath)
+            self._file = open(jsonlPath, 'a')
+        else:
+            self._file = open(jsonlPath, 'w')
+        self.jsonlPath = jsonlPath
+        self.fsync = fsync
+        if header is not None:
+            self._write({'header': header})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def append(self, frame, name, index=None):
+        self._write({'name': name, 'index': index, 'frame': frame})
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_frames(jsonlPath):
+    '''
+    Outputs:
+        header: dict of the last header line
+        entries: {name: {'index': index, 'frame': frame}}, in the order the frames were first written
+    '''
+    header, entries = {}, {}
+    with open(jsonlPath) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            record = json.loads(line)
+            if 'header' in record:
+                header = record['header']
+            else:
+                entries[record['name']] = {'index': record['index'], 'frame': record['frame']}
+    return header, entries
+
+def rewrite_frames(jsonlPath, header, entries):
+    # replace a frames file, e.g. to forget frames that have to be rendered again
+    tmpPath = jsonlPath + '.tmp'
+    with TransformsWriter(tmpPath, header or None, resume=False) as writer:
+        for name, entry in entries.items():
+            writer.append(entry['frame'], name, entry['index'])
+    os.replace(tmpPath, jsonlPath)
+
+def finalize_transforms(jsonlPaths, transformsPath, indent=4):
+    # transforms.json from the frames files, frames without index keep the order they were written in
+    # a frame name may only be in one of the files
+    out_data, entries, sources = {}, {}, {}
+    for jsonlPath in jsonlPaths:
+        header, fileEntries = read_frames(jsonlPath)
+        out_data = out_data or header
+        duplicates = [name for name in fileEntries if name in sources]
+        if duplicates:
+            raise ValueError('frames {} are in both {} and {}'.format(duplicates[:5], sources[duplicates[0]], jsonlPath))
+        sources.update((name, jsonlPath) for name in fileEntries)
+        entries.update(fileEntries)
+
+    names = sorted(entries, key=lambda name: entries[name]['index'] if entries[name]['index'] is not None else float('inf'))
+
+    out_data = dict(out_data)
+    out_data['frames'] = [entries[name]['frame'] for name in names]
+
+    tmpPath = transformsPath + '.tmp'
+    with open(tmpPath, 'w') as out_file:
+        json.dump(out_data, out_file, indent=indent)
+    os.replace(tmpPath, transformsPath)
+    return out_data, names
@@ -0,0 +1,231 @@
+'''
+
+batch_convert.py
+
+Converts many EndoSLAM pose files (e.g. every trajectory of every organ and
+camera) into poses_bounds.npy files in parallel, using the conversion of
+convert2npy.py in a process pool.
+
+Each pose file <root>/<dirs>/<name>.xlsx (or .csv) is written to
+<output>/<dirs>/<name>/poses_bounds.npy; without --root (a --manifest alone)
+<root> is the deepest folder holding all pose files. Pose files that would
+share an output directory (e.g. a.xlsx and a.csv) are reported before
+anything is converted. Outputs that are newer than their
+pose file are skipped unless --force is given. A summary with the status,
+number of poses and conversion time of every file is written to
+<output>/batch_summary.csv and printed at the end.
+
+Only .xlsx/.csv files whose header row names the pose columns (trans_x ...
+quot_w) are converted; the --output directory is never searched, so it can
+be inside --root. The frame range of a conversion is recorded next to its
+output (batch_convert.json), an output converted with another
+--start/--stop/--step is converted again.
+
+Flags:
+    --root (Directory tree searched for .xlsx/.csv pose files)
+    --manifest (Text file with one pose file path per line, instead of --root)
+    --output (Directory for the converted trajectories)
+    --workers (Number of worker processes, default is the number of cores)
+    --start, --stop, --step (Frame range/stride to convert, default is the whole trajectory)
+    --force (Convert again even if the output is up to date)
+    --no-cache (Parse the pose files without using their pose cache)
+
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl as opx
+
+import convert2npy
+
+POSE_EXTENSIONS = ('.xlsx', '.csv')
+SUMMARY_FILE = 'batch_summary.csv'
+SUMMARY_FIELDS = ['source', 'output', 'status', 'poses', 'seconds', 'error']
+SELECTION_FILE = 'batch_convert.json'
+POSE_HEADER = ('trans_x', 'trans_y', 'trans_z', 'quot_x', 'quot_y', 'quot_z', 'quot_w')
+
+
+def read_header(posePath):
+    # first row of an excel/csv file as strings, [] if it cannot be read
+    try:
+        if posePath.lower().endswith('.csv'):
+            with open(posePath, newline='') as f:
+                return [cell.strip() for cell in next(csv.reader(f), [])]
+        workbook = opx.load_workbook(posePath, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(max_row=1, values_only=True):
+                return [str(cell).strip() for cell in row if cell is not None]
+            return []
+        finally:
+            workbook.close()
+    except Exception:
+        return []
+
+def has_pose_header(posePath):
+    header = read_header(posePath)
+    return all(name in header for name in POSE_HEADER)
+
+def find_pose_files(root, exclude=()):
+    # pose files under root, directories in exclude (e.g. the output directory) are not searched
+    excluded = {os.path.normcase(os.path.abspath(path)) for path in exclude}
+    posePaths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(dirname for dirname in dirnames
+                             if os.path.normcase(os.path.abspath(os.path.join(dirpath, dirname))) not in excluded)
+        for filename in sorted(filenames):
+            # skip excel lock files and files without the pose columns (e.g. a batch summary)
+            posePath = os.path.join(dirpath, filename)
+            if filename.lower().endswith(POSE_EXTENSIONS) and not filename.startswith('~$') and has_pose_header(posePath):
+                posePaths.append(posePath)
+    return posePaths
+
+def read_manifest(manifestPath):
+    # one pose file per line, relative paths are relative to the manifest, '#' starts a comment
+    baseDir = os.path.dirname(os.path.abspath(manifestPath))
+    posePaths = []
+    with open(manifestPath) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                posePaths.append(os.path.join(baseDir, line))
+    return posePaths
+
+def output_dir_for(posePath, root, outputDir):
+    relPath = os.path.relpath(posePath, root) if root else os.path.basename(posePath)
+    return os.path.join(outputDir, os.path.splitext(relPath)[0])
+
+def output_dirs(posePaths, root, outputDir):
+    # one output directory per pose file, raises before anything is converted if two files would share one
+    if root is None and posePaths:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(posePath)) for posePath in posePaths])
+    npyDirs = []
+    sources = {}
+    for posePath in posePaths:
+        if root and os.path.relpath(os.path.abspath(posePath), os.path.abspath(root)).startswith(os.pardir):
+            raise ValueError('{} is not under --root {}'.format(posePath, root))
+        npyDir = output_dir_for(posePath, root, outputDir)
+        key = os.path.normcase(os.path.abspath(npyDir))
+        if key in sources:
+            raise ValueError('{} and {} would both be converted to {}'.format(sources[key], posePath, npyDir))
+        sources[key] = posePath
+        npyDirs.append(npyDir)
+    return npyDirs
+
+def selection_of(start, stop, step):
+    return {'start': start, 'stop': stop, 'step': step}
+
+def is_up_to_date(posePath, npyDir, selection=None):
+    # newer than the pose file and converted with the same frame range
+    npyPath = os.path.join(npyDir, 'poses_bounds.npy')
+    if not (os.path.exists(npyPath) and os.path.getmtime(npyPath) >= os.path.getmtime(posePath)):
+        return False
+    if selection is None:
+        return True
+    try:
+        with open(os.path.join(npyDir, SELECTION_FILE)) as f:
+            return json.load(f) == selection
+    except (IOError, ValueError):
+        return False
+
+def write_selection(npyDir, selection):
+    tmpPath = os.path.join(npyDir, SELECTION_FILE + '.tmp')
+    with open(tmpPath, 'w') as f:
+        json.dump(selection, f)
+    os.replace(tmpPath, os.path.join(npyDir, SELECTION_FILE))
+
+def convert_one(job):
+    posePath, npyDir, start, stop, step, useCache = job
+    result = {'source': posePath, 'output': npyDir, 'status': 'converted', 'poses': 0, 'seconds': 0., 'error': ''}
+
+    begin = time.perf_counter()
+    try:
+        os.makedirs(npyDir, exist_ok=True)
+        if posePath.lower().endswith('.csv'):
+            posesBounds = convert2npy.convert_to_npy_csv(posePath, npyDir, start, stop, step, useCache=useCache)
+        else:
+            posesBounds = convert2npy.convert_to_npy(posePath, npyDir, start, stop, step, useCache=useCache)
+        write_selection(npyDir, selection_of(start, stop, step))
+        result['poses'] = len(posesBounds)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - begin
+    return result
+
+def batch_convert(posePaths, outputDir, root=None, workers=None, start=0, stop=None, step=1, force=False, useCache=True):
+    # returns one summary dict per pose file, in the order of posePaths
+    results = [None] * len(posePaths)
+    jobs, jobIdx = [], []
+    for i, (posePath, npyDir) in enumerate(zip(posePaths, output_dirs(posePaths, root, outputDir))):
+        if not force and is_up_to_date(posePath, npyDir, selection_of(start, stop, step)):
+            results[i] = {'source': posePath, 'output': npyDir, 'status': 'skipped', 'poses': '', 'seconds': 0., 'error': ''}
+        else:
+            jobs.append((posePath, npyDir, start, stop, step, useCache))
+            jobIdx.append(i)
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, result in zip(jobIdx, pool.map(convert_one, jobs)):
+                results[i] = result
+    return results
+
+def write_summary(results, summaryPath):
+    with open(summaryPath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+def print_summary(results, wallTime):
+    for result in results:
+        print('{:<10}{:>8}{:>9.2f}s  {}{}'.format(result['status'], result['poses'], result['seconds'], result['source'],
+                                                 '  ' + result['error'] if result['error'] else ''))
+    counts = {status: sum(r['status'] == status for r in results) for status in ('converted', 'skipped', 'failed')}
+    cpuTime = sum(r['seconds'] for r in results)
+    print('{converted} converted, {skipped} skipped, {failed} failed'.format(**counts) +
+          ' in {:.2f}s ({:.2f}s of conversion time)'.format(wallTime, cpuTime))
+
+def main(args):
+    if args.manifest:
+        posePaths = read_manifest(args.manifest)
+        root = args.root
+    elif args.root:
+        posePaths = find_pose_files(args.root, exclude=[args.output])
+        root = args.root
+    else:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    begin = time.perf_counter()
+    results = batch_convert(posePaths, args.output, root, args.workers, args.start, args.stop, args.step,
+                            args.force, not args.no_cache)
+    wallTime = time.perf_counter() - begin
+
+    os.makedirs(args.output, exist_ok=True)
+    write_summary(results, os.path.join(args.output, SUMMARY_FILE))
+    print_summary(results, wallTime)
+
+    if any(r['status'] == 'failed' for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--root', type=str, help='Directory tree with .xlsx/.csv pose files')
+    parser.add_argument('--manifest', type=str, help='Text file listing pose files, one per line')
+    parser.add_argument('--output', type=str, default=os.getcwd(), help='Directory for the converted trajectories')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--start', type=int, default=0, help='Index of the first pose to convert')
+    parser.add_argument('--stop', type=int, default=None, help='Index after the last pose to convert')
+    parser.add_argument('--step', type=int, default=1, help='Convert every step-th pose')
+    parser.add_argument('--force', action='store_true', help='Convert again even if the output is up to date')
+    parser.add_argument('--no-cache', action='store_true', help='Parse the pose files without using their pose cache')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,136 @@
+'''
+
+bench_convert2npy.py
+
+Benchmarks the streaming pose ingestion of convert2npy.py on a synthetic
+trajectory. Writes a synthetic EndoSLAM-style excel and csv pose file with
+--rows poses, converts the whole trajectory and reports rows/sec and the
+peak resident memory of the converting process.
+
+Each conversion runs in a freshly spawned process so that the peak RSS
+reported belongs to that conversion only. The per-row quaternion conversion
+is also timed against the batched convert_to_poses_bounds on the same poses.
+
+Flags:
+    --rows (Number of synthetic poses, default 100000)
+    --workdir (Directory for the synthetic files, default is a temporary directory)
+    --chunk-size (Rows read and converted at a time)
+    --skip-xlsx (Only benchmark the csv path, writing a large excel file is slow)
+
+'''
+
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import openpyxl as opx
+
+import convert2npy
+
+
+def synthetic_trajectory(numRows, seed=0):
+    # random walk translations and random unit quaternions (x, y, z, w)
+    rng = np.random.default_rng(seed)
+    trans = np.cumsum(rng.normal(scale=0.1, size=(numRows, 3)), axis=0)
+    quats = rng.normal(size=(numRows, 4))
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    return np.concatenate((trans, quats), axis=1)
+
+def write_csv(tranQuots, csvPath):
+    with open(csvPath, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['trans_x', 'trans_y', 'trans_z', 'quot_x', 'quot_y', 'quot_z', 'quot_w'])
+        writer.writerows(tranQuots.tolist())
+
+def write_xlsx(tranQuots, xlsxPath):
+    workbook = opx.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['', 'ImageFrame', 'Pose_Index', 'trans_x', 'trans_y', 'trans_z', 'quot_x', 'quot_y', 'quot_z', 'quot_w'])
+    for i, row in enumerate(tranQuots.tolist()):
+        sheet.append([i, i, i] + row)
+    workbook.save(xlsxPath)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else maxrss / 1024.0
+
+def _run(kind, path, outDir, chunkSize, queue):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if kind == 'csv':
+        posesBounds = convert2npy.convert_to_npy_csv(path, outDir, stop=None, chunkSize=chunkSize)
+    else:
+        posesBounds = convert2npy.convert_to_npy(path, outDir, stop=None, chunkSize=chunkSize)
+    elapsed = time.perf_counter() - start
+    queue.put((len(posesBounds), elapsed, baseline, peak_rss_mb()))
+
+def run_isolated(kind, path, outDir, chunkSize):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(kind, path, outDir, chunkSize, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def convert_per_row(tranQuots, useScipy=True):
+    # the original row-by-row conversion, kept as a baseline
+    convert = convert2npy.convert_quot2rotMatrix_usingScipy if useScipy else convert2npy.convert_quot2rotMatrix
+    posesBounds = np.empty((len(tranQuots), 17))
+    for i, tranQuot in enumerate(tranQuots):
+        tranMatrix = np.array([tranQuot[:3]])
+        rotMatrix = convert(tranQuot[3:])
+        poseMatrixFlat = (np.concatenate((rotMatrix, tranMatrix.T, convert2npy.IMAGE_VEC.T), axis=1)).flatten()
+        posesBounds[i] = np.concatenate((poseMatrixFlat, convert2npy.CLOSE_DEPTH, convert2npy.FAR_DEPTH), axis=None)
+    return posesBounds
+
+def bench_conversion(tranQuots):
+    print('{:<10}{:>14}{:>14}{:>10}{:>12}'.format('rotation', 'per-row (s)', 'batched (s)', 'speedup', 'max |diff|'))
+    for name, useScipy in (('scipy', True), ('manual', False)):
+        start = time.perf_counter()
+        perRow = convert_per_row(tranQuots, useScipy)
+        perRowTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = convert2npy.convert_to_poses_bounds(tranQuots, useScipy)
+        batchedTime = time.perf_counter() - start
+
+        print('{:<10}{:>14.3f}{:>14.4f}{:>10.0f}{:>12.2e}'.format(name, perRowTime, batchedTime, perRowTime / batchedTime, np.abs(perRow - batched).max()))
+    print()
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_convert2npy_')
+    os.makedirs(workdir, exist_ok=True)
+
+    tranQuots = synthetic_trajectory(args.rows)
+    bench_conversion(tranQuots)
+
+    sources = [('csv', os.path.join(workdir, 'poses.csv'), write_csv)]
+    if not args.skip_xlsx:
+        sources.append(('xlsx', os.path.join(workdir, 'poses.xlsx'), write_xlsx))
+
+    print('{:<6}{:>10}{:>12}{:>14}{:>16}{:>16}'.format('input', 'rows', 'seconds', 'rows/sec', 'base RSS (MB)', 'peak RSS (MB)'))
+    for kind, path, writer in sources:
+        if not os.path.exists(path):
+            writer(tranQuots, path)
+        numRows, elapsed, baseline, peak = run_isolated(kind, path, workdir, args.chunk_size)
+        print('{:<6}{:>10d}{:>12.2f}{:>14.0f}{:>16.1f}{:>16.1f}'.format(kind, numRows, elapsed, numRows / elapsed, baseline, peak))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--rows', type=int, default=100000, help='Number of synthetic poses')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the synthetic pose files')
+    parser.add_argument('--chunk-size', type=int, default=convert2npy.CHUNK_SIZE, help='Rows read and converted at a time')
+    parser.add_argument('--skip-xlsx', action='store_true', help='Only benchmark the csv path')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,99 @@
+'''
+
+bench_evaluate_depth.py
+
+Benchmarks evaluate_depth.py. For every number of frames in --frames a
+ground truth and a predicted depth store of synthetic 640x480 depth maps are
+written (the prediction is the ground truth scaled and with noise), and
+both are evaluated with --align, serially and with a process pool of
+--workers processes. frames/sec and the peak resident memory of the
+evaluating process are reported; the peak should not grow with the number
+of frames. Each run is in a freshly spawned process.
+
+The stores are compressed by default, so frames are decoded chunk by chunk.
+Uncompressed stores are memory-mapped; the pages read from them count
+towards the RSS as well, although they are page cache the system can drop.
+
+Flags:
+    --frames (Comma separated numbers of frames)
+    --height, --width (Depth map size in pixels)
+    --compression (Compression of the depth stores, zlib or none)
+    --workers (Processes of the parallel runs, 0 skips them)
+    --workdir (Directory for the synthetic depth stores and results)
+
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench_convert2npy import peak_rss_mb
+from depth_store import DepthStoreWriter
+from evaluate_depth import evaluate_to_files
+
+HEIGHT = 480
+WIDTH = 640
+
+
+def write_synthetic_stores(numFrames, H, W, gtPath, predPath, compression=None, seed=0):
+    rng = np.random.default_rng(seed)
+    with DepthStoreWriter(gtPath, H, W, compression=compression) as gtWriter, \
+            DepthStoreWriter(predPath, H, W, compression=compression) as predWriter:
+        for k in range(numFrames):
+            gt = rng.uniform(0.5, 3., (H, W)).astype(np.float32)
+            name = 'r_{0:03d}'.format(k)
+            gtWriter.append(gt, name)
+            predWriter.append(gt * rng.uniform(1.8, 2.2, (H, W)).astype(np.float32), name)
+
+def _run(predPath, gtPath, outputDir, workers, queue):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    report = evaluate_to_files(predPath, gtPath, outputDir, align=True, workers=workers)
+    queue.put((report['frames'], time.perf_counter() - start, baseline, peak_rss_mb()))
+
+def run_isolated(*args):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_evaluate_depth_')
+    os.makedirs(workdir, exist_ok=True)
+
+    print('{:>8}{:>10}{:>10}{:>12}{:>16}{:>16}'.format('frames', 'workers', 'seconds', 'frames/sec',
+                                                      'base RSS (MB)', 'peak RSS (MB)'))
+    for numFrames in [int(f) for f in args.frames.split(',')]:
+        compression = None if args.compression == 'none' else args.compression
+        gtPath = os.path.join(workdir, 'gt_{}_{}.depthstore'.format(numFrames, args.compression))
+        predPath = os.path.join(workdir, 'pred_{}_{}.depthstore'.format(numFrames, args.compression))
+        if not os.path.exists(predPath):
+            write_synthetic_stores(numFrames, args.height, args.width, gtPath, predPath, compression)
+
+        for workers in sorted({0, args.workers}):
+            outputDir = os.path.join(workdir, 'eval_{}_{}'.format(numFrames, workers))
+            frames, elapsed, baseline, peak = run_isolated(predPath, gtPath, outputDir, workers)
+            print('{:>8d}{:>10}{:>10.2f}{:>12.1f}{:>16.1f}{:>16.1f}'.format(
+                frames, workers or 'serial', elapsed, frames / elapsed, baseline, peak))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=str, default='50,200', help='Comma separated numbers of frames')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='Depth map height in pixels')
+    parser.add_argument('--width', type=int, default=WIDTH, help='Depth map width in pixels')
+    parser.add_argument('--compression', type=str, default='zlib', choices=['zlib', 'none'],
+                        help='Compression of the depth stores')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes of the parallel runs, 0 skips them')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the synthetic depth stores and results')
+
+    args = parser.parse_args()
+
+    main(args)
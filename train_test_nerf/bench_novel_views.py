@@ -0,0 +1,87 @@
+'''
+
+bench_novel_views.py
+
+Benchmarks the tiled renderer of novel_views.py: a spline fly-through of
+--frames frames between the cameras of bench_point_sampling.py is rendered
+through the analytic TubeField, serially and with a pool of --workers
+processes. frames/sec and the peak resident memory of the driving process
+are reported; the peak should not grow with the number of frames, as
+finished frames are streamed to disk. Each run is in a freshly spawned
+process.
+
+Flags:
+    --frames (Comma separated numbers of frames)
+    --height, --width (Image size in pixels)
+    --tile (Tile size in pixels)
+    --samples (Samples per ray)
+    --workers (Processes of the parallel runs, 0 skips them)
+    --workdir (Directory for the rendered frames)
+
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from bench_convert2npy import peak_rss_mb
+from bench_point_sampling import tube_cameras
+from novel_views import TILE_SIZE, TiledRenderer, interpolate_poses
+from volume_rendering import TubeField
+
+HEIGHT = 240
+WIDTH = 320
+BOUNDS = (0.05, 6.)
+
+
+def _run(numFrames, H, W, tileSize, numSamples, workers, outputDir, queue):
+    baseline = peak_rss_mb()
+    poses = interpolate_poses(tube_cameras(8), numFrames, 'spline')
+    renderer = TiledRenderer(TubeField(), H, W, float(W), tileSize, numSamples=numSamples)
+
+    start = time.perf_counter()
+    numWritten = sum(1 for _ in renderer.render_path(poses, np.array(BOUNDS), outputDir, workers=workers))
+    queue.put((numWritten, time.perf_counter() - start, baseline, peak_rss_mb()))
+
+def run_isolated(*args):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_novel_views_')
+
+    print('{:>8}{:>10}{:>10}{:>12}{:>16}{:>16}'.format('frames', 'workers', 'seconds', 'frames/sec',
+                                                      'base RSS (MB)', 'peak RSS (MB)'))
+    for numFrames in [int(f) for f in args.frames.split(',')]:
+        for workers in sorted({0, args.workers}):
+            outputDir = os.path.join(workdir, 'frames_{}_{}'.format(numFrames, workers))
+            shutil.rmtree(outputDir, ignore_errors=True)
+            numWritten, elapsed, baseline, peak = run_isolated(numFrames, args.height, args.width, args.tile,
+                                                               args.samples, workers, outputDir)
+            print('{:>8d}{:>10}{:>10.2f}{:>12.2f}{:>16.1f}{:>16.1f}'.format(
+                numWritten, workers or 'serial', elapsed, numWritten / elapsed, baseline, peak))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=str, default='4,32', help='Comma separated numbers of frames')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='Image height in pixels')
+    parser.add_argument('--width', type=int, default=WIDTH, help='Image width in pixels')
+    parser.add_argument('--tile', type=int, default=TILE_SIZE, help='Tile size in pixels')
+    parser.add_argument('--samples', type=int, default=32, help='Samples per ray')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes of the parallel runs, 0 skips them')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the rendered frames')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,116 @@
+'''
+
+bench_pack_images.py
+
+Benchmarks pack_images.py on --frames synthetic 640x480 PNG frames with a
+synthetic poses_bounds.npy. Reported are the time to pack the frames, the
+time one epoch spends reading all frames by decoding the PNGs and by
+reading the memory-mapped pack (the difference is the decode time saved per
+epoch), and the ray batches per second of RayBatchLoader. Needs PIL or
+imageio to write and decode the PNGs.
+
+Flags:
+    --frames (Number of frames)
+    --height, --width (Image size in pixels)
+    --downscale (Integer factor the packed frames are reduced by)
+    --workers (Processes decoding the images while packing)
+    --batch-size (Rays per batch)
+    --batches (Number of ray batches drawn)
+    --workdir (Directory for the images and the pack)
+
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench_convert2npy import synthetic_trajectory
+from convert2npy import convert_to_poses_bounds
+from pack_images import RAY_BATCH_SIZE, ImagePack, RayBatchLoader, find_images, pack_images, read_image
+
+HEIGHT = 480
+WIDTH = 640
+FOCAL = 680.
+
+
+def write_image(imagePath, image):
+    try:
+        from PIL import Image
+    except ImportError:
+        import imageio
+        imageio.imwrite(imagePath, image)
+        return
+    Image.fromarray(image).save(imagePath)
+
+def write_synthetic_frames(numFrames, H, W, workdir, seed=0):
+    # smooth gradients with some noise, PNGs of a realistic size
+    rng = np.random.default_rng(seed)
+    imageDir = os.path.join(workdir, 'images')
+    os.makedirs(imageDir, exist_ok=True)
+    y, x = np.mgrid[0:H, 0:W]
+    for k in range(numFrames):
+        image = np.stack(((x + 3 * k) % 256, (y + 5 * k) % 256, (x + y + 7 * k) % 256), axis=-1)
+        image = np.clip(image + rng.integers(-8, 9, image.shape), 0, 255).astype(np.uint8)
+        write_image(os.path.join(imageDir, '{0:05d}.png'.format(k)), image)
+
+    npyPath = os.path.join(workdir, 'poses_bounds.npy')
+    np.save(npyPath, convert_to_poses_bounds(synthetic_trajectory(numFrames), imageVec=np.array([[H, W, FOCAL]])))
+    return npyPath, imageDir
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pack_images_')
+    try:
+        npyPath, imageDir = write_synthetic_frames(args.frames, args.height, args.width, workdir)
+    except ImportError:
+        print('bench_pack_images.py needs PIL or imageio', file=sys.stderr)
+        sys.exit(1)
+    packPath = os.path.join(workdir, 'images.imagepack')
+
+    start = time.perf_counter()
+    pack_images(npyPath, imageDir, packPath, args.downscale, args.workers)
+    packSeconds = time.perf_counter() - start
+
+    # one epoch of reading every frame, from the PNGs and from the pack
+    start = time.perf_counter()
+    for imagePath in find_images(imageDir):
+        read_image(imagePath)
+    decodeSeconds = time.perf_counter() - start
+
+    pack = ImagePack(packPath)
+    start = time.perf_counter()
+    for k in range(len(pack)):
+        np.array(pack[k])
+    readSeconds = time.perf_counter() - start
+
+    loader = RayBatchLoader(pack, args.batch_size, seed=0)
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        loader.batch()
+    batchSeconds = time.perf_counter() - start
+
+    print('packed {} frames of {}x{} in {:.2f} s ({:.1f} MB)'.format(len(pack), pack.shape[0], pack.shape[1], packSeconds,
+                                                                    os.path.getsize(packPath) / 2 ** 20))
+    print('epoch of frames: {:.3f} s decoding PNGs, {:.3f} s reading the pack, {:.3f} s saved'.format(
+        decodeSeconds, readSeconds, decodeSeconds - readSeconds))
+    print('{} ray batches of {}: {:.1f} batches/sec, {:.2f} Mrays/sec'.format(
+        args.batches, args.batch_size, args.batches / batchSeconds, args.batches * args.batch_size / batchSeconds / 1e6))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=int, default=100, help='Number of frames')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='Image height in pixels')
+    parser.add_argument('--width', type=int, default=WIDTH, help='Image width in pixels')
+    parser.add_argument('--downscale', type=int, default=1, help='Integer factor the packed frames are reduced by')
+    parser.add_argument('--workers', type=int, default=0, help='Processes decoding the images while packing')
+    parser.add_argument('--batch-size', type=int, default=RAY_BATCH_SIZE, help='Rays per batch')
+    parser.add_argument('--batches', type=int, default=1000, help='Number of ray batches drawn')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the images and the pack')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,177 @@
+'''
+
+bench_point_sampling.py
+
+Benchmarks point_sampling.py on a synthetic endoscopy scene: a tube of
+radius 1 closed at its far end, with --frames cameras moving down its axis
+and looking along it. The depth maps of the cameras are computed exactly and
+written as <name>_depth92.npz files, as the Blender renders, and the rays
+come from ray_generation.py.
+
+The rays get --coarse stratified samples and --fine importance samples
+(sample_pdf, weighted by a peak at the true surface in place of a coarse
+network pass), without a grid and with the grids built from the camera
+frusta and from the depth maps. With a grid only the samples inside occupied
+voxels count as network queries (skip_empty). The last run places only
+--occupied-coarse coarse samples, all in occupied space (sample_occupied).
+
+Reported are the network queries per ray, the sampling speed, the fraction
+of rays whose surface lies in occupied space (must be 1, else the grid skips
+geometry) and the fraction of rays with a queried fine sample within
+--tolerance of the surface. The run fails (exit code 1) if a grid skips
+surface points.
+
+Flags:
+    --frames (Number of cameras)
+    --height, --width (Image size in pixels)
+    --max-rays (Sample at most this many rays)
+    --coarse, --fine (Samples per ray of the two passes)
+    --occupied-coarse (Coarse samples per ray of the sample_occupied run)
+    --resolution (Voxels per side of the occupancy grids)
+    --tolerance (Distance to the surface that counts as a hit)
+    --workdir (Directory for the synthetic depth maps)
+
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from depth_bounds import iter_depth_source
+from point_sampling import GRID_RESOLUTION, OccupancyGrid, sample_occupied, sample_pdf, sample_stratified, skip_empty
+from ray_generation import BATCH_SIZE, RayGenerator, get_ray_directions
+
+RADIUS = 1.
+STEP = 0.05
+FOCAL_RATIO = 1.   # focal length in image widths
+
+
+def tube_cameras(numFrames, seed=0):
+    # (N, 3, 4) "right up back" cameras on the tube axis looking down the tube (-z), slightly off center
+    rng = np.random.default_rng(seed)
+    c2w = np.zeros((numFrames, 3, 4))
+    c2w[:, :, :3] = np.eye(3)
+    c2w[:, :2, 3] = rng.uniform(-0.2, 0.2, (numFrames, 2))
+    c2w[:, 2, 3] = -STEP * np.arange(numFrames)
+    return c2w
+
+def tube_depth(c2w, H, W, focal, capZ):
+    # exact z-depth of the tube wall x^2 + y^2 = RADIUS^2 and the cap at z = capZ seen by a camera
+    dirs = get_ray_directions(H, W, focal, normalize=False).astype(float) @ c2w[:, :3].T
+    o = c2w[:, 3]
+    a = (dirs[..., :2] ** 2).sum(axis=-1)
+    b = 2. * (dirs[..., :2] * o[:2]).sum(axis=-1)
+    c = (o[:2] ** 2).sum() - RADIUS ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wall = (-b + np.sqrt(b ** 2 - 4. * a * c)) / (2. * a)
+    cap = (o[2] - capZ) / -dirs[..., 2]
+    return np.fmin(wall, cap).astype(np.float32)
+
+def write_scene(numFrames, H, W, workdir):
+    focal = FOCAL_RATIO * W
+    c2w = tube_cameras(numFrames)
+    capZ = c2w[-1, 2, 3] - 2.
+    for k in range(numFrames):
+        np.savez_compressed(os.path.join(workdir, 'r_{0:03d}_depth92.npz'.format(k)),
+                            depth=tube_depth(c2w[k], H, W, focal, capZ))
+    bounds = np.tile([0.05, c2w[0, 2, 3] - capZ + 0.5], (numFrames, 1))
+    return c2w, bounds, focal
+
+def surface_distances(generator, depthSource, stop):
+    # distance along the unit ray directions to the surface, for the first stop rays
+    norms = np.linalg.norm(get_ray_directions(generator.H, generator.W, generator.focal, normalize=False), axis=-1).ravel()
+    _, depths = iter_depth_source(depthSource)
+    out = []
+    for depth in depths:
+        out.append(np.asarray(depth, dtype=np.float32).ravel() * norms)
+        if len(out) * generator.raysPerCamera >= stop:
+            break
+    return np.concatenate(out)[:stop]
+
+def surface_weights(t, surface, width):
+    # stand-in for the weights of a coarse network pass, a peak at the surface
+    return np.exp(-0.5 * ((t - surface[:, None]) / width) ** 2)
+
+def sample_batch(rays, surface, grid, numCoarse, numFine, tolerance, rng, concentrate=False):
+    # (network queries, rays with a fine sample near the surface) of a batch
+    rays_o, rays_d, near, far = rays[:, :3], rays[:, 3:6], rays[:, 6], rays[:, 7]
+    if concentrate:
+        coarse, validCoarse = sample_occupied(rays_o, rays_d, near, far, grid, numCoarse, rng=rng)
+    else:
+        coarse = sample_stratified(near, far, numCoarse, rng=rng)
+        validCoarse = np.ones(coarse.shape, dtype=bool) if grid is None else skip_empty(grid, rays_o, rays_d, coarse)
+
+    mids = 0.5 * (coarse[:, 1:] + coarse[:, :-1])
+    weights = surface_weights(coarse[:, 1:-1], surface, tolerance) * validCoarse[:, 1:-1]
+    fine = sample_pdf(mids, weights, numFine, rng=rng)
+    validFine = np.ones(fine.shape, dtype=bool) if grid is None else skip_empty(grid, rays_o, rays_d, fine)
+
+    near_surface = (np.abs(fine - surface[:, None]) < tolerance) & validFine
+    return validCoarse.sum() + validFine.sum(), near_surface.any(axis=1).sum()
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_point_sampling_')
+    os.makedirs(workdir, exist_ok=True)
+    c2w, bounds, focal = write_scene(args.frames, args.height, args.width, workdir)
+
+    generator = RayGenerator(c2w, args.height, args.width, focal, bounds)
+    stop = min(len(generator), args.max_rays)
+    surface = surface_distances(generator, workdir, stop)
+
+    start = time.perf_counter()
+    _, depths = iter_depth_source(workdir)
+    frustaGrid = OccupancyGrid.from_frusta(c2w, args.height, args.width, focal, bounds, args.resolution)
+    depthGrid = OccupancyGrid.from_depths(c2w, depths, focal, bounds, args.resolution)
+    # (name, grid, coarse samples, concentrate the samples in occupied space)
+    runs = [('none', None, args.coarse, False),
+            ('frusta', frustaGrid, args.coarse, False),
+            ('depth', depthGrid, args.coarse, False),
+            ('occupied', depthGrid, args.occupied_coarse, True)]
+    print('built grids in {:.2f} s'.format(time.perf_counter() - start))
+
+    print('{:>8}{:>10}{:>16}{:>14}{:>12}{:>12}'.format('grid', 'occupied', 'queries/ray', 'Mrays/sec',
+                                                       'covered', 'hits'))
+    failed = False
+    for name, grid, numCoarse, concentrate in runs:
+        rng = np.random.default_rng(0)
+        queries = hits = 0
+        start = time.perf_counter()
+        for s, e in generator.batch_ranges(stop=stop):
+            q, h = sample_batch(generator.rays(s, e), surface[s:e], grid, numCoarse, args.fine, args.tolerance, rng,
+                                concentrate)
+            queries += q
+            hits += h
+        elapsed = time.perf_counter() - start
+
+        rays = generator.rays(0, stop)
+        points = rays[:, :3] + surface[:, None] * rays[:, 3:6]
+        covered = ((surface >= rays[:, 6]) & (surface <= rays[:, 7])).mean() if grid is None else grid.query(points).mean()
+        failed |= covered < 1.
+        print('{:>8}{:>10.3f}{:>16.1f}{:>14.3f}{:>12.4f}{:>12.4f}'.format(
+            name, 1. if grid is None else grid.occupied_fraction(), queries / stop, stop / elapsed / 1e6, covered, hits / stop))
+
+    if failed:
+        print('surface points in skipped space', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=int, default=20, help='Number of cameras')
+    parser.add_argument('--height', type=int, default=240, help='Image height in pixels')
+    parser.add_argument('--width', type=int, default=320, help='Image width in pixels')
+    parser.add_argument('--max-rays', type=int, default=4 * BATCH_SIZE, help='Sample at most this many rays')
+    parser.add_argument('--coarse', type=int, default=64, help='Stratified samples per ray')
+    parser.add_argument('--occupied-coarse', type=int, default=16, help='Coarse samples per ray placed in occupied space')
+    parser.add_argument('--fine', type=int, default=128, help='Importance samples per ray')
+    parser.add_argument('--resolution', type=int, default=GRID_RESOLUTION, help='Voxels per side of the occupancy grids')
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Distance to the surface that counts as a hit')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the synthetic depth maps')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,98 @@
+'''
+
+bench_ray_generation.py
+
+Benchmarks ray_generation.py on synthetic 640x480 cameras. For every number
+of frames in --frames a synthetic poses_bounds.npy is written, and the rays
+are streamed in batches, serially and with a process pool of --workers
+processes. rays/sec and the peak resident memory of the generating process
+are reported.
+
+With many frames only the first --max-rays rays are generated (10k frames
+are 3e9 rays), which is enough for a stable rays/sec figure. Each run is in a
+freshly spawned process, so the peak RSS shows that memory does not depend
+on the number of frames.
+
+Flags:
+    --frames (Comma separated numbers of frames, default 20,100,1000,10000)
+    --max-rays (Generate at most this many rays per run)
+    --batch-size (Rays per batch)
+    --workers (Processes of the parallel runs, 0 skips them)
+    --ndc (Generate NDC rays)
+    --workdir (Directory for the synthetic poses_bounds.npy files)
+
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench_convert2npy import peak_rss_mb, synthetic_trajectory
+from convert2npy import convert_to_poses_bounds
+from ray_generation import BATCH_SIZE, RayGenerator, load_llff_cameras
+
+HEIGHT = 480
+WIDTH = 640
+FOCAL = 680.
+
+
+def write_synthetic_poses(numFrames, npyPath):
+    posesBounds = convert_to_poses_bounds(synthetic_trajectory(numFrames), imageVec=np.array([[HEIGHT, WIDTH, FOCAL]]))
+    np.save(npyPath, posesBounds)
+
+def _run(npyPath, maxRays, batchSize, workers, ndc, queue):
+    baseline = peak_rss_mb()
+    c2w, bounds, H, W, focal = load_llff_cameras(npyPath)
+    generator = RayGenerator(c2w, H, W, focal, bounds, ndc=ndc, batchSize=batchSize)
+    stop = min(len(generator), maxRays)
+
+    start = time.perf_counter()
+    batches = generator.iter_batches_parallel(workers, stop=stop) if workers else generator.iter_batches(stop=stop)
+    numRays = 0
+    for rays in batches:
+        numRays += len(rays)
+    elapsed = time.perf_counter() - start
+    queue.put((numRays, elapsed, baseline, peak_rss_mb()))
+
+def run_isolated(npyPath, maxRays, batchSize, workers, ndc):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(npyPath, maxRays, batchSize, workers, ndc, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_ray_generation_')
+    os.makedirs(workdir, exist_ok=True)
+
+    print('{:>8}{:>10}{:>14}{:>10}{:>14}{:>16}{:>16}'.format('frames', 'workers', 'rays', 'seconds', 'Mrays/sec',
+                                                            'base RSS (MB)', 'peak RSS (MB)'))
+    for numFrames in [int(f) for f in args.frames.split(',')]:
+        npyPath = os.path.join(workdir, 'poses_bounds_{}.npy'.format(numFrames))
+        if not os.path.exists(npyPath):
+            write_synthetic_poses(numFrames, npyPath)
+
+        for workers in sorted({0, args.workers}):
+            numRays, elapsed, baseline, peak = run_isolated(npyPath, args.max_rays, args.batch_size, workers, args.ndc)
+            print('{:>8d}{:>10}{:>14d}{:>10.2f}{:>14.1f}{:>16.1f}{:>16.1f}'.format(
+                numFrames, workers or 'serial', numRays, elapsed, numRays / elapsed / 1e6, baseline, peak))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=str, default='20,100,1000,10000', help='Comma separated numbers of frames')
+    parser.add_argument('--max-rays', type=int, default=100000000, help='Generate at most this many rays per run')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rays per batch')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes of the parallel runs, 0 skips them')
+    parser.add_argument('--ndc', action='store_true', help='Generate NDC rays')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the synthetic poses_bounds.npy files')
+
+    args = parser.parse_args()
+
+    main(args)
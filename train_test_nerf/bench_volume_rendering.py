@@ -0,0 +1,92 @@
+'''
+
+bench_volume_rendering.py
+
+Benchmarks volume_rendering.py: renders --frames 640x480 views down the
+analytic TubeField (the cameras of bench_point_sampling.py) for every
+combination of --chunks and --thresholds. rays/sec, the evaluated samples
+per ray and the peak resident memory of the rendering process are reported,
+along with the largest color difference to the run without early
+termination (threshold 0). Each run is in a freshly spawned process.
+
+Flags:
+    --frames (Number of views)
+    --height, --width (Image size in pixels)
+    --samples (Samples per ray)
+    --chunks (Comma separated ray chunk sizes)
+    --sample-chunk (Samples evaluated at a time along the rays)
+    --thresholds (Comma separated transmittance thresholds, 0 disables early termination)
+
+'''
+
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from bench_convert2npy import peak_rss_mb
+from bench_point_sampling import tube_cameras
+from volume_rendering import CHUNK_SIZE, NUM_SAMPLES, SAMPLE_CHUNK, TRANSMITTANCE_THRESHOLD, TubeField, render_cameras
+
+HEIGHT = 480
+WIDTH = 640
+BOUNDS = (0.05, 6.)
+
+
+def _run(numFrames, H, W, numSamples, chunkSize, sampleChunk, threshold, queue):
+    baseline = peak_rss_mb()
+    c2w = tube_cameras(numFrames)
+    frames = render_cameras(TubeField(), c2w, H, W, float(W), np.array(BOUNDS), numSamples=numSamples,
+                            chunkSize=chunkSize, sampleChunk=sampleChunk, threshold=threshold)
+
+    start = time.perf_counter()
+    rgbs = []
+    numEvaluated = 0
+    for frame in frames:
+        rgbs.append(frame['rgb'])
+        numEvaluated += int(frame['samples'].sum())
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, numEvaluated, baseline, peak_rss_mb(), np.stack(rgbs)))
+
+def run_isolated(*args):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main(args):
+    numRays = args.frames * args.height * args.width
+    thresholds = [float(t) for t in args.thresholds.split(',')]
+
+    print('{:>10}{:>12}{:>10}{:>12}{:>14}{:>16}{:>16}{:>12}'.format('chunk', 'threshold', 'seconds', 'Mrays/sec',
+                                                                   'samples/ray', 'base RSS (MB)', 'peak RSS (MB)', 'max diff'))
+    for chunkSize in [int(c) for c in args.chunks.split(',')]:
+        reference = None
+        for threshold in sorted(thresholds):
+            elapsed, numEvaluated, baseline, peak, rgbs = run_isolated(args.frames, args.height, args.width, args.samples,
+                                                                       chunkSize, args.sample_chunk, threshold)
+            if reference is None:
+                reference = rgbs
+            print('{:>10d}{:>12g}{:>10.2f}{:>12.3f}{:>14.1f}{:>16.1f}{:>16.1f}{:>12.2e}'.format(
+                chunkSize, threshold, elapsed, numRays / elapsed / 1e6, numEvaluated / numRays, baseline, peak,
+                np.abs(rgbs - reference).max()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--frames', type=int, default=1, help='Number of views')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='Image height in pixels')
+    parser.add_argument('--width', type=int, default=WIDTH, help='Image width in pixels')
+    parser.add_argument('--samples', type=int, default=NUM_SAMPLES, help='Samples per ray')
+    parser.add_argument('--chunks', type=str, default='4096,{}'.format(CHUNK_SIZE), help='Comma separated ray chunk sizes')
+    parser.add_argument('--sample-chunk', type=int, default=SAMPLE_CHUNK, help='Samples evaluated at a time along the rays')
+    parser.add_argument('--thresholds', type=str, default='0,{:g}'.format(TRANSMITTANCE_THRESHOLD),
+                        help='Comma separated transmittance thresholds, 0 disables early termination')
+
+    args = parser.parse_args()
+
+    main(args)
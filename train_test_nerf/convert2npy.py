@@ -9,19 +9,33 @@ link: https://github.com/Fyusion/LLFF/issues/10.
 
 Flags:
     --xlsx (Path to the excel file with camera pose information)
+    --csv (Path to a csv file with camera pose information)
     --output (Path to the directory where the produced poses_bounds.npy file can be placed)
     --npy (Path to the poses_bounds.npy file, use for viewing the contents of the file)
+    --start, --stop, --step (Frame range/stride to convert, defaults to the first 20 poses)
+    --all (Convert the entire trajectory, overrides --stop)
+    --chunk-size (Number of rows read and converted at a time)
+    --no-scipy (Use convert_quot2rotMatrix instead of scipy for the rotation matrices)
+    --no-cache (Parse the input file without reading or writing its pose cache)
+    --rebuild-cache (Re-parse the input file and overwrite its pose cache)
+    --depth-dir (Directory with per-frame depth maps, e.g. *_depth92.npz, or a depth store, used for per-frame 
+                 near/far bounds instead of CLOSE_DEPTH/FAR_DEPTH, see depth_bounds.py)
 
 Additional Notes:
-    This code is currently set to read and convert only the first 20 camera poses from 
-    the input excel file. Please modify the convert_to_npy function accordingly if you 
-    would like to include all or a different number of camera poses for your conversion.
+    By default only the first 20 camera poses from the input file are converted. Use --all 
+    (or --start/--stop/--step) to convert the whole trajectory or a subset of it. Rows are 
+    streamed from the input file in chunks, so long trajectories are converted in bounded 
+    memory.
+
+    The parsed rows are cached next to the input file (see pose_cache.py), so later runs 
+    on the same file skip the excel/csv parsing.
 
 Feel free to reach out via email with any questions/concerns: qyc206@nyu.edu
 
 '''
 
 import argparse
+import itertools
 import sys
 import os
 
@@ -31,6 +45,10 @@ import csv
 
 from scipy.spatial.transform import Rotation as R
 
+from pose_cache import load_pose_table, read_table
+from pose_store import PoseStore
+from depth_bounds import fill_bounds_from_depth_dir
+
 # arbitrary values
 # IMAGE_VEC = np.array([[480, 640, 28]])  # [image height, image width, focal length (mm)]
 IMAGE_VEC = np.array([[320, 320, 28]])  # [image height, image width, focal length (mm)]
@@ -40,9 +58,21 @@ FAR_DEPTH = 2
 # CLOSE_DEPTH = 0.01
 # FAR_DEPTH = 2
 
+# number of poses converted when no frame range is given
+NUM_IMAGES = 20
+# number of rows read and converted at a time when streaming
+CHUNK_SIZE = 4096
+
+# columns holding [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w]
+# excel: ['', 'ImageFrame', 'Pose_Index', 'trans_x', ..., 'quot_w']
+XLSX_POSE_COLS = slice(3, 10)
+# csv: ['trans_x', ..., 'quot_w']
+CSV_POSE_COLS = slice(0, 7)
+
 def read_npy_file(filePath):
     try: 
-        data = np.load(filePath)
+        # memory-mapped, rows are only read when they are accessed
+        data = PoseStore(filePath).data
         return data
     except (IOError, ValueError) as e:
         print(e)
@@ -73,94 +103,164 @@ def convert_quot2rotMatrix_usingScipy(quot):
 
     return R.from_quat([x, y, z, w]).as_matrix()
 
-def convert_to_npy_csv(csvPath, npyPath):
-    # explicitly state number of images desired
-    numImages = 20
+def _to_float(value):
+    # empty cells and names (e.g. an ImageFrame column of file names) become nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _chunked(rows, start, stop, step, chunkSize, poseCols):
+    # keep rows[start:stop:step] and group them into (k, num_columns) float arrays
+    rows = itertools.islice(rows, start, stop, step)
+    while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk:
+            return
+        numCols = len(chunk[0])
+        table = np.empty((len(chunk), numCols))
+        # the pose columns have to be numbers, empty cells (None) become nan
+        table[:, poseCols] = np.array([row[poseCols] for row in chunk], dtype=float)
+        # the index columns ('', 'ImageFrame', 'Pose_Index') may be blank or hold names
+        indexCols = [col for col in range(numCols) if col not in range(*poseCols.indices(numCols))]
+        if indexCols:
+            cells = [[row[col] for col in indexCols] for row in chunk]
+            try:
+                table[:, indexCols] = np.array(cells, dtype=float)
+            except (TypeError, ValueError):
+                table[:, indexCols] = [[_to_float(value) for value in rowCells] for rowCells in cells]
+        yield table
+
+def iter_xlsx_chunks(xlsxPath, start=0, stop=None, step=1, chunkSize=CHUNK_SIZE):
+    # read-only mode streams the rows from the sheet instead of loading the whole workbook
+    workbook = opx.load_workbook(xlsxPath, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(min_row=2, values_only=True)   # skip header row
+        yield from _chunked(rows, start, stop, step, chunkSize, XLSX_POSE_COLS)
+    finally:
+        workbook.close()
+
+def iter_csv_chunks(csvPath, start=0, stop=None, step=1, chunkSize=CHUNK_SIZE):
+    with open(csvPath, newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader, None)   # skip header row
+        yield from _chunked(csv_reader, start, stop, step, chunkSize, CSV_POSE_COLS)
+
+def iter_pose_chunks(posePath, start=0, stop=None, step=1, chunkSize=CHUNK_SIZE):
+    if posePath.lower().endswith('.csv'):
+        return iter_csv_chunks(posePath, start, stop, step, chunkSize)
+    return iter_xlsx_chunks(posePath, start, stop, step, chunkSize)
+
+def iter_table_chunks(table, start=0, stop=None, step=1, chunkSize=CHUNK_SIZE):
+    # same as iter_pose_chunks for an already parsed (possibly memory-mapped) table
+    rows = table[start:stop:step]
+    for i in range(0, len(rows), chunkSize):
+        yield np.asarray(rows[i:i+chunkSize], dtype=float)
+
+def read_pose_table(posePath):
+    # parse every row of an excel/csv pose file into an (N, num_columns) float table in memory
+    return read_table(iter_pose_chunks(posePath))
+
+def load_pose_chunks(posePath, start=0, stop=None, step=1, chunkSize=CHUNK_SIZE, useCache=True, rebuildCache=False):
+    # row chunks of posePath, read through the pose cache unless useCache is False
+    if not useCache:
+        return iter_pose_chunks(posePath, start, stop, step, chunkSize)
+    # the parsed chunks are streamed into the cache and served from its memory map
+    table = load_pose_table(posePath, iter_pose_chunks, rebuild=rebuildCache)
+    return iter_table_chunks(table, start, stop, step, chunkSize)
+
+def convert_quots2rotMatrices(quots):
+    # batched convert_quot2rotMatrix, quots is an (N, 4) array of (x, y, z, w)
+    q0 = quots[:, 3] # w
+    q1 = quots[:, 0] # x
+    q2 = quots[:, 1] # y
+    q3 = quots[:, 2] # z
+
+    # R(x y z) = (r1 r2 r3), each column is (N, 3)
+    r1 = np.stack(((2*(q0*q0 + q1*q1))-1, 2*(q1*q2 + q0*q3), 2*(q1*q3 - q0*q2)), axis=-1)
+    r2 = np.stack((2*(q1*q2 - q0*q3), (2*(q0*q0 + q2*q2))-1, 2*(q2*q3 + q0*q1)), axis=-1)
+    r3 = np.stack((2*(q1*q3 + q0*q2), 2*(q2*q3 - q0*q1), (2*(q0*q0 + q3*q3))-1), axis=-1)
+
+    # change columns to [down, right, backwards] or [-y, x, z]
+    r2 = -1*r2
+    return np.stack((r2, r1, r3), axis=-1)   # (N, 3, 3)
 
-    # initialize an empty Nx17 numpy array
-    posesBoundsMatrix = np.empty((numImages,17))   # only the first numImages images
+def convert_quots2rotMatrices_usingScipy(quots):
+    # batched convert_quot2rotMatrix_usingScipy, quots is an (N, 4) array of (x, y, z, w)
+    return R.from_quat(quots).as_matrix()   # (N, 3, 3)
 
-    with open(csvPath) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        curr_row = 0
-        for row in csv_reader:
-            if (curr_row == 0):
-                curr_row += 1
-                continue
-
-            if (curr_row-1 == numImages):
-                break
-
-            # get translation matrix
-            tranMatrix = np.array([[float(row[0]), float(row[1]), float(row[2])]])
-
-            # get rotation matrix
-            rotMatrix = convert_quot2rotMatrix_usingScipy((float(row[3]), float(row[4]), float(row[5]), float(row[6])))
-
-            # concatenate & flatten rotation, translation and [height, width, focal] matrices
-            poseMatrixFlat = (np.concatenate((rotMatrix, tranMatrix.T, IMAGE_VEC.T), axis=1)).flatten()
-            # concatenate close/far depths to get 17d array for pose & add to poses matrix
-            finalMatrix = np.concatenate((poseMatrixFlat, CLOSE_DEPTH, FAR_DEPTH), axis=None)
-            posesBoundsMatrix[curr_row-1] = finalMatrix
-
-            curr_row += 1
-        
-        # write Nx17 numpy array to .npy file
-        with open(npyPath+"/poses_bounds.npy", 'wb') as writeFile:
-            np.save(writeFile, posesBoundsMatrix)
-
-def convert_to_npy(xlsxPath, npyPath):
-    # read excel file
-    workbook = opx.load_workbook(xlsxPath)
-    # read active sheet from excel file
-    sheet = workbook.active
-
-    # explicitly state number of images desired
-    numImages = 20
-    # numImages = 120
-
-    # initialize an empty Nx17 numpy array
-    # posesBoundsMatrix = np.empty((sheet.max_row-1,17))    # use this instead for ALL images in excel file
-    posesBoundsMatrix = np.empty((numImages,17))   # only the first numImages images
-    currRow = 0
-
-    # iterate through images and fill poses matrix
-    # for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row): # use this instead for ALL images in excel file
-    for row in sheet.iter_rows(min_row=2, max_row=numImages+1): # only the first numImages images
-        # get translation matrix
-        tranMatrix = np.array([[row[3].value, row[4].value, row[5].value]])
-
-        # get rotation matrix
-        # rotMatrix = convert_quot2rotMatrix((row[6].value, row[7].value, row[8].value, row[9].value))
-        rotMatrix = convert_quot2rotMatrix_usingScipy((row[6].value, row[7].value, row[8].value, row[9].value))
-
-        # concatenate & flatten rotation, translation and [height, width, focal] matrices
-        poseMatrixFlat = (np.concatenate((rotMatrix, tranMatrix.T, IMAGE_VEC.T), axis=1)).flatten()
-        # concatenate close/far depths to get 17d array for pose & add to poses matrix
-        finalMatrix = np.concatenate((poseMatrixFlat, CLOSE_DEPTH, FAR_DEPTH), axis=None)
-        posesBoundsMatrix[currRow] = finalMatrix
-        currRow = currRow + 1
-
-    # close excel file
-    workbook.close()
-    
+def convert_to_poses_bounds(tranQuots, useScipy=True, imageVec=IMAGE_VEC, closeDepth=CLOSE_DEPTH, farDepth=FAR_DEPTH):
+    # tranQuots is an (N, 7) array of [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w]
+    # returns the (N, 17) poses_bounds rows in one pass
+    tranQuots = np.asarray(tranQuots, dtype=float).reshape(-1, 7)
+    numPoses = len(tranQuots)
+
+    if useScipy:
+        rotMatrices = convert_quots2rotMatrices_usingScipy(tranQuots[:, 3:])
+    else:
+        rotMatrices = convert_quots2rotMatrices(tranQuots[:, 3:])
+
+    # [rotation | translation | [height, width, focal]] for every pose
+    poses = np.empty((numPoses, 3, 5))
+    poses[:, :, :3] = rotMatrices
+    poses[:, :, 3] = tranQuots[:, :3]
+    poses[:, :, 4] = np.asarray(imageVec).reshape(3)
+
+    posesBounds = np.empty((numPoses, 17))
+    posesBounds[:, :15] = poses.reshape(numPoses, 15)
+    posesBounds[:, 15] = closeDepth
+    posesBounds[:, 16] = farDepth
+    return posesBounds
+
+def convert_chunks(chunks, poseCols, useScipy=True):
+    # convert a stream of raw row chunks into the Nx17 poses_bounds matrix
+    posesBounds = [convert_to_poses_bounds(chunk[:, poseCols], useScipy) for chunk in chunks]
+
+    if not posesBounds:
+        return np.empty((0, 17))
+    return np.concatenate(posesBounds, axis=0)
+
+def save_poses_bounds(posesBoundsMatrix, npyPath):
     # write Nx17 numpy array to .npy file
     with open(npyPath+"/poses_bounds.npy", 'wb') as writeFile:
         np.save(writeFile, posesBoundsMatrix)
 
+def convert_to_npy_csv(csvPath, npyPath, start=0, stop=NUM_IMAGES, step=1, chunkSize=CHUNK_SIZE, useScipy=True,
+                       useCache=True, rebuildCache=False):
+    # stop=None converts every row from start to the end of the file
+    chunks = load_pose_chunks(csvPath, start, stop, step, chunkSize, useCache, rebuildCache)
+    posesBoundsMatrix = convert_chunks(chunks, CSV_POSE_COLS, useScipy)
+    save_poses_bounds(posesBoundsMatrix, npyPath)
+    return posesBoundsMatrix
+
+def convert_to_npy(xlsxPath, npyPath, start=0, stop=NUM_IMAGES, step=1, chunkSize=CHUNK_SIZE, useScipy=True,
+                   useCache=True, rebuildCache=False):
+    # stop=None converts every row from start to the end of the sheet
+    chunks = load_pose_chunks(xlsxPath, start, stop, step, chunkSize, useCache, rebuildCache)
+    posesBoundsMatrix = convert_chunks(chunks, XLSX_POSE_COLS, useScipy)
+    save_poses_bounds(posesBoundsMatrix, npyPath)
+    return posesBoundsMatrix
+
 def main(args):
+    stop = None if args.all else args.stop
+    cacheArgs = (not args.no_cache, args.rebuild_cache)
+
     if (args.npy):
         data = read_npy_file(args.npy)
         print(data)
         print(len(data))
     elif (args.xlsx):
-        convert_to_npy(args.xlsx, args.output)
+        convert_to_npy(args.xlsx, args.output, args.start, stop, args.step, args.chunk_size, not args.no_scipy, *cacheArgs)
     elif (args.csv):
-        convert_to_npy_csv(args.csv, args.output)
+        convert_to_npy_csv(args.csv, args.output, args.start, stop, args.step, args.chunk_size, not args.no_scipy, *cacheArgs)
     else:
         parser.print_help(sys.stderr)
         sys.exit(1)
 
+    if (args.depth_dir and not args.npy):
+        # replace the constant bounds by per-frame bounds from the depth maps
+        fill_bounds_from_depth_dir(args.output+"/poses_bounds.npy", args.depth_dir, fallback=(CLOSE_DEPTH, FAR_DEPTH))
+
 if __name__=='__main__':
     parser = argparse.ArgumentParser()
 
@@ -168,6 +268,15 @@ if __name__=='__main__':
     parser.add_argument('--csv', type=str, help='Path to poses csv file')
     parser.add_argument('--output', type=str, default=os.getcwd(), help='Path to directory to place the produced poses_bounds.npy file')
     parser.add_argument('--npy', type=str, help='Path to poses_bounds.npy file')
+    parser.add_argument('--start', type=int, default=0, help='Index of the first pose to convert')
+    parser.add_argument('--stop', type=int, default=NUM_IMAGES, help='Index after the last pose to convert')
+    parser.add_argument('--step', type=int, default=1, help='Convert every step-th pose')
+    parser.add_argument('--all', action='store_true', help='Convert every pose until the end of the file')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of rows read and converted at a time')
+    parser.add_argument('--no-scipy', action='store_true', help='Use the hand-rolled quaternion conversion ([down, right, backwards] columns)')
+    parser.add_argument('--no-cache', action='store_true', help='Parse the input file without using its pose cache')
+    parser.add_argument('--rebuild-cache', action='store_true', help='Re-parse the input file and overwrite its pose cache')
+    parser.add_argument('--depth-dir', type=str, help='Directory with per-frame depth maps for the near/far bounds')
     
     args = parser.parse_args()  # retrieve arguments
 
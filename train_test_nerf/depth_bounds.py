@@ -0,0 +1,186 @@
+'''
+
+depth_bounds.py
+
+Estimates per-frame near/far bounds from depth maps and writes them into the
+last two columns of poses_bounds.npy, instead of the constant CLOSE_DEPTH /
+FAR_DEPTH of convert2npy.py. The near/far bound of a frame is a low/high
+percentile of its valid depth values, so a few stray pixels do not widen the
+sampling range.
+
+Depth maps are streamed: by default the *_depth92.npz files saved by
+renderFramesBlenderV2.py, in frame order (numbers in the file names are
+compared as numbers, r_100 comes after r_99; one per row of poses_bounds.npy),
+or the frames of a depth store (see depth_store.py), but any iterable of
+(H, W) arrays works. Frames are processed in batches of
+--batch frames, so memory does not grow with the number of frames.
+
+Pixels that are not finite, not positive or at least --max-depth (e.g. the
+background, which Blender renders at a huge depth with film_transparent)
+are ignored. Frames without any valid pixel get the fallback bounds.
+
+Flags:
+    --depth-dir (Directory with the depth maps, or a .depthstore file)
+    --pattern (Glob pattern of the depth maps in --depth-dir, default *_depth92.npz)
+    --npy (poses_bounds.npy file whose bounds are replaced)
+    --output (Where to write the updated file, default overwrites --npy)
+    --near-percentile, --far-percentile (Percentiles used as near/far, default 1 and 99)
+    --max-depth (Depth values at or above this are background, default 1e4)
+    --batch (Number of depth maps processed at a time)
+
+'''
+
+import argparse
+import glob
+import os
+import re
+import sys
+
+import numpy as np
+
+from depth_store import DepthStore, is_depth_store
+
+DEPTH_PATTERN = '*_depth92.npz'
+NEAR_PERCENTILE = 1.
+FAR_PERCENTILE = 99.
+MAX_DEPTH = 1e4
+BATCH_SIZE = 16
+
+
+def natural_key(path):
+    # numbers in the file name compare as numbers, so r_1000 sorts after r_999
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
+
+def find_depth_files(depthDir, pattern=DEPTH_PATTERN):
+    return sorted(glob.glob(os.path.join(depthDir, pattern)), key=natural_key)
+
+def load_depth(depthPath):
+    # .npz as saved by the Blender script (key 'depth'), or a plain .npy (memory-mapped)
+    if depthPath.endswith('.npz'):
+        with np.load(depthPath) as data:
+            key = 'depth' if 'depth' in data.files else data.files[0]
+            return data[key]
+    return np.load(depthPath, mmap_mode='r')
+
+def iter_depth_files(depthPaths):
+    for depthPath in depthPaths:
+        yield load_depth(depthPath)
+
+def _batches(depths, batchSize):
+    # group consecutive depth maps of the same shape into (k, H*W) float32 stacks
+    batch = []
+    for depth in depths:
+        depth = np.asarray(depth, dtype=np.float32)
+        if batch and (len(batch) == batchSize or depth.shape != batch[0].shape):
+            yield np.stack(batch).reshape(len(batch), -1)
+            batch = []
+        batch.append(depth)
+    if batch:
+        yield np.stack(batch).reshape(len(batch), -1)
+
+def batch_percentiles(values, valid, percentiles):
+    '''
+    Per-row percentiles (linear interpolation, as np.percentile) of the valid
+    entries of a (k, n) array.
+
+    Outputs:
+        (k, len(percentiles)), nan for rows without valid entries
+    '''
+    # invalid entries are sorted to the end of each row
+    ordered = np.sort(np.where(valid, values, np.inf), axis=1)
+    numValid = valid.sum(axis=1)
+
+    pos = (np.asarray(percentiles, dtype=float)[None] / 100.) * np.maximum(numValid - 1, 0)[:, None]
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, np.maximum(numValid - 1, 0)[:, None])
+    frac = pos - lo
+    lowValues = np.take_along_axis(ordered, lo, axis=1)
+    highValues = np.take_along_axis(ordered, hi, axis=1)
+
+    with np.errstate(invalid='ignore'):   # inf - inf in rows without valid entries
+        result = lowValues + frac * (highValues - lowValues)
+    result[numValid == 0] = np.nan
+    return result
+
+def estimate_bounds(depths, nearPercentile=NEAR_PERCENTILE, farPercentile=FAR_PERCENTILE, maxDepth=MAX_DEPTH,
+                    batchSize=BATCH_SIZE, fallback=None):
+    '''
+    Inputs:
+        depths: iterable of (H, W) depth maps, one per frame
+        fallback: (near, far) for frames without valid depth, default leaves nan
+
+    Outputs:
+        bounds: (N_frames, 2) [near, far]
+    '''
+    bounds = []
+    for batch in _batches(depths, batchSize):
+        valid = np.isfinite(batch) & (batch > 0) & (batch < maxDepth)
+        bounds.append(batch_percentiles(batch, valid, (nearPercentile, farPercentile)))
+
+    bounds = np.concatenate(bounds, axis=0) if bounds else np.zeros((0, 2))
+    if fallback is not None:
+        missing = np.isnan(bounds).any(axis=1)
+        bounds[missing] = fallback
+    return bounds
+
+def fill_bounds(posesBounds, bounds):
+    # copy of the (N, 17) poses_bounds with the per-frame bounds in the last two columns
+    if len(posesBounds) != len(bounds):
+        raise ValueError('{} poses but {} depth maps'.format(len(posesBounds), len(bounds)))
+    posesBounds = np.array(posesBounds, dtype=float)
+    posesBounds[:, 15:] = bounds
+    return posesBounds
+
+def iter_depth_source(depthSource, pattern=DEPTH_PATTERN):
+    # (number of frames, frame iterator) of a depth store or a directory of depth maps
+    if is_depth_store(depthSource):
+        store = DepthStore(depthSource)
+        return len(store), iter(store)
+
+    depthPaths = find_depth_files(depthSource, pattern)
+    if not depthPaths:
+        raise IOError('no depth maps matching {} in {}'.format(pattern, depthSource))
+    return len(depthPaths), iter_depth_files(depthPaths)
+
+def fill_bounds_from_depth_dir(npyPath, depthDir, outputPath=None, pattern=DEPTH_PATTERN, **kwargs):
+    # depthDir is a directory of depth maps or a depth store
+    numFrames, depths = iter_depth_source(depthDir, pattern)
+
+    posesBounds = np.load(npyPath)
+    # checked before any depth map is read, fill_bounds would only notice after the whole pass
+    if numFrames != len(posesBounds):
+        raise ValueError('{} poses in {} but {} depth maps in {}'.format(len(posesBounds), npyPath, numFrames, depthDir))
+    if 'fallback' not in kwargs:
+        kwargs['fallback'] = posesBounds[:, 15:].mean(axis=0) if len(posesBounds) else None
+    posesBounds = fill_bounds(posesBounds, estimate_bounds(depths, **kwargs))
+
+    with open(outputPath or npyPath, 'wb') as writeFile:
+        np.save(writeFile, posesBounds)
+    return posesBounds
+
+def main(args):
+    if not (args.depth_dir and args.npy):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    posesBounds = fill_bounds_from_depth_dir(args.npy, args.depth_dir, args.output, args.pattern,
+                                             nearPercentile=args.near_percentile, farPercentile=args.far_percentile,
+                                             maxDepth=args.max_depth, batchSize=args.batch)
+    print('near: {:.4f} - {:.4f}, far: {:.4f} - {:.4f} over {} frames'.format(
+        posesBounds[:, 15].min(), posesBounds[:, 15].max(), posesBounds[:, 16].min(), posesBounds[:, 16].max(), len(posesBounds)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--depth-dir', type=str, help='Directory with the depth maps, or a .depthstore file')
+    parser.add_argument('--pattern', type=str, default=DEPTH_PATTERN, help='Glob pattern of the depth maps')
+    parser.add_argument('--npy', type=str, help='poses_bounds.npy file whose bounds are replaced')
+    parser.add_argument('--output', type=str, default=None, help='Where to write the updated poses_bounds.npy')
+    parser.add_argument('--near-percentile', type=float, default=NEAR_PERCENTILE, help='Percentile used as near bound')
+    parser.add_argument('--far-percentile', type=float, default=FAR_PERCENTILE, help='Percentile used as far bound')
+    parser.add_argument('--max-depth', type=float, default=MAX_DEPTH, help='Depth values at or above this are background')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='Number of depth maps processed at a time')
+
+    args = parser.parse_args()
+
+    main(args)
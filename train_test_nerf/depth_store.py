@@ -0,0 +1,245 @@
+'''
+
+depth_store.py
+
+Stores all depth maps of a rendered sequence in one file instead of one
+*_depth92.npz per frame. A store is a data file <name>.depthstore holding
+the frames back to back, plus an index <name>.depthstore.json with the
+frame size, dtype, compression, frame names and chunk offsets.
+
+Without compression the data file is a plain (N, H, W) array, so the reader
+memory-maps it and every frame is a zero-copy view. With compression frames
+are grouped into chunks of chunkFrames frames and every chunk is compressed
+on its own: 'zlib' (level 1, fast) or 'lz4' (needs the lz4 package). Reading
+a frame then decompresses its chunk once and returns views into it.
+
+A writer can continue an existing store (append=True) and drop frames from
+its end (truncate), so interrupted renders can be resumed. merge_depth_stores
+joins the stores of several render shards into one.
+
+Example:
+    with DepthStoreWriter('frames/depth.depthstore', 480, 640) as writer:
+        for name, depth in frames:
+            writer.append(depth, name)
+
+    store = DepthStore('frames/depth.depthstore')
+    depth = store[10]            # (480, 640) view
+    depth = store.frame('r_010')
+
+'''
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+STORE_SUFFIX = '.depthstore'
+STORE_VERSION = 1
+COMPRESSIONS = (None, 'zlib', 'lz4')
+
+
+def _compress(data, compression):
+    if compression == 'zlib':
+        return zlib.compress(data, 1)
+    import lz4.frame
+    return lz4.frame.compress(data)
+
+def _decompress(data, compression):
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    import lz4.frame
+    return lz4.frame.decompress(data)
+
+def index_path(storePath):
+    return storePath + '.json'
+
+def is_depth_store(path):
+    return path.endswith(STORE_SUFFIX) and os.path.isfile(path)
+
+
+class DepthStoreWriter:
+    def __init__(self, storePath, height, width, dtype='float32', compression=None, chunkFrames=16, append=False):
+        # append=True continues an existing store (e.g. when resuming a render) instead of replacing it
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression: {}'.format(compression))
+        if compression == 'lz4':
+            import lz4.frame  # fail early if lz4 is missing
+
+        self.storePath = storePath
+        self.shape = (height, width)
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.chunkFrames = chunkFrames if compression else 1
+
+        self.names = []
+        self.chunks = []    # [offset, size in bytes, number of frames] per chunk
+        self._pending = []
+        self._offset = 0
+
+        if append and os.path.exists(index_path(storePath)):
+            with open(index_path(storePath)) as f:
+                index = json.load(f)
+            if (index['height'], index['width']) != self.shape or np.dtype(index['dtype']) != self.dtype \
+                    or index['compression'] != compression:
+                raise ValueError('cannot append to {}, it stores {}x{} {} frames with compression {}'.format(
+                    storePath, index['height'], index['width'], index['dtype'], index['compression']))
+            self.names = index['names']
+            self.chunks = index['chunks']
+            self._offset = sum(chunk[1] for chunk in self.chunks)
+            # drop anything written after the last flush
+            self._file = open(storePath, 'r+b')
+            self._file.truncate(self._offset)
+            self._file.seek(self._offset)
+        else:
+            self._file = open(storePath, 'wb')
+
+    def append(self, depth, name=None):
+        # depth may be any (H, W) view (e.g. flipped), it is copied once into the file
+        depth = np.asarray(depth)
+        if depth.shape != self.shape:
+            raise ValueError('expected a {} depth map, got {}'.format(self.shape, depth.shape))
+        self.names.append(name if name is not None else '{:06d}'.format(len(self.names)))
+        self._pending.append(np.ascontiguousarray(depth, dtype=self.dtype))
+        if len(self._pending) == self.chunkFrames:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self._pending:
+            return
+        data = b''.join(frame.tobytes() for frame in self._pending) if len(self._pending) > 1 else self._pending[0].data
+        if self.compression:
+            data = _compress(data, self.compression)
+        self._file.write(data)
+        size = len(data) if self.compression else self._pending[0].nbytes
+        self.chunks.append([self._offset, size, len(self._pending)])
+        self._offset += size
+        self._pending = []
+
+    def truncate(self, numFrames):
+        # keep only the first numFrames frames, cuts are only possible at chunk boundaries
+        self._write_chunk()
+        while len(self.names) > numFrames:
+            offset, size, count = self.chunks[-1]
+            if len(self.names) - count < numFrames:
+                raise ValueError('cannot truncate {} to {} frames inside a chunk'.format(self.storePath, numFrames))
+            self.chunks.pop()
+            del self.names[-count:]
+            self._offset = offset
+        self._file.truncate(self._offset)
+        self._file.seek(self._offset)
+        self.flush()
+
+    def flush(self):
+        # write buffered frames and an index covering everything written so far
+        self._write_chunk()
+        self._file.flush()
+        index = {
+            'version': STORE_VERSION,
+            'height': self.shape[0],
+            'width': self.shape[1],
+            'dtype': self.dtype.str,
+            'compression': self.compression,
+            'names': self.names,
+            'chunks': self.chunks,
+        }
+        tmpPath = index_path(self.storePath) + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmpPath, index_path(self.storePath))
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DepthStore:
+    def __init__(self, storePath):
+        with open(index_path(storePath)) as f:
+            index = json.load(f)
+        if index['version'] != STORE_VERSION:
+            raise ValueError('unsupported depth store version {} in {}'.format(index['version'], storePath))
+
+        self.storePath = storePath
+        self.shape = (index['height'], index['width'])
+        self.dtype = np.dtype(index['dtype'])
+        self.compression = index['compression']
+        self.names = index['names']
+        self._nameIdx = {name: i for i, name in enumerate(self.names)}
+
+        chunks = np.array(index['chunks'], dtype=np.int64).reshape(-1, 3)
+        self._chunkOffsets = chunks[:, 0]
+        self._chunkSizes = chunks[:, 1]
+        # index of the first frame of every chunk
+        self._chunkStarts = np.concatenate(([0], np.cumsum(chunks[:, 2])))
+
+        self._frames = None
+        self._cached = (None, None)   # (chunk index, decompressed frames)
+        if self.compression is None and len(self.names):
+            self._frames = np.memmap(storePath, dtype=self.dtype, mode='r', shape=(len(self.names),) + self.shape)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _chunk(self, chunkIdx):
+        if self._cached[0] != chunkIdx:
+            with open(self.storePath, 'rb') as f:
+                f.seek(int(self._chunkOffsets[chunkIdx]))
+                data = _decompress(f.read(int(self._chunkSizes[chunkIdx])), self.compression)
+            self._cached = (chunkIdx, np.frombuffer(data, dtype=self.dtype).reshape((-1,) + self.shape))
+        return self._cached[1]
+
+    def __getitem__(self, i):
+        # (H, W) read-only view of frame i
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('frame {} out of range for {} frames'.format(i, len(self)))
+        if self._frames is not None:
+            return self._frames[i]
+        chunkIdx = int(np.searchsorted(self._chunkStarts, i, side='right')) - 1
+        return self._chunk(chunkIdx)[i - self._chunkStarts[chunkIdx]]
+
+    def frame(self, name):
+        return self[self._nameIdx[name]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def as_array(self):
+        # (N, H, W) memory-mapped array of an uncompressed store
+        if self.compression is not None:
+            raise ValueError('as_array needs an uncompressed depth store')
+        if self._frames is None:
+            return np.zeros((0,) + self.shape, dtype=self.dtype)
+        return self._frames
+
+
+def merge_depth_stores(storePaths, outputPath, names=None, compression=None):
+    # one store with the frames of several stores, in the order of names (default: in store order)
+    stores = [DepthStore(storePath) for storePath in storePaths]
+    sources = {}
+    for store in stores:
+        for name in store.names:
+            sources[name] = store
+    if names is None:
+        names = list(sources)
+    # e.g. frames checkpointed by a render whose depth maps were not flushed, checked before anything is written
+    missing = [name for name in names if name not in sources]
+    if missing:
+        raise ValueError('{} frames are in none of the depth stores {}: {}{}'.format(
+            len(missing), storePaths, ', '.join(missing[:10]), ', ...' if len(missing) > 10 else ''))
+
+    with DepthStoreWriter(outputPath, stores[0].shape[0], stores[0].shape[1], stores[0].dtype, compression) as writer:
+        for name in names:
+            writer.append(sources[name].frame(name), name)
+    return len(names)
@@ -0,0 +1,236 @@
+'''
+
+evaluate_depth.py
+
+Evaluates predicted depth maps against the ground truth depth rendered by
+renderFramesBlenderV2.py, without loading all frames at once. Predicted and
+ground truth frames are paired by name and streamed pair by pair; each
+source is a directory of .npz/.npy depth maps (matched by --pred-pattern /
+--gt-pattern, the name is the part matched by '*', e.g. r_010 for
+r_010_depth92.npz) or a depth store (see depth_store.py).
+
+Per frame, pixels whose ground truth is not finite, not positive or outside
+[--min-depth, --max-depth) are ignored, as are pixels without a positive
+prediction. With --align the prediction is first scaled by
+median(gt) / median(pred) (NeRF depth has an arbitrary scale, e.g. after
+recenter_scale). The metrics are the usual ones of monocular depth
+estimation:
+
+    abs_rel  = mean(|pred - gt| / gt)
+    sq_rel   = mean((pred - gt)^2 / gt)
+    rmse     = sqrt(mean((pred - gt)^2))
+    rmse_log = sqrt(mean((log pred - log gt)^2))
+    delta<t  = fraction of pixels with max(pred / gt, gt / pred) < t, t = 1.25, 1.25^2, 1.25^3
+
+Frames are evaluated in batches by a process pool (--workers), the workers
+open the sources themselves and at most a few batches are in flight. One row
+per frame is written to <output>/depth_eval.csv and the mean and median of
+every metric over all frames to <output>/depth_eval_report.json.
+
+Flags:
+    --pred (Directory or depth store with the predicted depth maps)
+    --gt (Directory or depth store with the ground truth depth maps)
+    --pred-pattern (Glob pattern of the predicted depth maps, default *.npz)
+    --gt-pattern (Glob pattern of the ground truth depth maps, default *_depth92.npz)
+    --align (Scale every prediction by the ratio of the medians)
+    --min-depth, --max-depth (Range of valid ground truth depth)
+    --workers (Number of worker processes, 0 evaluates in this process)
+    --batch (Frames per task)
+    --output (Directory for the csv file and the report)
+
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from depth_bounds import DEPTH_PATTERN, MAX_DEPTH, find_depth_files, load_depth, natural_key
+from depth_store import DepthStore, is_depth_store
+
+PRED_PATTERN = '*.npz'
+MIN_DEPTH = 1e-3
+BATCH_SIZE = 16
+METRICS = ['abs_rel', 'sq_rel', 'rmse', 'rmse_log', 'delta1', 'delta2', 'delta3']
+CSV_FIELDS = ['name', 'pixels', 'scale'] + METRICS
+CSV_FILE = 'depth_eval.csv'
+REPORT_FILE = 'depth_eval_report.json'
+
+
+class DepthDir:
+    # depth maps of a directory by name, the interface of DepthStore used here
+    def __init__(self, depthDir, pattern=DEPTH_PATTERN):
+        prefix, _, suffix = pattern.partition('*')
+        self.paths = {}
+        for depthPath in find_depth_files(depthDir, pattern):
+            filename = os.path.basename(depthPath)
+            self.paths[filename[len(prefix):len(filename) - len(suffix)]] = depthPath
+        self.names = sorted(self.paths, key=natural_key)
+
+    def frame(self, name):
+        return load_depth(self.paths[name])
+
+def open_depth_source(source, pattern=DEPTH_PATTERN):
+    if is_depth_store(source):
+        return DepthStore(source)
+    if not os.path.isdir(source):
+        raise IOError('no depth store or directory at {}'.format(source))
+    return DepthDir(source, pattern)
+
+def paired_names(predSource, gtSource):
+    # names in both sources, in the order of the ground truth
+    predNames = set(predSource.names)
+    names = [name for name in gtSource.names if name in predNames]
+    if not names:
+        raise ValueError('no frame names in common between the predicted and the ground truth depth maps')
+    return names
+
+def match_shape(pred, gt):
+    # a prediction rendered at 1/k of the ground truth size is upsampled (nearest)
+    if pred.shape == gt.shape:
+        return pred
+    fy, fx = gt.shape[0] // pred.shape[0], gt.shape[1] // pred.shape[1]
+    if (pred.shape[0] * fy, pred.shape[1] * fx) != gt.shape:
+        raise ValueError('predicted depth {} does not match ground truth {}'.format(pred.shape, gt.shape))
+    return np.repeat(np.repeat(pred, fy, axis=0), fx, axis=1)
+
+def depth_metrics(pred, gt, align=False, minDepth=MIN_DEPTH, maxDepth=MAX_DEPTH):
+    # metrics of one frame as a dict (NaN without valid pixels), float64 sums over float32 maps
+    gt = np.asarray(gt, dtype=np.float32)
+    pred = match_shape(np.asarray(pred, dtype=np.float32), gt)
+    valid = np.isfinite(gt) & (gt >= minDepth) & (gt < maxDepth) & np.isfinite(pred) & (pred > 0)
+    gt, pred = gt[valid], pred[valid]
+
+    result = {'pixels': int(gt.size), 'scale': 1.}
+    if not gt.size:
+        result.update({metric: float('nan') for metric in METRICS})
+        return result
+    if align:
+        result['scale'] = float(np.median(gt) / np.median(pred))
+        pred = pred * result['scale']
+
+    diff = pred - gt
+    ratio = np.maximum(pred / gt, gt / pred)
+    logDiff = np.log(pred) - np.log(gt)
+    result.update({
+        'abs_rel': float(np.mean(np.abs(diff) / gt, dtype=np.float64)),
+        'sq_rel': float(np.mean(diff ** 2 / gt, dtype=np.float64)),
+        'rmse': float(np.sqrt(np.mean(diff ** 2, dtype=np.float64))),
+        'rmse_log': float(np.sqrt(np.mean(logDiff ** 2, dtype=np.float64))),
+        'delta1': float(np.mean(ratio < 1.25)),
+        'delta2': float(np.mean(ratio < 1.25 ** 2)),
+        'delta3': float(np.mean(ratio < 1.25 ** 3)),
+    })
+    return result
+
+
+def evaluate_names(predSource, gtSource, names, options):
+    rows = []
+    for name in names:
+        row = depth_metrics(predSource.frame(name), gtSource.frame(name), **options)
+        row['name'] = name
+        rows.append(row)
+    return rows
+
+
+_WORKER_STATE = None
+
+def _init_worker(pred, gt, predPattern, gtPattern, options):
+    global _WORKER_STATE
+    _WORKER_STATE = (open_depth_source(pred, predPattern), open_depth_source(gt, gtPattern), options)
+
+def _evaluate_batch(names):
+    predSource, gtSource, options = _WORKER_STATE
+    return evaluate_names(predSource, gtSource, names, options)
+
+def evaluate_depth(pred, gt, predPattern=PRED_PATTERN, gtPattern=DEPTH_PATTERN, align=False, minDepth=MIN_DEPTH,
+                   maxDepth=MAX_DEPTH, workers=0, batchSize=BATCH_SIZE, maxPending=None):
+    # yields the metrics of every paired frame, in the order of the ground truth
+    options = {'align': align, 'minDepth': minDepth, 'maxDepth': maxDepth}
+    predSource, gtSource = open_depth_source(pred, predPattern), open_depth_source(gt, gtPattern)
+    names = paired_names(predSource, gtSource)
+    batches = [names[s:s + batchSize] for s in range(0, len(names), batchSize)]
+
+    if not workers:
+        for batch in batches:
+            for row in evaluate_names(predSource, gtSource, batch, options):
+                yield row
+        return
+
+    maxPending = maxPending or 2 * workers
+    initargs = (pred, gt, predPattern, gtPattern, options)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_evaluate_batch, batch))
+            if len(pending) >= maxPending:
+                for row in pending.popleft().result():
+                    yield row
+        while pending:
+            for row in pending.popleft().result():
+                yield row
+
+def aggregate(rows):
+    # mean and median of every metric over the frames with valid pixels
+    valid = [row for row in rows if row['pixels']]
+    report = {'frames': len(rows), 'frames_without_valid_pixels': len(rows) - len(valid),
+              'pixels': int(sum(row['pixels'] for row in valid))}
+    for metric in METRICS + ['scale']:
+        values = np.array([row[metric] for row in valid], dtype=float)
+        report[metric] = {'mean': float(values.mean()) if len(values) else None,
+                          'median': float(np.median(values)) if len(values) else None}
+    return report
+
+def evaluate_to_files(pred, gt, outputDir, **kwargs):
+    # streams the per-frame rows into the csv file, then writes the report
+    os.makedirs(outputDir, exist_ok=True)
+    rows = []
+    with open(os.path.join(outputDir, CSV_FILE), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in evaluate_depth(pred, gt, **kwargs):
+            writer.writerow(row)
+            # only the scalar metrics of every frame are kept for the report
+            rows.append(row)
+
+    report = aggregate(rows)
+    with open(os.path.join(outputDir, REPORT_FILE), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+def main(args):
+    if not (args.pred and args.gt):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    report = evaluate_to_files(args.pred, args.gt, args.output, predPattern=args.pred_pattern, gtPattern=args.gt_pattern,
+                               align=args.align, minDepth=args.min_depth, maxDepth=args.max_depth, workers=args.workers,
+                               batchSize=args.batch)
+    print('{} frames ({} without valid pixels), {} pixels'.format(report['frames'], report['frames_without_valid_pixels'],
+                                                                   report['pixels']))
+    for metric in METRICS:
+        if report[metric]['mean'] is not None:
+            print('{:<10}mean {:.4f}  median {:.4f}'.format(metric, report[metric]['mean'], report[metric]['median']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--pred', type=str, help='Directory or depth store with the predicted depth maps')
+    parser.add_argument('--gt', type=str, help='Directory or depth store with the ground truth depth maps')
+    parser.add_argument('--pred-pattern', type=str, default=PRED_PATTERN, help='Glob pattern of the predicted depth maps')
+    parser.add_argument('--gt-pattern', type=str, default=DEPTH_PATTERN, help='Glob pattern of the ground truth depth maps')
+    parser.add_argument('--align', action='store_true', help='Scale every prediction by the ratio of the medians')
+    parser.add_argument('--min-depth', type=float, default=MIN_DEPTH, help='Smallest valid ground truth depth')
+    parser.add_argument('--max-depth', type=float, default=MAX_DEPTH, help='Ground truth depth at or above this is invalid')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes, 0 evaluates here')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='Frames per task')
+    parser.add_argument('--output', type=str, default=os.getcwd(), help='Directory for the csv file and the report')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,272 @@
+'''
+
+novel_views.py
+
+Camera paths for novel views around the poses of poses_bounds.npy, and a
+tiled driver that renders them through a radiance field (see
+volume_rendering.py).
+
+Paths ((N, 3, 4) "right up back" camera-to-world poses, as load_llff_cameras):
+    spiral_path:       spiral around the average pose (average_poses), looking
+                       at a focus point in front of it, as nerf_pl's
+                       create_spiral_poses
+    interpolate_poses: fly-through between recorded poses, rotations by
+                       SLERP, positions linear ('slerp') or on a Catmull-Rom
+                       spline ('spline')
+
+TiledRenderer splits every frame into tiles of tileSize x tileSize pixels
+and renders them serially or in a process pool. Each process writes the rays
+of a tile into one reused buffer, at most maxPending tiles are in flight and
+finished frames are written to disk right away, so memory stays constant
+however long the path is. Every frame is saved as <name>.npz with rgb
+(uint8), depth (key 'depth', as the *_depth92.npz files) and opacity; frames
+already on disk are skipped when resume is set.
+
+Run from the command line, the path is saved as path.npy and rendered
+through the analytic TubeField, to check paths and the driver without a
+trained network.
+
+Flags:
+    --npy (poses_bounds.npy with the recorded poses)
+    --variant (Camera variant of load_llff_cameras, default recenter_scale)
+    --path (spiral, slerp or spline)
+    --frames (Number of frames of the path)
+    --key-step (Use every key-step-th recorded pose as key frame of slerp/spline paths)
+    --rotations (Turns of the spiral)
+    --downscale (Render at 1/downscale of the image size)
+    --tile (Tile size in pixels)
+    --samples (Samples per ray)
+    --workers (Processes rendering tiles, 0 renders in this process)
+    --output (Directory for the rendered frames)
+
+'''
+
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pose_transforms import center_poses
+from ray_generation import VARIANTS, get_ray_directions, load_llff_cameras
+from volume_rendering import TubeField, render_rays
+
+PATHS = ('spiral', 'slerp', 'spline')
+NUM_FRAMES = 120
+TILE_SIZE = 64
+NAME_FORMAT = 'r_{0:03d}'
+
+
+def spiral_path(c2w, bounds, numFrames=NUM_FRAMES, numRotations=2, radiusScale=1., focusDepth=None):
+    '''
+    Inputs:
+        c2w: (N, 3, 4) recorded poses
+        bounds: (N, 2) near/far of the recorded poses, in the same scale
+        focusDepth: distance of the point the cameras look at, default as in NeRF's render_path_spiral
+
+    Outputs:
+        poses: (numFrames, 3, 4), in the frame of c2w
+    '''
+    centered, avg_inv = center_poses(np.asarray(c2w, dtype=float)[:, :3])
+    radii = np.percentile(np.abs(centered[..., 3]), 90, axis=0) * radiusScale
+    if focusDepth is None:
+        # weighted harmonic mean of a close and a far depth
+        close, far = np.min(bounds) * .9, np.max(bounds) * 5.
+        dt = .75
+        focusDepth = 1. / ((1. - dt) / close + dt / far)
+
+    t = np.linspace(0, 2 * np.pi * numRotations, numFrames, endpoint=False)
+    centers = np.stack((np.cos(t), -np.sin(t), -np.sin(0.5 * t)), axis=1) * radii
+    z = centers - np.array([0, 0, -focusDepth])
+    z /= np.linalg.norm(z, axis=1, keepdims=True)
+    x = np.cross([0, 1, 0], z)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    y = np.cross(z, x)
+
+    poses = np.zeros((numFrames, 4, 4))
+    poses[:, :3] = np.stack((x, y, z, centers), axis=2)
+    poses[:, 3, 3] = 1
+    # back from the frame of the average pose
+    return (np.linalg.inv(avg_inv) @ poses)[:, :3]
+
+def catmull_rom(points, u):
+    # (K, 3) control points evaluated at parameters u in [0, K - 1], the spline passes through every point
+    points = np.asarray(points, dtype=float)
+    padded = np.concatenate((points[:1], points, points[-1:]))
+    seg = np.clip(np.floor(u).astype(int), 0, len(points) - 2)
+    t = (u - seg)[:, None]
+    p0, p1, p2, p3 = (padded[seg + k] for k in range(4))
+    return 0.5 * (2 * p1 + (p2 - p0) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2
+                  + (3 * p1 - p0 - 3 * p2 + p3) * t ** 3)
+
+def interpolate_poses(c2w, numFrames=NUM_FRAMES, mode='slerp', keyStep=1):
+    '''
+    numFrames poses through every keyStep-th pose of c2w, evenly spaced in
+    key frames. Rotations are SLERPed, positions are interpolated linearly
+    (mode 'slerp') or on a Catmull-Rom spline (mode 'spline').
+    '''
+    from scipy.spatial.transform import Rotation as R, Slerp
+
+    if mode not in ('slerp', 'spline'):
+        raise ValueError('unknown interpolation mode: {}'.format(mode))
+    keys = np.asarray(c2w, dtype=float)[::keyStep, :3]
+    if len(keys) < 2:
+        raise ValueError('interpolation needs at least 2 key poses, got {}'.format(len(keys)))
+
+    u = np.linspace(0., len(keys) - 1, numFrames)
+    if mode == 'spline':
+        positions = catmull_rom(keys[:, :, 3], u)
+    else:
+        positions = np.stack([np.interp(u, np.arange(len(keys)), keys[:, k, 3]) for k in range(3)], axis=1)
+
+    poses = np.empty((numFrames, 3, 4))
+    poses[:, :, :3] = Slerp(np.arange(len(keys)), R.from_matrix(keys[:, :, :3]))(u).as_matrix()
+    poses[:, :, 3] = positions
+    return poses
+
+def make_path(path, c2w, bounds, numFrames=NUM_FRAMES, keyStep=1, numRotations=2):
+    if path == 'spiral':
+        return spiral_path(c2w, bounds, numFrames, numRotations)
+    if path in ('slerp', 'spline'):
+        return interpolate_poses(c2w, numFrames, path, keyStep)
+    raise ValueError('unknown path: {}'.format(path))
+
+def frame_path(outputDir, name):
+    return os.path.join(outputDir, name + '.npz')
+
+def save_frame(framePath, rgb, depth, opacity):
+    # written to a temporary file first, a frame on disk is always complete
+    tmpPath = framePath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        np.savez(f, rgb=np.round(np.clip(rgb, 0., 1.) * 255).astype(np.uint8), depth=depth, opacity=opacity)
+    os.replace(tmpPath, framePath)
+
+
+class TiledRenderer:
+    def __init__(self, field, H, W, focal, tileSize=TILE_SIZE, **renderKwargs):
+        # renderKwargs are passed on to render_rays (numSamples, threshold, ...)
+        self.field = field
+        self.H, self.W, self.focal = H, W, focal
+        self.tileSize = tileSize
+        self.renderKwargs = renderKwargs
+        self.directions = get_ray_directions(H, W, focal)
+        self.tiles = [(y, min(y + tileSize, H), x, min(x + tileSize, W))
+                      for y in range(0, H, tileSize) for x in range(0, W, tileSize)]
+        self.buffer = None
+
+    def __getstate__(self):
+        # every process allocates its own ray buffer
+        state = self.__dict__.copy()
+        state['buffer'] = None
+        return state
+
+    def render_tile(self, c2w, bounds, tile):
+        y0, y1, x0, x1 = tile
+        if self.buffer is None:
+            self.buffer = np.empty((self.tileSize * self.tileSize, 8), dtype=np.float32)
+        rays = self.buffer[:(y1 - y0) * (x1 - x0)]
+        np.matmul(self.directions[y0:y1, x0:x1].reshape(-1, 3), np.asarray(c2w)[:3, :3].T, out=rays[:, 3:6])
+        rays[:, :3] = np.asarray(c2w)[:3, 3]
+        rays[:, 6:] = bounds
+        results = render_rays(self.field, rays, **self.renderKwargs)
+        return tile, results['rgb'], results['depth'], results['opacity']
+
+    def render_path(self, c2w, bounds, outputDir, names=None, workers=0, resume=True, maxPending=None):
+        '''
+        Renders the (N, 3, 4) poses with their (N, 2) or (2,) near/far bounds
+        into outputDir, yields the name of every written frame.
+        '''
+        os.makedirs(outputDir, exist_ok=True)
+        bounds = np.broadcast_to(bounds, (len(c2w), 2))
+        names = names or [NAME_FORMAT.format(k) for k in range(len(c2w))]
+        todo = [k for k in range(len(c2w)) if not (resume and os.path.exists(frame_path(outputDir, names[k])))]
+        tasks = ((k, tile) for k in todo for tile in self.tiles)
+
+        rgb = np.empty((self.H, self.W, 3), dtype=np.float32)
+        depth = np.empty((self.H, self.W), dtype=np.float32)
+        opacity = np.empty((self.H, self.W), dtype=np.float32)
+        numTiles = [0]
+
+        def collect(k, result):
+            # tiles arrive in order, a frame is complete after its last tile
+            (y0, y1, x0, x1), tileRgb, tileDepth, tileOpacity = result
+            rgb[y0:y1, x0:x1] = tileRgb.reshape(y1 - y0, x1 - x0, 3)
+            depth[y0:y1, x0:x1] = tileDepth.reshape(y1 - y0, x1 - x0)
+            opacity[y0:y1, x0:x1] = tileOpacity.reshape(y1 - y0, x1 - x0)
+            numTiles[0] += 1
+            if numTiles[0] < len(self.tiles):
+                return None
+            numTiles[0] = 0
+            save_frame(frame_path(outputDir, names[k]), rgb, depth, opacity)
+            return names[k]
+
+        if not workers:
+            for k, tile in tasks:
+                name = collect(k, self.render_tile(c2w[k], bounds[k], tile))
+                if name:
+                    yield name
+            return
+
+        maxPending = maxPending or 4 * workers
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as pool:
+            pending = deque()
+            for k, tile in tasks:
+                pending.append((k, pool.submit(_worker_tile, c2w[k], bounds[k], tile)))
+                if len(pending) >= maxPending:
+                    k, future = pending.popleft()
+                    name = collect(k, future.result())
+                    if name:
+                        yield name
+            while pending:
+                k, future = pending.popleft()
+                name = collect(k, future.result())
+                if name:
+                    yield name
+
+
+_WORKER_RENDERER = None
+
+def _init_worker(renderer):
+    global _WORKER_RENDERER
+    _WORKER_RENDERER = renderer
+
+def _worker_tile(c2w, bounds, tile):
+    return _WORKER_RENDERER.render_tile(c2w, bounds, tile)
+
+def main(args):
+    if not args.npy:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    c2w, bounds, H, W, focal = load_llff_cameras(args.npy, args.variant)
+    poses = make_path(args.path, c2w, bounds, args.frames, args.key_step, args.rotations)
+    os.makedirs(args.output, exist_ok=True)
+    np.save(os.path.join(args.output, 'path.npy'), poses)
+
+    H, W, focal = H // args.downscale, W // args.downscale, focal / args.downscale
+    renderer = TiledRenderer(TubeField(), H, W, focal, args.tile, numSamples=args.samples)
+    # bounds of the recorded poses for every novel view
+    pathBounds = (bounds[:, 0].min(), bounds[:, 1].max())
+    for name in renderer.render_path(poses, pathBounds, args.output, workers=args.workers):
+        print('rendered {}'.format(name))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--npy', type=str, help='poses_bounds.npy with the recorded poses')
+    parser.add_argument('--variant', type=str, default='recenter_scale', choices=VARIANTS, help='Camera variant')
+    parser.add_argument('--path', type=str, default='spiral', choices=PATHS, help='Camera path')
+    parser.add_argument('--frames', type=int, default=NUM_FRAMES, help='Number of frames of the path')
+    parser.add_argument('--key-step', type=int, default=1, help='Use every key-step-th recorded pose as key frame')
+    parser.add_argument('--rotations', type=float, default=2, help='Turns of the spiral')
+    parser.add_argument('--downscale', type=int, default=1, help='Render at 1/downscale of the image size')
+    parser.add_argument('--tile', type=int, default=TILE_SIZE, help='Tile size in pixels')
+    parser.add_argument('--samples', type=int, default=64, help='Samples per ray')
+    parser.add_argument('--workers', type=int, default=0, help='Processes rendering tiles, 0 renders in this process')
+    parser.add_argument('--output', type=str, default='novel_views', help='Directory for the rendered frames')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,254 @@
+'''
+
+pack_images.py
+
+Packs a poses_bounds.npy and its images folder (the layout expected by
+nerf_pl, see the README) into one image pack, so training does not decode
+thousands of PNGs every run. A pack is a data file <name>.imagepack holding
+all frames as one uint8 (N, H, W, 3) array, plus an index
+<name>.imagepack.json with the frame size, the image names, the
+poses_bounds rows of the frames (hwf adjusted to the packed size) and the
+time spent decoding the images.
+
+Images are matched to the rows of poses_bounds.npy in sorted name order, as
+nerf_pl does. Before anything is decoded the size of every image is
+checked against the height/width of its row (IMAGE_VEC in convert2npy.py
+has to match the images). With --downscale the frames are reduced by an
+integer factor (mean of factor x factor blocks) and the hwf column is scaled
+with them. Images are decoded in a process pool with --workers processes.
+
+PIL or imageio is needed to decode the images (imported when first used);
+reading a pack needs only numpy. ImagePack memory-maps the data file and
+RayBatchLoader draws random ray batches (rays of ray_generation.py with
+their pixel colors) straight from the mapped frames.
+
+Example:
+    pack = ImagePack('frames.imagepack')
+    loader = RayBatchLoader(pack, batchSize=1024)
+    for rays, rgbs in loader.epoch_batches():
+        ...   # (1024, 8) and (1024, 3) views, valid until the next batch
+
+Flags:
+    --npy (poses_bounds.npy of the images)
+    --images (Folder with the images)
+    --output (Path of the image pack, default <folder of --npy>/images.imagepack)
+    --downscale (Integer factor the images are reduced by)
+    --workers (Processes decoding the images, 0 decodes in this process)
+
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pose_store import PoseStore
+from ray_generation import RayGenerator, load_llff_cameras
+
+PACK_SUFFIX = '.imagepack'
+PACK_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+RAY_BATCH_SIZE = 1024
+
+
+def index_path(packPath):
+    return packPath + '.json'
+
+def find_images(imageDir):
+    return sorted(os.path.join(imageDir, filename) for filename in os.listdir(imageDir)
+                  if filename.lower().endswith(IMAGE_EXTENSIONS))
+
+def read_image(imagePath):
+    # (H, W, 3) uint8, with PIL if installed, else imageio
+    try:
+        from PIL import Image
+    except ImportError:
+        import imageio
+        image = np.asarray(imageio.imread(imagePath))
+        if image.ndim == 2:
+            image = np.stack((image,) * 3, axis=-1)
+        return np.ascontiguousarray(image[..., :3], dtype=np.uint8)
+    with Image.open(imagePath) as image:
+        return np.asarray(image.convert('RGB'))
+
+def image_size(imagePath):
+    # (height, width) from the header with PIL, imageio has to decode the image
+    try:
+        from PIL import Image
+    except ImportError:
+        return read_image(imagePath).shape[:2]
+    with Image.open(imagePath) as image:
+        return image.size[1], image.size[0]
+
+def downsample(image, factor):
+    # mean of factor x factor blocks, rounded back to uint8
+    if factor == 1:
+        return image
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor, -1)
+    return np.round(blocks.mean(axis=(1, 3))).astype(np.uint8)
+
+def validate_sizes(imagePaths, hwf):
+    # every image has to have the height/width of its poses_bounds row
+    if len(imagePaths) != len(hwf):
+        raise ValueError('{} images but {} poses'.format(len(imagePaths), len(hwf)))
+    mismatched = []
+    for imagePath, (H, W, _) in zip(imagePaths, hwf):
+        size = image_size(imagePath)
+        if size != (int(H), int(W)):
+            mismatched.append('{} is {}x{}, poses_bounds says {}x{}'.format(
+                os.path.basename(imagePath), size[0], size[1], int(H), int(W)))
+    if mismatched:
+        raise ValueError('{} images do not match the hwf column (IMAGE_VEC in convert2npy.py), e.g. {}'.format(
+            len(mismatched), mismatched[0]))
+
+def decode_frame(job):
+    # (frame, seconds spent decoding and downsampling)
+    imagePath, factor = job
+    start = time.perf_counter()
+    frame = downsample(read_image(imagePath), factor)
+    return frame, time.perf_counter() - start
+
+def _iter_decoded(jobs, workers, maxPending=None):
+    # decoded frames in order, with at most maxPending images in flight
+    if not workers:
+        for job in jobs:
+            yield decode_frame(job)
+        return
+
+    maxPending = maxPending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(decode_frame, job))
+            if len(pending) >= maxPending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def pack_images(npyPath, imageDir, packPath, downscale=1, workers=0):
+    # writes the image pack and returns its index
+    store = PoseStore(npyPath)
+    imagePaths = find_images(imageDir)
+    if not imagePaths:
+        raise IOError('no images in {}'.format(imageDir))
+    validate_sizes(imagePaths, store.hwf)
+
+    posesBounds = np.array(store.data, dtype=float)
+    hwf = posesBounds[:, :15].reshape(-1, 3, 5)[:, :, 4]
+    hwf[:, 0] = hwf[:, 0].astype(int) // downscale
+    hwf[:, 1] = hwf[:, 1].astype(int) // downscale
+    hwf[:, 2] /= downscale
+    sizes = {(int(H), int(W)) for H, W in hwf[:, :2]}
+    if len(sizes) > 1:
+        raise ValueError('all frames of a pack need the same size, got {}'.format(sorted(sizes)))
+    H, W = sizes.pop()
+
+    # the data file is written under a temporary name and the index last, a pack on disk is always complete
+    decodeSeconds = 0.
+    tmpPath = packPath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        for frame, seconds in _iter_decoded([(imagePath, downscale) for imagePath in imagePaths], workers):
+            if frame.shape != (H, W, 3):
+                raise ValueError('decoded frame of {}x{}, expected {}x{}'.format(frame.shape[0], frame.shape[1], H, W))
+            f.write(frame.tobytes())
+            decodeSeconds += seconds
+    os.replace(tmpPath, packPath)
+
+    index = {
+        'version': PACK_VERSION,
+        'height': H,
+        'width': W,
+        'downscale': downscale,
+        'names': [os.path.basename(imagePath) for imagePath in imagePaths],
+        'poses_bounds': posesBounds.tolist(),
+        'decode_seconds': decodeSeconds,
+    }
+    with open(index_path(packPath) + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path(packPath) + '.tmp', index_path(packPath))
+    return index
+
+
+class ImagePack:
+    def __init__(self, packPath):
+        with open(index_path(packPath)) as f:
+            index = json.load(f)
+        if index['version'] != PACK_VERSION:
+            raise ValueError('unsupported image pack version {} in {}'.format(index['version'], packPath))
+
+        self.packPath = packPath
+        self.shape = (index['height'], index['width'], 3)
+        self.names = index['names']
+        self.downscale = index['downscale']
+        self.decodeSeconds = index['decode_seconds']
+        self.posesBounds = np.array(index['poses_bounds'], dtype=float).reshape(-1, 17)
+        self.frames = np.memmap(packPath, dtype=np.uint8, mode='r', shape=(len(self.names),) + self.shape)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        # (H, W, 3) uint8 read-only view of frame i
+        return self.frames[i]
+
+    def cameras(self, variant='recenter_scale', focal=None):
+        # c2w, bounds, H, W, focal of the frames, see ray_generation.load_llff_cameras
+        return load_llff_cameras(self.posesBounds, variant, focal)
+
+
+class RayBatchLoader:
+    def __init__(self, pack, batchSize=RAY_BATCH_SIZE, variant='recenter_scale', focal=None, ndc=False, seed=None):
+        c2w, bounds, H, W, focal = pack.cameras(variant, focal)
+        self.generator = RayGenerator(c2w, H, W, focal, bounds, ndc=ndc)
+        self.pixels = pack.frames.reshape(-1, 3)
+        self.batchSize = batchSize
+        self.rng = np.random.default_rng(seed)
+        self.rays = np.empty((batchSize, 8), dtype=np.float32)
+        self.rgbs = np.empty((batchSize, 3), dtype=np.float32)
+
+    def __len__(self):
+        # batches per epoch
+        return len(self.generator) // self.batchSize
+
+    def batch(self):
+        # random rays with their colors in [0, 1], views of reused buffers
+        # sorted indices read the mapped frames front to back
+        indices = np.sort(self.rng.integers(0, len(self.generator), self.batchSize))
+        self.generator.rays_at(indices, out=self.rays)
+        np.multiply(self.pixels[indices], 1. / 255., out=self.rgbs)
+        return self.rays, self.rgbs
+
+    def epoch_batches(self):
+        for _ in range(len(self)):
+            yield self.batch()
+
+
+def main(args):
+    if not (args.npy and args.images):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    packPath = args.output or os.path.join(os.path.dirname(os.path.abspath(args.npy)), 'images' + PACK_SUFFIX)
+    index = pack_images(args.npy, args.images, packPath, args.downscale, args.workers)
+    print('packed {} frames of {}x{} into {} ({:.1f} MB), {:.2f} s of decoding saved per epoch'.format(
+        len(index['names']), index['height'], index['width'], packPath, os.path.getsize(packPath) / 2 ** 20,
+        index['decode_seconds']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--npy', type=str, help='poses_bounds.npy of the images')
+    parser.add_argument('--images', type=str, help='Folder with the images')
+    parser.add_argument('--output', type=str, default=None, help='Path of the image pack')
+    parser.add_argument('--downscale', type=int, default=1, help='Integer factor the images are reduced by')
+    parser.add_argument('--workers', type=int, default=0, help='Processes decoding the images, 0 decodes here')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,272 @@
+'''
+
+point_sampling.py
+
+Places the sample points of NeRF rays (see ray_generation.py) between their
+near and far bounds, on the CPU:
+
+    sample_stratified:    evenly spaced in depth, jittered within each bin
+    sample_inverse_depth: evenly spaced in inverse depth (lindisp in nerf_pl)
+    sample_pdf:           importance (hierarchical) sampling of the bins of a
+                          coarse pass, weighted e.g. by its rendering weights
+
+In endoscopy scenes most of a ray passes through the empty lumen. An
+OccupancyGrid marks the voxels that can contain a surface, built either
+from rendered depth maps (from_depths, e.g. the *_depth92.npz files of the
+Blender renders) or from the camera frusta (from_frusta, everything any
+camera sees between its near and far bound). skip_empty masks the samples
+in empty voxels, so only the remaining ones need network queries;
+sample_occupied instead clips the rays to the grid, probes them densely (grid
+lookups are cheap) and places all samples inside occupied voxels.
+
+All sampling functions work on (n_rays, ...) float32 arrays and are
+vectorized over rays; t values are distances along the (unit) ray
+directions of ray_generation.py.
+
+'''
+
+import itertools
+
+import numpy as np
+
+from depth_bounds import MAX_DEPTH
+
+GRID_RESOLUTION = 128
+
+
+def _bin_positions(numSamples, perturb, rng, numRays):
+    # (numRays, numSamples) positions in [0, 1], jittered within their bin if perturb
+    steps = np.linspace(0., 1., numSamples, dtype=np.float32)
+    if not perturb:
+        return np.broadcast_to(steps, (numRays, numSamples))
+    mids = 0.5 * (steps[1:] + steps[:-1])
+    upper = np.concatenate((mids, steps[-1:]))
+    lower = np.concatenate((steps[:1], mids))
+    rng = rng or np.random.default_rng()
+    return lower + (upper - lower) * rng.random((numRays, numSamples), dtype=np.float32)
+
+def sample_stratified(near, far, numSamples, perturb=True, rng=None):
+    '''
+    Inputs:
+        near, far: (n_rays,) bounds
+
+    Outputs:
+        t: (n_rays, numSamples) float32, sorted along each ray
+    '''
+    near = np.asarray(near, dtype=np.float32)[:, None]
+    far = np.asarray(far, dtype=np.float32)[:, None]
+    steps = _bin_positions(numSamples, perturb, rng, len(near))
+    return near * (1. - steps) + far * steps
+
+def sample_inverse_depth(near, far, numSamples, perturb=True, rng=None):
+    # evenly spaced in 1/t, more samples close to the camera
+    near = np.asarray(near, dtype=np.float32)[:, None]
+    far = np.asarray(far, dtype=np.float32)[:, None]
+    steps = _bin_positions(numSamples, perturb, rng, len(near))
+    return 1. / (1. / near * (1. - steps) + 1. / far * steps)
+
+def sample_pdf(bins, weights, numSamples, det=False, rng=None, eps=1e-5):
+    '''
+    Importance sampling as in nerf_pl/models/rendering.py (sample_pdf).
+
+    Inputs:
+        bins: (n_rays, n_bins + 1) bin edges along each ray
+        weights: (n_rays, n_bins) weight of every bin
+        det: evenly spaced instead of stratified random samples
+
+    Outputs:
+        t: (n_rays, numSamples) float32, sorted along each ray
+    '''
+    bins = np.asarray(bins, dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float32) + eps   # prevent division by zero
+    numRays, numBins = weights.shape
+
+    pdf = weights / weights.sum(axis=1, keepdims=True)
+    cdf = np.concatenate((np.zeros((numRays, 1), dtype=np.float32), np.cumsum(pdf, axis=1)), axis=1)
+
+    # one uniform sample per stratum of [0, 1], already sorted, which keeps searchsorted cache friendly
+    u = _bin_positions(numSamples, not det, rng, numRays)
+
+    # searchsorted of every row at once: rows are moved apart by an offset larger than the cdf range
+    offset = 2. * np.arange(numRays)[:, None]
+    inds = np.searchsorted((cdf + offset).ravel(), (u + offset).ravel(), side='right').reshape(numRays, numSamples)
+    inds -= (numBins + 1) * np.arange(numRays)[:, None]
+    below = np.clip(inds - 1, 0, numBins)
+    above = np.clip(inds, 0, numBins)
+
+    cdf_g0 = np.take_along_axis(cdf, below, axis=1)
+    cdf_g1 = np.take_along_axis(cdf, above, axis=1)
+    bins_g0 = np.take_along_axis(bins, below, axis=1)
+    bins_g1 = np.take_along_axis(bins, above, axis=1)
+
+    denom = cdf_g1 - cdf_g0
+    denom[denom < eps] = 1   # the bin has zero weight and will not be sampled anyway
+    return bins_g0 + (u - cdf_g0) / denom * (bins_g1 - bins_g0)
+
+def points_along_rays(rays_o, rays_d, t):
+    # (n_rays, n_samples, 3) sample points
+    return rays_o[:, None, :] + t[..., None] * rays_d[:, None, :]
+
+def ray_aabb(rays_o, rays_d, aabbMin, aabbMax):
+    # entry and exit distance of every ray in the box, tmin > tmax if it misses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = 1. / rays_d
+        t0 = (aabbMin - rays_o) * inv
+        t1 = (aabbMax - rays_o) * inv
+    tmin = np.nanmax(np.minimum(t0, t1), axis=1)
+    tmax = np.nanmin(np.maximum(t0, t1), axis=1)
+    return tmin, tmax
+
+def frustum_corners(c2w, H, W, focal, bounds):
+    # (N, 8, 3) corners of the camera frusta between near and far ("right up back" poses)
+    x, y = W / (2. * focal), H / (2. * focal)
+    dirs = np.array([[-x, -y, -1.], [x, -y, -1.], [x, y, -1.], [-x, y, -1.]])
+    depths = np.asarray(bounds, dtype=float).reshape(-1, 2)
+    local = np.concatenate((dirs[None] * depths[:, :1, None], dirs[None] * depths[:, 1:, None]), axis=1)
+    return np.einsum('nij,nkj->nki', c2w[:, :3, :3], local) + c2w[:, None, :3, 3]
+
+
+class OccupancyGrid:
+    def __init__(self, aabbMin, aabbMax, resolution=GRID_RESOLUTION):
+        self.aabbMin = np.asarray(aabbMin, dtype=np.float32).reshape(3)
+        self.aabbMax = np.asarray(aabbMax, dtype=np.float32).reshape(3)
+        self.resolution = np.broadcast_to(np.asarray(resolution, dtype=int), (3,)).copy()
+        self.voxelSize = (self.aabbMax - self.aabbMin) / self.resolution
+        self.grid = np.zeros(tuple(self.resolution), dtype=bool)
+
+    @classmethod
+    def around_cameras(cls, c2w, H, W, focal, bounds, resolution=GRID_RESOLUTION):
+        # grid over the bounding box of all camera frusta
+        corners = frustum_corners(c2w, H, W, focal, bounds).reshape(-1, 3)
+        return cls(corners.min(axis=0), corners.max(axis=0), resolution)
+
+    def voxel_indices(self, points):
+        # (..., 3) integer voxel of every point and whether it is inside the grid
+        idx = np.floor((points - self.aabbMin) / self.voxelSize).astype(np.int64)
+        inside = np.all((idx >= 0) & (idx < self.resolution), axis=-1)
+        return idx, inside
+
+    def mark_points(self, points):
+        idx, inside = self.voxel_indices(np.asarray(points, dtype=np.float32).reshape(-1, 3))
+        idx = idx[inside]
+        self.grid[idx[:, 0], idx[:, 1], idx[:, 2]] = True
+
+    def dilate(self, iterations=1):
+        # grow the occupied voxels by one voxel per iteration (6-neighborhood), covers depth noise
+        for _ in range(iterations):
+            grown = self.grid.copy()
+            for axis in range(3):
+                lo = [slice(None)] * 3
+                hi = [slice(None)] * 3
+                lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+                grown[tuple(lo)] |= self.grid[tuple(hi)]
+                grown[tuple(hi)] |= self.grid[tuple(lo)]
+            self.grid = grown
+        return self
+
+    def query(self, points):
+        # occupancy of (..., 3) points, points outside the grid are empty
+        scaled = (points - self.aabbMin) / self.voxelSize
+        inside = np.all((scaled >= 0) & (scaled < self.resolution), axis=-1)
+        # flat voxel index, outside points are clamped to voxel 0 and masked afterwards
+        idx = scaled.astype(np.int32)
+        np.clip(idx, 0, self.resolution - 1, out=idx)
+        flat = (idx[..., 0] * self.resolution[1] + idx[..., 1]) * self.resolution[2] + idx[..., 2]
+        return self.grid.ravel()[flat] & inside
+
+    def occupied_fraction(self):
+        return float(self.grid.mean())
+
+    @classmethod
+    def from_depths(cls, c2w, depths, focal, bounds, resolution=GRID_RESOLUTION, stride=1, depthScale=1.,
+                    maxDepth=MAX_DEPTH, dilation=1):
+        '''
+        Marks the surface points seen in depth maps (z-depth along the camera
+        axis, as rendered by Blender), one map per camera of c2w, streamed.
+        For poses scaled by load_llff_cameras(variant='recenter_scale') pass
+        depthScale = 1 / scale_factor. Every stride-th pixel is used; larger
+        strides are faster but can miss surfaces seen at grazing angles.
+        '''
+        depths = iter(depths)
+        first = np.asarray(next(depths), dtype=np.float32)
+        H, W = first.shape
+        grid = cls.around_cameras(c2w, H, W, focal, bounds, resolution)
+
+        j, i = np.mgrid[0:H:stride, 0:W:stride].astype(np.float32)
+        dirs = np.stack(((i - W / 2) / focal, -(j - H / 2) / focal, -np.ones_like(i)), axis=-1)
+
+        for cam, depth in enumerate(itertools.chain([first], depths)):
+            z = np.asarray(depth, dtype=np.float32)[::stride, ::stride]
+            valid = np.isfinite(z) & (z > 0) & (z < maxDepth)
+            local = dirs[valid] * (z[valid, None] * depthScale)
+            grid.mark_points(local @ c2w[cam, :3, :3].T + c2w[cam, :3, 3])
+        return grid.dilate(dilation)
+
+    @classmethod
+    def from_frusta(cls, c2w, H, W, focal, bounds, resolution=GRID_RESOLUTION):
+        # every voxel inside at least one camera frustum, the space any camera sees between near and far
+        bounds = np.broadcast_to(bounds, (len(c2w), 2))
+        grid = cls.around_cameras(c2w, H, W, focal, bounds, resolution)
+        corners = frustum_corners(c2w, H, W, focal, bounds)
+        tanX, tanY = W / (2. * focal), H / (2. * focal)
+        pad = 0.5 * np.linalg.norm(grid.voxelSize)
+
+        for cam in range(len(c2w)):
+            # only the voxels in the bounding box of this frustum
+            lo, _ = grid.voxel_indices(corners[cam].min(axis=0))
+            hi, _ = grid.voxel_indices(corners[cam].max(axis=0))
+            lo = np.clip(lo, 0, grid.resolution - 1)
+            hi = np.clip(hi, 0, grid.resolution - 1) + 1
+            axes = [np.arange(lo[k], hi[k]) for k in range(3)]
+            idx = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+            centers = grid.aabbMin + (idx + 0.5) * grid.voxelSize
+
+            # voxels whose bounding sphere touches the frustum, so no voxel with visible space is left out
+            local = (centers - c2w[cam, :3, 3]) @ c2w[cam, :3, :3]
+            z = -local[:, 2]
+            inside = (z >= bounds[cam, 0] - pad) & (z <= bounds[cam, 1] + pad) \
+                & (np.abs(local[:, 0]) <= z * tanX + pad * np.sqrt(1. + tanX ** 2)) \
+                & (np.abs(local[:, 1]) <= z * tanY + pad * np.sqrt(1. + tanY ** 2))
+            idx = idx[inside]
+            grid.grid[idx[:, 0], idx[:, 1], idx[:, 2]] = True
+        return grid
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, aabbMin=self.aabbMin, aabbMax=self.aabbMax, grid=np.packbits(self.grid),
+                                resolution=self.resolution)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            grid = cls(data['aabbMin'], data['aabbMax'], data['resolution'])
+            grid.grid = np.unpackbits(data['grid'])[:grid.grid.size].reshape(grid.grid.shape).astype(bool)
+        return grid
+
+def skip_empty(grid, rays_o, rays_d, t):
+    # (n_rays, n_samples) bool, the samples in occupied voxels, only these need network queries
+    return grid.query(points_along_rays(rays_o, rays_d, t))
+
+def sample_occupied(rays_o, rays_d, near, far, grid, numSamples, numProbe=128, perturb=True, rng=None):
+    '''
+    numSamples samples per ray inside the occupied voxels of grid, for a
+    smaller sample budget than stratified sampling of the whole ray. The rays
+    are clipped to the grid and probed at numProbe evenly spaced points; the
+    samples are drawn with sample_pdf from the occupied probe intervals.
+
+    Outputs:
+        t: (n_rays, numSamples) float32, sorted along each ray
+        valid: (n_rays, numSamples) bool, samples in occupied voxels (none for rays missing all of them)
+    '''
+    tmin, tmax = ray_aabb(rays_o, rays_d, grid.aabbMin, grid.aabbMax)
+    near = np.maximum(near, tmin)
+    far = np.minimum(far, tmax)
+    hit = near < far
+    far = np.where(hit, far, near + 1e-6)
+
+    probes = sample_stratified(near, far, numProbe + 1, perturb=False)
+    mids = 0.5 * (probes[:, 1:] + probes[:, :-1])
+    occupied = skip_empty(grid, rays_o, rays_d, mids) & hit[:, None]
+
+    t = sample_pdf(probes, occupied, numSamples, det=not perturb, rng=rng)
+    return t, skip_empty(grid, rays_o, rays_d, t) & occupied.any(axis=1)[:, None]
@@ -0,0 +1,177 @@
+'''
+
+pose_cache.py
+
+Caches the parsed pose table of an EndoSLAM .xlsx/.csv file so that the file
+is only parsed once. The first load streams the parsed row chunks into a
+row-major .npy file next to the source (<source>.posecache.npy), so the table
+is never held in memory, and writes a small json file holding the cache key
+(sha1 of the source content, its size and mtime). The table is then served
+from the memory-mapped .npy file, as on every later load, without touching
+openpyxl/csv.
+
+When the size and mtime of the source still match the key the cache is used
+directly. If only the mtime changed (e.g. the file was copied or touched) the
+content hash decides, so an unchanged file does not trigger a re-parse.
+
+The cached table holds every column of the source rows (the header row is
+skipped), e.g. ['', 'ImageFrame', 'Pose_Index', 'trans_x', ..., 'quot_w']
+for the EndoSLAM excel files, with empty cells and non-numeric index cells
+(e.g. image names in the ImageFrame column) stored as nan.
+
+'''
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+CACHE_SUFFIX = '.posecache'
+CACHE_VERSION = 2
+# the .npy header has a fixed size, so it can be rewritten with the row count once all chunks are written
+HEADER_SIZE = 128
+
+
+def file_digest(path, blockSize=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def cache_paths(sourcePath, cacheDir=None):
+    # returns the paths of the cached table and of its key file
+    if cacheDir is None:
+        base = sourcePath
+    else:
+        base = os.path.join(cacheDir, os.path.basename(sourcePath))
+    return base + CACHE_SUFFIX + '.npy', base + CACHE_SUFFIX + '.json'
+
+def _read_key(keyPath):
+    try:
+        with open(keyPath) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def _write_key(keyPath, key):
+    tmpPath = keyPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(key, f)
+    os.replace(tmpPath, keyPath)
+
+def is_valid(sourcePath, cacheDir=None):
+    tablePath, keyPath = cache_paths(sourcePath, cacheDir)
+    key = _read_key(keyPath)
+    if key is None or key.get('version') != CACHE_VERSION or not os.path.exists(tablePath):
+        return False
+
+    stat = os.stat(sourcePath)
+    if key['size'] != stat.st_size:
+        return False
+    if key['mtime_ns'] == stat.st_mtime_ns:
+        return True
+
+    # mtime changed, only re-parse if the content changed as well
+    if key['sha1'] != file_digest(sourcePath):
+        return False
+    key['mtime_ns'] = stat.st_mtime_ns
+    try:
+        _write_key(keyPath, key)
+    except OSError:
+        pass   # still valid, the hash is checked again next time
+    return True
+
+def _npy_header(shape):
+    # .npy version 1.0 header of a row-major float64 table, padded to HEADER_SIZE bytes
+    header = repr({'descr': '<f8', 'fortran_order': False, 'shape': tuple(shape)})
+    header = header.ljust(HEADER_SIZE - 11) + '\n'
+    return np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+def write_cache(sourcePath, chunks, cacheDir=None):
+    # chunks: (k, num_columns) row chunks (or one whole table), written to the cache as they come
+    if isinstance(chunks, np.ndarray):
+        chunks = [chunks]
+    tablePath, keyPath = cache_paths(sourcePath, cacheDir)
+
+    # write the table first so a key file never points to a partial table
+    tmpPath = tablePath + '.tmp'
+    numRows, numCols = 0, None
+    try:
+        with open(tmpPath, 'wb') as f:
+            f.write(_npy_header((0, 0)))
+            for chunk in chunks:
+                chunk = np.ascontiguousarray(chunk, dtype='<f8')
+                if numCols is None:
+                    numCols = chunk.shape[1]
+                elif chunk.shape[1] != numCols:
+                    raise ValueError('row chunk of {} columns in a table of {} columns'.format(chunk.shape[1], numCols))
+                f.write(chunk.tobytes())
+                numRows += len(chunk)
+            f.seek(0)
+            f.write(_npy_header((numRows, numCols or 0)))
+        os.replace(tmpPath, tablePath)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+    stat = os.stat(sourcePath)
+    key = {
+        'version': CACHE_VERSION,
+        'source': os.path.basename(sourcePath),
+        'sha1': file_digest(sourcePath),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'shape': [numRows, numCols or 0],
+    }
+    _write_key(keyPath, key)
+
+def invalidate(sourcePath, cacheDir=None):
+    # remove the cached table of sourcePath, returns True if there was one
+    removed = False
+    for path in cache_paths(sourcePath, cacheDir):
+        if os.path.exists(path):
+            os.remove(path)
+            removed = True
+    return removed
+
+def read_table(chunks):
+    # the row chunks as one in-memory table
+    chunks = list(chunks)
+    if not chunks:
+        return np.empty((0, 0))
+    return np.concatenate(chunks, axis=0)
+
+def load_pose_table(sourcePath, parse=None, cacheDir=None, useCache=True, rebuild=False):
+    '''
+    Returns the (N, num_columns) float table of the pose rows in sourcePath,
+    memory-mapped from the cache unless useCache is False.
+
+    parse: callable taking sourcePath and yielding (k, num_columns) row
+        chunks, defaults to convert2npy.iter_pose_chunks
+    useCache: False parses the source into memory without reading or writing
+        the cache
+    rebuild: True re-parses the source and overwrites the cache
+    '''
+    if parse is None:
+        from convert2npy import iter_pose_chunks as parse
+
+    if not useCache:
+        return read_table(parse(sourcePath))
+
+    if not os.path.exists(sourcePath):
+        # raised here, a missing source is not a cache that could not be written
+        raise IOError('no pose file at {}'.format(sourcePath))
+
+    tablePath, _ = cache_paths(sourcePath, cacheDir)
+    if rebuild or not is_valid(sourcePath, cacheDir):
+        try:
+            write_cache(sourcePath, parse(sourcePath), cacheDir)
+        except OSError as e:
+            # e.g. a read-only dataset folder, parse into memory instead
+            print('could not write pose cache for {}: {}'.format(sourcePath, e))
+            return read_table(parse(sourcePath))
+    return np.load(tablePath, mmap_mode='r')
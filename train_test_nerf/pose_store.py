@@ -0,0 +1,75 @@
+'''
+
+pose_store.py
+
+Read access to poses_bounds.npy files (https://github.com/Fyusion/LLFF/issues/10)
+without loading them eagerly. The file is memory-mapped and the poses, bounds
+and intrinsics are exposed as views of the mapped (N, 17) array, so only the
+frames that are actually used are read from disk.
+
+Each row of poses_bounds.npy is a flattened 3x5 pose matrix followed by the
+near/far bounds:
+    [ R | t | [height, width, focal] ] (3x5) + [near, far]
+
+Example:
+    store = PoseStore('poses_bounds.npy')
+    for start, chunk in store.iter_ranges(1000):
+        c2w = chunk.c2w      # (<=1000, 3, 4) view, nothing else is read
+
+'''
+
+import numpy as np
+
+
+class PoseStore:
+    def __init__(self, source, mmap=True):
+        # source: path to a poses_bounds.npy file or an (N, 17) array
+        if isinstance(source, np.ndarray):
+            data = source
+        else:
+            data = np.load(source, mmap_mode='r' if mmap else None)
+
+        if data.ndim != 2 or data.shape[1] != 17:
+            raise ValueError('expected an (N, 17) poses_bounds array, got shape {}'.format(data.shape))
+        self.data = data
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        # slicing returns another store over a view of the same rows
+        if isinstance(index, slice):
+            return PoseStore(self.data[index])
+        # negative indices count from the end, out of range ones raise IndexError
+        index = range(len(self))[index]
+        return PoseStore(self.data[index:index+1])
+
+    @property
+    def poses(self):
+        # (N, 3, 5) [R | t | hwf] view
+        return self.data[:, :15].reshape(-1, 3, 5)
+
+    @property
+    def c2w(self):
+        # (N, 3, 4) camera-to-world view, columns [down, right, backwards, translation]
+        return self.poses[..., :4]
+
+    @property
+    def hwf(self):
+        # (N, 3) [height, width, focal] view
+        return self.poses[..., 4]
+
+    @property
+    def bounds(self):
+        # (N, 2) [near, far] view
+        return self.data[:, 15:]
+
+    def intrinsics(self, index=0):
+        # height, width, focal of one camera as python floats
+        H, W, focal = self.hwf[index]
+        return float(H), float(W), float(focal)
+
+    def iter_ranges(self, chunkSize):
+        # yields (start, store) for consecutive ranges of at most chunkSize frames
+        for start in range(0, len(self), chunkSize):
+            yield start, self[start:start+chunkSize]
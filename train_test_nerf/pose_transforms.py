@@ -0,0 +1,227 @@
+'''
+
+pose_transforms.py
+
+Batched rigid edits of camera poses, shared by the sampling and rendering
+scripts. A transform works on either format used in this repo:
+
+    (N, 7) [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w] rows, as in the
+           EndoSLAM files and CAMERA_INFO
+    (N, 4, 4) or (N, 3, 4) camera-to-world matrices
+
+and transforms are composed into a pipeline applied in one call:
+
+    pipeline = Pipeline(FlipShift(180, 37), Recenter(), Rescale(1/0.75))
+    tranQuots = pipeline(tranQuots)
+
+FlipShift reproduces updateCamera(deltaDeg, deltaZ) of sampleCameraPoses.py
+and the Blender scripts (rotate the y euler angle by deltaDeg, shift z by
+deltaZ) for all poses at once.
+
+scipy is imported only by the transforms that need it, so the module can be
+imported from Blender's python without scipy.
+
+'''
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+def normalize(v):
+    """Normalize a vector."""
+    return v/np.linalg.norm(v)
+
+# this function is borrowed from nerf_pl/datasets/llff.py
+def average_poses(poses):
+    """
+    Calculate the average pose, which is then used to center all poses
+    using @center_poses. Its computation is as follows:
+    1. Compute the center: the average of pose centers.
+    2. Compute the z axis: the normalized average z axis.
+    3. Compute axis y': the average y axis.
+    4. Compute x' = y' cross product z, then normalize it as the x axis.
+    5. Compute the y axis: z cross product x.
+    
+    Note that at step 3, we cannot directly use y' as y axis since it's
+    not necessarily orthogonal to z axis. We need to pass from x to y.
+
+    Inputs:
+        poses: (N_images, 3, 4)
+
+    Outputs:
+        pose_avg: (3, 4) the average pose
+    """
+    # 1. Compute the center
+    center = poses[..., 3].mean(0) # (3)
+
+    # 2. Compute the z axis
+    z = normalize(poses[..., 2].mean(0)) # (3)
+
+    # 3. Compute axis y' (no need to normalize as it's not the final output)
+    y_ = poses[..., 1].mean(0) # (3)
+
+    # 4. Compute the x axis
+    x = normalize(np.cross(y_, z)) # (3)
+
+    # 5. Compute the y axis (as z and x are normalized, y is already of norm 1)
+    y = np.cross(z, x) # (3)
+
+    pose_avg = np.stack([x, y, z, center], 1) # (3, 4)
+
+    return pose_avg
+
+# this function is borrowed from nerf_pl/datasets/llff.py, which is used to re-center the cameras
+def center_poses(poses):
+    """
+    Center the poses so that we can use NDC.
+    See https://github.com/bmild/nerf/issues/34
+
+    Inputs:
+        poses: (N_images, 3, 4)
+
+    Outputs:
+        poses_centered: (N_images, 3, 4) the centered poses
+        pose_avg: (3, 4) the average pose
+    """
+
+    pose_avg = average_poses(poses) # (3, 4)
+    pose_avg_homo = np.eye(4)
+    pose_avg_homo[:3] = pose_avg # convert to homogeneous coordinate for faster computation
+                                 # by simply adding 0, 0, 0, 1 as the last row
+    last_row = np.tile(np.array([0, 0, 0, 1]), (len(poses), 1, 1)) # (N_images, 1, 4)
+    poses_homo = \
+        np.concatenate([poses, last_row], 1) # (N_images, 4, 4) homogeneous coordinate
+
+    poses_centered = np.linalg.inv(pose_avg_homo) @ poses_homo # (N_images, 4, 4)
+    poses_centered = poses_centered[:, :3] # (N_images, 3, 4)
+
+    return poses_centered, np.linalg.inv(pose_avg_homo)
+
+
+def tranquots_to_matrices(tranQuots):
+    # (N, 7) rows to (N, 4, 4) camera-to-world matrices
+    from scipy.spatial.transform import Rotation as R
+
+    tranQuots = np.asarray(tranQuots, dtype=float).reshape(-1, 7)
+    matrices = np.zeros((len(tranQuots), 4, 4))
+    matrices[:, :3, :3] = R.from_quat(tranQuots[:, 3:]).as_matrix()
+    matrices[:, :3, 3] = tranQuots[:, :3]
+    matrices[:, 3, 3] = 1
+    return matrices
+
+def matrices_to_tranquots(matrices):
+    # (N, 3, 4) or (N, 4, 4) matrices to (N, 7) rows
+    from scipy.spatial.transform import Rotation as R
+
+    matrices = np.asarray(matrices, dtype=float)
+    return np.concatenate((matrices[:, :3, 3], R.from_matrix(matrices[:, :3, :3]).as_quat()), axis=1)
+
+def _is_tranquots(poses):
+    return poses.ndim == 2 and poses.shape[1] == 7
+
+
+class PoseTransform(ABC):
+    # subclasses implement apply_matrices and, where it can be done without a
+    # round trip through matrices, apply_tranquots
+
+    def __call__(self, poses):
+        poses = np.asarray(poses, dtype=float)
+        if _is_tranquots(poses):
+            return self.apply_tranquots(poses)
+        if poses.ndim == 3 and poses.shape[1:] in ((3, 4), (4, 4)):
+            return self.apply_matrices(poses)
+        raise ValueError('expected (N, 7) or (N, 3/4, 4) poses, got shape {}'.format(poses.shape))
+
+    def apply_tranquots(self, tranQuots):
+        return matrices_to_tranquots(self.apply_matrices(tranquots_to_matrices(tranQuots)))
+
+    @abstractmethod
+    def apply_matrices(self, matrices):
+        pass
+
+
+class FlipShift(PoseTransform):
+    # rotate the y euler angle ('xyz', degrees) by deltaDeg and shift z by deltaZ
+    def __init__(self, deltaDeg, deltaZ):
+        self.deltaDeg = deltaDeg
+        self.deltaZ = deltaZ
+
+    def _flip(self, rotation):
+        from scipy.spatial.transform import Rotation as R
+
+        rEuler = rotation.as_euler('xyz', degrees=True)
+        rEuler[:, 1] += self.deltaDeg
+        return R.from_euler('xyz', rEuler, degrees=True)
+
+    def apply_tranquots(self, tranQuots):
+        from scipy.spatial.transform import Rotation as R
+
+        out = np.array(tranQuots, dtype=float)
+        out[:, 2] += self.deltaZ
+        out[:, 3:] = self._flip(R.from_quat(out[:, 3:])).as_quat()
+        return out
+
+    def apply_matrices(self, matrices):
+        from scipy.spatial.transform import Rotation as R
+
+        out = np.array(matrices, dtype=float)
+        out[:, 2, 3] += self.deltaZ
+        out[:, :3, :3] = self._flip(R.from_matrix(out[:, :3, :3])).as_matrix()
+        return out
+
+
+class Shift(PoseTransform):
+    # add delta (3,) to every camera position
+    def __init__(self, delta):
+        self.delta = np.asarray(delta, dtype=float).reshape(3)
+
+    def apply_tranquots(self, tranQuots):
+        out = np.array(tranQuots, dtype=float)
+        out[:, :3] += self.delta
+        return out
+
+    def apply_matrices(self, matrices):
+        out = np.array(matrices, dtype=float)
+        out[:, :3, 3] += self.delta
+        return out
+
+
+class Rescale(PoseTransform):
+    # multiply every camera position by factor
+    def __init__(self, factor):
+        self.factor = factor
+
+    def apply_tranquots(self, tranQuots):
+        out = np.array(tranQuots, dtype=float)
+        out[:, :3] *= self.factor
+        return out
+
+    def apply_matrices(self, matrices):
+        out = np.array(matrices, dtype=float)
+        out[:, :3, 3] *= self.factor
+        return out
+
+
+class Recenter(PoseTransform):
+    # move the average pose (see average_poses) to the origin, as center_poses
+    def apply_matrices(self, matrices):
+        out = np.array(matrices, dtype=float)
+        out[:, :3], _ = center_poses(out[:, :3])
+        return out
+
+
+class Pipeline(PoseTransform):
+    # applies the transforms in order, poses keep their format between the steps
+    def __init__(self, *transforms):
+        self.transforms = transforms
+
+    def apply_tranquots(self, tranQuots):
+        for transform in self.transforms:
+            tranQuots = transform.apply_tranquots(tranQuots)
+        return tranQuots
+
+    def apply_matrices(self, matrices):
+        for transform in self.transforms:
+            matrices = transform.apply_matrices(matrices)
+        return matrices
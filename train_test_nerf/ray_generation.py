@@ -0,0 +1,240 @@
+'''
+
+ray_generation.py
+
+Generates the NeRF rays of every pixel of every camera on the CPU, as
+nerf_pl/datasets/ray_utils.py does (get_ray_directions, get_rays,
+get_ndc_rays). Cameras are read from poses_bounds.npy (load_llff_cameras) or
+from the camera json/bundle of poseNpy2json.py (cameras_from_bundle,
+load_camera_file).
+
+The rays are numbered camera by camera, row by row. RayGenerator returns
+any range of them as (n, 8) float32 rows
+
+    [origin (3), direction (3), near, far]
+
+and iter_batches streams all of them in batches of batchSize rays written
+into one reused buffer, so memory does not grow with the number of cameras.
+The pixel directions are computed once in camera space and rotated per
+camera with one matrix product. iter_batches_parallel computes the batches
+in a process pool instead, with at most maxPending tasks in flight, so a slow
+consumer does not make finished batches pile up.
+
+Variants:
+    load_llff_cameras(variant=...) as the camera json variants of
+    poseNpy2json.py: 'original', 'recenter' (center_poses) and
+    'recenter_scale' (also scaled so the nearest bound is at 1/0.75, as used
+    for training in nerf_pl). ndc=True maps the rays into normalized device
+    coordinates (forward-facing scenes, near plane at 1), near/far become 0/1.
+
+Example:
+    c2w, bounds, H, W, focal = load_llff_cameras('poses_bounds.npy')
+    generator = RayGenerator(c2w, H, W, focal, bounds, batchSize=65536)
+    for rays in generator.iter_batches():
+        ...   # (65536, 8) view, valid until the next batch
+
+'''
+
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pose_store import PoseStore
+from pose_transforms import center_poses
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'visualize_cameras'))
+from camera_bundle import bundle_from_dict, load_cameras
+
+BATCH_SIZE = 65536
+VARIANTS = ('original', 'recenter', 'recenter_scale')
+BD_FACTOR = 0.75
+
+
+def get_ray_directions(H, W, focal, normalize=True):
+    '''
+    Ray directions of all pixels in camera coordinates ("right up back",
+    looking along -z), as in nerf_pl.
+
+    Outputs:
+        directions: (H, W, 3) float32, unit length if normalize
+    '''
+    i, j = np.meshgrid(np.arange(W, dtype=np.float32), np.arange(H, dtype=np.float32), indexing='xy')
+    directions = np.stack(((i - W / 2) / focal, -(j - H / 2) / focal, -np.ones_like(i)), axis=-1)
+    if normalize:
+        # rotating does not change the length, so normalizing here equals normalizing every world direction
+        directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    return directions.astype(np.float32)
+
+def get_rays(directions, c2w):
+    # (n, 3) camera space directions and a (3, 4) camera-to-world pose to (n, 3) world origins and directions
+    rays_d = directions @ c2w[:, :3].T
+    rays_o = np.broadcast_to(c2w[:, 3], rays_d.shape)
+    return rays_o, rays_d
+
+def get_ndc_rays(H, W, focal, near, rays_o, rays_d):
+    # rays in normalized device coordinates, see nerf_pl/datasets/ray_utils.py
+    # shift ray origins to near plane
+    t = -(near + rays_o[..., 2]) / rays_d[..., 2]
+    rays_o = rays_o + t[..., None] * rays_d
+
+    ox_oz = rays_o[..., 0] / rays_o[..., 2]
+    oy_oz = rays_o[..., 1] / rays_o[..., 2]
+
+    o0 = -1. / (W / (2. * focal)) * ox_oz
+    o1 = -1. / (H / (2. * focal)) * oy_oz
+    o2 = 1. + 2. * near / rays_o[..., 2]
+
+    d0 = -1. / (W / (2. * focal)) * (rays_d[..., 0] / rays_d[..., 2] - ox_oz)
+    d1 = -1. / (H / (2. * focal)) * (rays_d[..., 1] / rays_d[..., 2] - oy_oz)
+    d2 = 1. - o2
+
+    return np.stack((o0, o1, o2), axis=-1), np.stack((d0, d1, d2), axis=-1)
+
+def load_llff_cameras(npyPath, variant='recenter_scale', focal=None, bdFactor=BD_FACTOR):
+    '''
+    Inputs:
+        npyPath: poses_bounds.npy
+        variant: 'original', 'recenter' or 'recenter_scale'
+        focal: focal length in pixels, default is the one in poses_bounds.npy
+
+    Outputs:
+        c2w: (N, 3, 4) "right up back" camera-to-world poses
+        bounds: (N, 2) near/far, scaled with the poses for 'recenter_scale'
+        H, W, focal
+    '''
+    if variant not in VARIANTS:
+        raise ValueError('unknown camera variant: {}'.format(variant))
+    store = PoseStore(npyPath)
+    H, W, fileFocal = store.intrinsics(0)
+    bounds = np.array(store.bounds, dtype=float)
+
+    # "down right back" to "right up back"
+    poses = store.poses
+    c2w = np.concatenate([poses[..., 1:2], -poses[..., :1], poses[..., 2:4]], -1)
+
+    if variant != 'original':
+        c2w, _ = center_poses(c2w)
+    if variant == 'recenter_scale':
+        scale_factor = bounds.min() * bdFactor
+        c2w[..., 3] /= scale_factor
+        bounds /= scale_factor
+    return c2w, bounds, int(H), int(W), focal or fileFocal
+
+def cameras_from_bundle(bundle, near=0., far=1.):
+    '''
+    Cameras of a camera bundle or json camera dict (see camera_bundle.py),
+    which all share one K and image size.
+
+    Outputs:
+        c2w, bounds, H, W, focal as load_llff_cameras
+    '''
+    if not isinstance(bundle.get('W2C'), np.ndarray):
+        # camera dict as in the json files, in the camera order of camera_bundle.py
+        bundle = bundle_from_dict(bundle)
+
+    K = np.asarray(bundle['K'], dtype=float).reshape(-1, 4, 4)
+    img_size = np.asarray(bundle['img_size'], dtype=float).reshape(-1, 2)
+    if not (np.allclose(K, K[0]) and np.allclose(img_size, img_size[0])):
+        raise ValueError('all cameras need the same intrinsics')
+
+    c2w = np.linalg.inv(np.asarray(bundle['W2C'], dtype=float).reshape(-1, 4, 4))[:, :3]
+    bounds = np.tile([near, far], (len(c2w), 1))
+    H, W = img_size[0]
+    return c2w, bounds, int(H), int(W), float(K[0, 0, 0])
+
+def load_camera_file(cameraPath, near=0., far=1.):
+    # cameras of a camera json file of poseNpy2json.py or of a camera bundle (.npz)
+    return cameras_from_bundle(load_cameras(cameraPath), near, far)
+
+
+class RayGenerator:
+    def __init__(self, c2w, H, W, focal, bounds, ndc=False, batchSize=BATCH_SIZE, ndcNear=1.):
+        self.c2w = np.ascontiguousarray(np.asarray(c2w)[:, :3, :4], dtype=np.float32)
+        self.bounds = np.ascontiguousarray(np.broadcast_to(bounds, (len(self.c2w), 2)), dtype=np.float32)
+        self.H, self.W, self.focal = H, W, focal
+        self.ndc = ndc
+        self.ndcNear = ndcNear
+        self.batchSize = batchSize
+        self.raysPerCamera = H * W
+        self.directions = get_ray_directions(H, W, focal).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.c2w) * self.raysPerCamera
+
+    def rays(self, start, stop, out=None):
+        # rays start..stop as (stop - start, 8) float32, written into out if given
+        if out is None:
+            out = np.empty((stop - start, 8), dtype=np.float32)
+
+        pos = start
+        while pos < stop:
+            cam, pix = divmod(pos, self.raysPerCamera)
+            n = min(stop - pos, self.raysPerCamera - pix)
+            rays = out[pos - start:pos - start + n]
+            np.matmul(self.directions[pix:pix + n], self.c2w[cam, :, :3].T, out=rays[:, 3:6])
+            rays[:, :3] = self.c2w[cam, :, 3]
+            rays[:, 6:] = self.bounds[cam]
+            pos += n
+
+        if self.ndc:
+            out[:, :3], out[:, 3:6] = get_ndc_rays(self.H, self.W, self.focal, self.ndcNear, out[:, :3], out[:, 3:6])
+            out[:, 6] = 0.
+            out[:, 7] = 1.
+        return out
+
+    def rays_at(self, indices, out=None):
+        # rays of arbitrary ray indices (e.g. a random training batch) as (n, 8) float32
+        indices = np.asarray(indices)
+        if out is None:
+            out = np.empty((len(indices), 8), dtype=np.float32)
+
+        cams, pixels = np.divmod(indices, self.raysPerCamera)
+        np.einsum('nj,nij->ni', self.directions[pixels], self.c2w[cams, :, :3], out=out[:, 3:6])
+        out[:, :3] = self.c2w[cams, :, 3]
+        out[:, 6:] = self.bounds[cams]
+
+        if self.ndc:
+            out[:, :3], out[:, 3:6] = get_ndc_rays(self.H, self.W, self.focal, self.ndcNear, out[:, :3], out[:, 3:6])
+            out[:, 6] = 0.
+            out[:, 7] = 1.
+        return out
+
+    def batch_ranges(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        return [(s, min(s + self.batchSize, stop)) for s in range(start, stop, self.batchSize)]
+
+    def iter_batches(self, start=0, stop=None):
+        # yields views of one reused buffer, copy a batch to keep it
+        buffer = np.empty((self.batchSize, 8), dtype=np.float32)
+        for s, e in self.batch_ranges(start, stop):
+            yield self.rays(s, e, out=buffer[:e - s])
+
+    def iter_batches_parallel(self, workers=None, start=0, stop=None, batchesPerTask=4, maxPending=None):
+        # same batches as iter_batches, in order, computed by a process pool (each batch is a new array)
+        # tasks of batchesPerTask batches, at most maxPending of them submitted and not yet consumed
+        ranges = self.batch_ranges(start, stop)
+        tasks = [ranges[i:i + batchesPerTask] for i in range(0, len(ranges), batchesPerTask)]
+        maxPending = maxPending or 2 * (workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_worker_rays, task))
+                if len(pending) >= maxPending:
+                    for rays in pending.popleft().result():
+                        yield rays
+            while pending:
+                for rays in pending.popleft().result():
+                    yield rays
+
+
+_WORKER_GENERATOR = None
+
+def _init_worker(generator):
+    global _WORKER_GENERATOR
+    _WORKER_GENERATOR = generator
+
+def _worker_rays(batchRanges):
+    return [_WORKER_GENERATOR.rays(*batchRange) for batchRange in batchRanges]
@@ -0,0 +1,88 @@
+'''
+
+test_convert2npy.py
+
+The batched pose conversion against the original per-row loop, and
+converting EndoSLAM pose files whose index columns are not numbers: a blank
+first column and an ImageFrame column holding image names.
+
+    python -m pytest -q test_convert2npy.py
+
+'''
+
+import csv
+import os
+
+import numpy as np
+import openpyxl as opx
+import pytest
+
+from bench_convert2npy import convert_per_row, synthetic_trajectory
+from convert2npy import (CSV_POSE_COLS, XLSX_POSE_COLS, convert_quot2rotMatrix, convert_quot2rotMatrix_usingScipy,
+                         convert_quots2rotMatrices, convert_quots2rotMatrices_usingScipy, convert_to_npy,
+                         convert_to_npy_csv, convert_to_poses_bounds, iter_pose_chunks)
+
+NUM_POSES = 50
+XLSX_HEADER = ['', 'ImageFrame', 'Pose_Index', 'trans_x', 'trans_y', 'trans_z', 'quot_x', 'quot_y', 'quot_z', 'quot_w']
+
+
+@pytest.fixture
+def tranQuots():
+    return synthetic_trajectory(NUM_POSES)
+
+def write_xlsx(xlsxPath, tranQuots, firstCell):
+    workbook = opx.Workbook()
+    sheet = workbook.active
+    sheet.append(XLSX_HEADER)
+    for i, tranQuot in enumerate(tranQuots):
+        sheet.append([firstCell, 'image_{0:04d}.png'.format(i), i] + tranQuot.tolist())
+    workbook.save(xlsxPath)
+
+@pytest.mark.parametrize('useScipy', [True, False])
+def test_batched_matches_per_row(tranQuots, useScipy):
+    np.testing.assert_allclose(convert_to_poses_bounds(tranQuots, useScipy), convert_per_row(tranQuots, useScipy),
+                               rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize('batched, perRow', [(convert_quots2rotMatrices_usingScipy, convert_quot2rotMatrix_usingScipy),
+                                             (convert_quots2rotMatrices, convert_quot2rotMatrix)])
+def test_batched_rotations_match_per_row(tranQuots, batched, perRow):
+    expected = np.stack([perRow(quot) for quot in tranQuots[:, 3:]])
+    np.testing.assert_allclose(batched(tranQuots[:, 3:]), expected, rtol=0, atol=1e-12)
+
+def test_convert_empty():
+    assert convert_to_poses_bounds(np.empty((0, 7))).shape == (0, 17)
+
+@pytest.mark.parametrize('firstCell', [None, '', 'frame'])
+@pytest.mark.parametrize('useCache', [False, True])
+def test_xlsx_with_image_names(tmp_path, tranQuots, firstCell, useCache):
+    xlsxPath = os.path.join(str(tmp_path), 'poses.xlsx')
+    write_xlsx(xlsxPath, tranQuots, firstCell)
+
+    posesBounds = convert_to_npy(xlsxPath, str(tmp_path), stop=None, chunkSize=16, useCache=useCache)
+    np.testing.assert_allclose(posesBounds, convert_to_poses_bounds(tranQuots))
+    np.testing.assert_allclose(np.load(os.path.join(str(tmp_path), 'poses_bounds.npy')), posesBounds)
+
+def test_xlsx_index_columns(tmp_path, tranQuots):
+    xlsxPath = os.path.join(str(tmp_path), 'poses.xlsx')
+    write_xlsx(xlsxPath, tranQuots, None)
+
+    table = np.concatenate(list(iter_pose_chunks(xlsxPath, chunkSize=16)))
+    assert table.shape == (NUM_POSES, len(XLSX_HEADER))
+    # names and blank cells become nan, numbers are kept
+    assert np.isnan(table[:, :2]).all()
+    np.testing.assert_array_equal(table[:, 2], np.arange(NUM_POSES))
+    np.testing.assert_allclose(table[:, XLSX_POSE_COLS], tranQuots)
+
+def test_csv_with_image_names(tmp_path, tranQuots):
+    csvPath = os.path.join(str(tmp_path), 'poses.csv')
+    with open(csvPath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(XLSX_HEADER[3:] + ['ImageFrame'])
+        for i, tranQuot in enumerate(tranQuots):
+            writer.writerow(tranQuot.tolist() + ['image_{0:04d}.png'.format(i)])
+
+    posesBounds = convert_to_npy_csv(csvPath, str(tmp_path), stop=None, chunkSize=16, useCache=False)
+    np.testing.assert_allclose(posesBounds, convert_to_poses_bounds(tranQuots))
+    table = np.concatenate(list(iter_pose_chunks(csvPath)))
+    np.testing.assert_allclose(table[:, CSV_POSE_COLS], tranQuots)
+    assert np.isnan(table[:, 7]).all()
@@ -0,0 +1,144 @@
+'''
+
+test_depth_store.py
+
+Write/append/truncate round trips of depth stores with synthetic depth
+maps, uncompressed and zlib compressed, and merging the stores of several
+shards.
+
+    python -m pytest -q test_depth_store.py
+
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+from depth_store import DepthStore, DepthStoreWriter, is_depth_store, merge_depth_stores
+
+HEIGHT = 12
+WIDTH = 16
+COMPRESSIONS = [None, 'zlib']
+
+
+def synthetic_depths(numFrames, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.5, 3., (numFrames, HEIGHT, WIDTH)).astype(np.float32)
+
+def frame_names(start, stop):
+    return ['r_{0:03d}'.format(k) for k in range(start, stop)]
+
+def write_store(storePath, depths, names, compression, chunkFrames=4, append=False):
+    with DepthStoreWriter(storePath, HEIGHT, WIDTH, compression=compression, chunkFrames=chunkFrames,
+                          append=append) as writer:
+        for depth, name in zip(depths, names):
+            writer.append(depth, name)
+
+def assert_store(storePath, depths, names):
+    store = DepthStore(storePath)
+    assert store.names == names
+    assert len(store) == len(depths)
+    for k, name in enumerate(names):
+        np.testing.assert_array_equal(store[k], depths[k])
+        np.testing.assert_array_equal(store.frame(name), depths[k])
+    np.testing.assert_array_equal(store[-1], depths[-1])
+    np.testing.assert_array_equal(np.stack(list(store)), depths)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_round_trip(tmp_path, compression):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    depths = synthetic_depths(10)
+    write_store(storePath, depths, frame_names(0, 10), compression)
+
+    assert is_depth_store(storePath)
+    assert_store(storePath, depths, frame_names(0, 10))
+
+def test_flipped_view_is_copied(tmp_path):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    depths = synthetic_depths(3)
+    write_store(storePath, [depth[::-1] for depth in depths], frame_names(0, 3), None)
+    assert_store(storePath, depths[:, ::-1], frame_names(0, 3))
+
+def test_wrong_shape(tmp_path):
+    with DepthStoreWriter(os.path.join(str(tmp_path), 'depth.depthstore'), HEIGHT, WIDTH) as writer:
+        with pytest.raises(ValueError):
+            writer.append(np.zeros((WIDTH, HEIGHT)))
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_append(tmp_path, compression):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    depths = synthetic_depths(11)
+    write_store(storePath, depths[:6], frame_names(0, 6), compression)
+    write_store(storePath, depths[6:], frame_names(6, 11), compression, append=True)
+    assert_store(storePath, depths, frame_names(0, 11))
+
+def test_append_other_format(tmp_path):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    write_store(storePath, synthetic_depths(2), frame_names(0, 2), None)
+    with pytest.raises(ValueError):
+        DepthStoreWriter(storePath, HEIGHT, WIDTH, compression='zlib', append=True)
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_unflushed_frames_are_dropped_on_append(tmp_path, compression):
+    # a writer that is never closed (a killed render) keeps only what was flushed
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    depths = synthetic_depths(7)
+    writer = DepthStoreWriter(storePath, HEIGHT, WIDTH, compression=compression, chunkFrames=4)
+    for depth, name in zip(depths, frame_names(0, 7)):
+        writer.append(depth, name)
+        if name == 'r_003':
+            writer.flush()
+    writer._file.flush()
+
+    with DepthStoreWriter(storePath, HEIGHT, WIDTH, compression=compression, chunkFrames=4, append=True) as resumed:
+        assert resumed.names == frame_names(0, 4)
+        for depth, name in zip(depths[4:], frame_names(4, 7)):
+            resumed.append(depth, name)
+    writer._file.close()
+    assert_store(storePath, depths, frame_names(0, 7))
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_truncate(tmp_path, compression):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    depths = synthetic_depths(12)
+    write_store(storePath, depths, frame_names(0, 12), compression)
+
+    with DepthStoreWriter(storePath, HEIGHT, WIDTH, compression=compression, chunkFrames=4, append=True) as writer:
+        writer.truncate(8)
+        assert writer.names == frame_names(0, 8)
+        writer.append(depths[0], 'again')
+    assert_store(storePath, np.concatenate((depths[:8], depths[:1])), frame_names(0, 8) + ['again'])
+
+def test_truncate_inside_chunk(tmp_path):
+    storePath = os.path.join(str(tmp_path), 'depth.depthstore')
+    write_store(storePath, synthetic_depths(8), frame_names(0, 8), 'zlib')
+    with DepthStoreWriter(storePath, HEIGHT, WIDTH, compression='zlib', chunkFrames=4, append=True) as writer:
+        with pytest.raises(ValueError):
+            writer.truncate(6)
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_merge(tmp_path, compression):
+    depths = synthetic_depths(10)
+    storePaths = [os.path.join(str(tmp_path), 'depth_shard_{:02d}.depthstore'.format(k)) for k in range(2)]
+    write_store(storePaths[0], depths[:5], frame_names(0, 5), compression)
+    write_store(storePaths[1], depths[5:], frame_names(5, 10), 'zlib')
+
+    outputPath = os.path.join(str(tmp_path), 'depth.depthstore')
+    assert merge_depth_stores(storePaths, outputPath) == 10
+    assert_store(outputPath, depths, frame_names(0, 10))
+
+    # in the order of names, e.g. the frame order of transforms.json
+    names = frame_names(0, 10)[::-1]
+    merge_depth_stores(storePaths[::-1], outputPath, names, compression=compression)
+    assert_store(outputPath, depths[::-1], names)
+
+def test_merge_missing_frames(tmp_path):
+    storePath = os.path.join(str(tmp_path), 'depth_shard_00.depthstore')
+    write_store(storePath, synthetic_depths(3), frame_names(0, 3), None)
+
+    outputPath = os.path.join(str(tmp_path), 'depth.depthstore')
+    with pytest.raises(ValueError, match='r_004'):
+        merge_depth_stores([storePath], outputPath, frame_names(0, 5))
+    assert not os.path.exists(outputPath)
@@ -0,0 +1,120 @@
+'''
+
+test_novel_views.py
+
+The camera paths of novel_views.py at their end points, and TiledRenderer on
+the analytic TubeField: serial, pooled and single tile renders give the same
+frames, and resume skips the frames already on disk.
+
+    python -m pytest -q test_novel_views.py
+
+'''
+
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation as R
+
+from bench_point_sampling import tube_cameras
+from novel_views import TiledRenderer, frame_path, interpolate_poses, spiral_path
+from pose_transforms import center_poses
+from volume_rendering import TubeField
+
+NUM_POSES = 9
+HEIGHT = 20
+WIDTH = 28
+BOUNDS = (0.05, 4.)
+
+
+@pytest.fixture
+def c2w():
+    rng = np.random.default_rng(0)
+    poses = np.empty((NUM_POSES, 3, 4))
+    poses[:, :, :3] = R.from_euler('xyz', rng.uniform(-0.3, 0.3, (NUM_POSES, 3))).as_matrix()
+    poses[:, :, 3] = rng.uniform(-1., 1., (NUM_POSES, 3))
+    return poses
+
+def assert_rotations(poses):
+    rotations = poses[:, :, :3]
+    np.testing.assert_allclose(rotations @ rotations.transpose(0, 2, 1), np.broadcast_to(np.eye(3), rotations.shape),
+                               atol=1e-9)
+    np.testing.assert_allclose(np.linalg.det(rotations), 1., atol=1e-9)
+
+def load_frame(outputDir, name):
+    with np.load(frame_path(outputDir, name)) as data:
+        return {key: data[key] for key in ('rgb', 'depth', 'opacity')}
+
+
+def test_spiral_path(c2w):
+    numFrames, focusDepth = 40, 3.
+    poses = spiral_path(c2w, np.tile(BOUNDS, (NUM_POSES, 1)), numFrames, numRotations=2, focusDepth=focusDepth)
+    assert poses.shape == (numFrames, 3, 4)
+    assert_rotations(poses)
+
+    # the spiral is closed after every full turn of its z oscillation, i.e. half the frames
+    np.testing.assert_allclose(poses[0], poses[numFrames // 2], atol=1e-9)
+    # centered on the average pose, and every camera looks at the focus point in front of it
+    _, avg_inv = center_poses(c2w)
+    avg = np.linalg.inv(avg_inv)
+    np.testing.assert_allclose(poses[:, :, 3].mean(axis=0), avg[:3, 3], atol=1e-9)
+    focus = avg[:3, :3] @ [0., 0., -focusDepth] + avg[:3, 3]
+    toFocus = focus - poses[:, :, 3]
+    toFocus /= np.linalg.norm(toFocus, axis=1, keepdims=True)
+    np.testing.assert_allclose(toFocus, -poses[:, :, 2], atol=1e-9)
+
+@pytest.mark.parametrize('mode', ['slerp', 'spline'])
+@pytest.mark.parametrize('keyStep', [1, 3])
+def test_interpolate_poses_through_keys(c2w, mode, keyStep):
+    keys = c2w[::keyStep]
+    perKey = 5
+    poses = interpolate_poses(c2w, (len(keys) - 1) * perKey + 1, mode, keyStep)
+    assert_rotations(poses)
+    # starts and ends at the first and last key pose and passes through every key pose in between
+    np.testing.assert_allclose(poses[0], c2w[0], atol=1e-9)
+    np.testing.assert_allclose(poses[-1], keys[-1], atol=1e-9)
+    np.testing.assert_allclose(poses[::perKey], keys, atol=1e-9)
+
+def test_interpolate_poses_errors(c2w):
+    with pytest.raises(ValueError):
+        interpolate_poses(c2w, 10, mode='linear')
+    with pytest.raises(ValueError):
+        interpolate_poses(c2w[:1], 10)
+
+
+@pytest.fixture
+def path():
+    return tube_cameras(4)
+
+def render(path, outputDir, tileSize=8, **kwargs):
+    renderer = TiledRenderer(TubeField(), HEIGHT, WIDTH, float(WIDTH), tileSize, numSamples=32)
+    return list(renderer.render_path(path, BOUNDS, outputDir, **kwargs))
+
+def test_pooled_matches_serial(tmp_path, path):
+    serialDir, pooledDir, wholeDir = (os.path.join(str(tmp_path), name) for name in ('serial', 'pooled', 'whole'))
+    names = render(path, serialDir)
+    assert names == ['r_000', 'r_001', 'r_002', 'r_003']
+    assert render(path, pooledDir, workers=2, maxPending=3) == names
+    # one tile covering the whole frame
+    assert render(path, wholeDir, tileSize=max(HEIGHT, WIDTH)) == names
+
+    for name in names:
+        serial = load_frame(serialDir, name)
+        assert serial['rgb'].shape == (HEIGHT, WIDTH, 3) and serial['rgb'].dtype == np.uint8
+        for otherDir in (pooledDir, wholeDir):
+            other = load_frame(otherDir, name)
+            for key in serial:
+                np.testing.assert_array_equal(other[key], serial[key])
+
+def test_resume_skips_finished_frames(tmp_path, path):
+    outputDir = str(tmp_path)
+    names = render(path, outputDir)
+    os.remove(frame_path(outputDir, names[2]))
+    finished = {name: os.stat(frame_path(outputDir, name)).st_mtime_ns for name in names if name != names[2]}
+
+    assert render(path, outputDir, workers=2) == [names[2]]
+    for name, mtime in finished.items():
+        assert os.stat(frame_path(outputDir, name)).st_mtime_ns == mtime
+    assert not [name for name in os.listdir(outputDir) if name.endswith('.tmp')]
+
+    assert render(path, outputDir, resume=False) == names
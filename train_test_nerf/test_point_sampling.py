@@ -0,0 +1,129 @@
+'''
+
+test_point_sampling.py
+
+sample_pdf against the per-ray inverse-CDF sampling of nerf_pl, ray_aabb on
+rays that hit and miss a box, and an OccupancyGrid built from the exact depth
+maps of the tube scene of bench_point_sampling.py that has to keep every
+surface point.
+
+    python -m pytest -q test_point_sampling.py
+
+'''
+
+import numpy as np
+import pytest
+
+from bench_point_sampling import tube_cameras, tube_depth
+from point_sampling import OccupancyGrid, _bin_positions, ray_aabb, sample_occupied, sample_pdf, skip_empty
+from ray_generation import RayGenerator, get_ray_directions
+
+NUM_RAYS = 50
+NUM_BINS = 32
+HEIGHT = 24
+WIDTH = 32
+
+
+def inverse_cdf(bins, weights, u, eps=1e-5):
+    # sample_pdf of nerf_pl/models/rendering.py, one ray at a time
+    t = np.empty(u.shape)
+    for r in range(len(u)):
+        pdf = (weights[r] + eps) / (weights[r] + eps).sum()
+        cdf = np.concatenate(([0.], np.cumsum(pdf)))
+        inds = np.searchsorted(cdf, u[r], side='right')
+        below = np.clip(inds - 1, 0, len(pdf))
+        above = np.clip(inds, 0, len(pdf))
+        denom = cdf[above] - cdf[below]
+        denom[denom < eps] = 1
+        t[r] = bins[r, below] + (u[r] - cdf[below]) / denom * (bins[r, above] - bins[r, below])
+    return t
+
+@pytest.fixture
+def binsWeights():
+    rng = np.random.default_rng(0)
+    bins = np.cumsum(rng.uniform(0.01, 0.2, (NUM_RAYS, NUM_BINS + 1)), axis=1).astype(np.float32)
+    weights = rng.random((NUM_RAYS, NUM_BINS)).astype(np.float32)
+    # rays with empty bins and with all weight in one bin
+    weights[::3, 5:20] = 0.
+    weights[1] = 0.
+    weights[1, 7] = 1.
+    return bins, weights
+
+
+@pytest.mark.parametrize('det', [True, False])
+@pytest.mark.parametrize('numSamples', [1, 16, 129])
+def test_sample_pdf_matches_inverse_cdf(binsWeights, det, numSamples):
+    bins, weights = binsWeights
+    t = sample_pdf(bins, weights, numSamples, det=det, rng=np.random.default_rng(1))
+    u = _bin_positions(numSamples, not det, np.random.default_rng(1), NUM_RAYS)
+    np.testing.assert_allclose(t, inverse_cdf(bins, weights, u), rtol=1e-5, atol=1e-5)
+    assert t.shape == (NUM_RAYS, numSamples) and t.dtype == np.float32
+    assert np.all(np.diff(t, axis=1) >= 0)
+
+def test_sample_pdf_follows_weights(binsWeights):
+    bins, weights = binsWeights
+    t = sample_pdf(bins, weights, 4096, det=True)
+    for r in range(NUM_RAYS):
+        counts = np.histogram(t[r], bins[r])[0] / 4096.
+        pdf = (weights[r] + 1e-5) / (weights[r] + 1e-5).sum()
+        np.testing.assert_allclose(counts, pdf, atol=2e-3)
+
+def test_ray_aabb():
+    aabbMin, aabbMax = np.array([-1., -1., -1.]), np.array([1., 1., 1.])
+    rays_o = np.array([[-3., 0., 0.],    # along x through the center
+                       [0., 0., 0.],     # from inside
+                       [-3., 2., 0.],    # parallel to the box, above it
+                       [-3., -3., 0.],   # diagonal through the center
+                       [-3., 0.5, 0.],   # diagonal, misses
+                       [3., 0., 0.]])    # pointing away
+    rays_d = np.array([[1., 0., 0.], [0., 0., 1.], [1., 0., 0.], [1., 1., 0.], [1., 1., 0.], [1., 0., 0.]])
+    rays_d /= np.linalg.norm(rays_d, axis=1, keepdims=True)
+    tmin, tmax = ray_aabb(rays_o, rays_d, aabbMin, aabbMax)
+
+    hits = [0, 1, 3]
+    np.testing.assert_allclose(tmin[hits], [2., -1., 2. * np.sqrt(2.)])
+    np.testing.assert_allclose(tmax[hits], [4., 1., 4. * np.sqrt(2.)])
+    assert np.all(tmin[[2, 4]] > tmax[[2, 4]])
+    # behind the origin only
+    assert tmax[5] < 0
+
+@pytest.fixture
+def tube():
+    c2w = tube_cameras(6)
+    focal = float(WIDTH)
+    capZ = c2w[-1, 2, 3] - 2.
+    depths = [tube_depth(c2w[k], HEIGHT, WIDTH, focal, capZ) for k in range(len(c2w))]
+    bounds = np.tile([0.05, c2w[0, 2, 3] - capZ + 0.5], (len(c2w), 1))
+    return c2w, depths, focal, bounds
+
+def surface_rays(c2w, depths, focal, bounds):
+    # rays of ray_generation.py and their distance to the surface along the unit directions
+    generator = RayGenerator(c2w, HEIGHT, WIDTH, focal, bounds)
+    rays = generator.rays(0, len(c2w) * HEIGHT * WIDTH)
+    norms = np.linalg.norm(get_ray_directions(HEIGHT, WIDTH, focal, normalize=False), axis=-1).ravel()
+    surface = np.concatenate([depth.ravel() * norms for depth in depths])
+    return rays, surface
+
+@pytest.mark.parametrize('resolution', [32, 64])
+def test_grid_from_depths_keeps_surface(tube, resolution):
+    c2w, depths, focal, bounds = tube
+    grid = OccupancyGrid.from_depths(c2w, depths, focal, bounds, resolution=resolution)
+    # the lumen is empty, else the grid skips nothing
+    assert grid.occupied_fraction() < 0.5
+
+    rays, surface = surface_rays(c2w, depths, focal, bounds)
+    rays_o, rays_d = rays[:, :3], rays[:, 3:6]
+    assert skip_empty(grid, rays_o, rays_d, surface[:, None]).all()
+    # the samples in the middle of the lumen are skipped
+    assert not skip_empty(grid, rays_o, rays_d, 0.1 * surface[:, None]).any()
+
+def test_sample_occupied_reaches_surface(tube):
+    c2w, depths, focal, bounds = tube
+    grid = OccupancyGrid.from_depths(c2w, depths, focal, bounds, resolution=64)
+    rays, surface = surface_rays(c2w, depths, focal, bounds)
+    t, valid = sample_occupied(rays[:, :3], rays[:, 3:6], rays[:, 6], rays[:, 7], grid, 16, perturb=False)
+
+    assert valid.any(axis=1).all()
+    # every ray gets a valid sample within a voxel diagonal of its surface
+    reach = np.linalg.norm(grid.voxelSize) * 2.
+    assert np.all((np.abs(t - surface[:, None]) < reach).any(axis=1))
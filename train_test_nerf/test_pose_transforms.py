@@ -0,0 +1,98 @@
+'''
+
+test_pose_transforms.py
+
+The batched transforms of pose_transforms.py against the per-row code they
+replace (updateCamera of sampleCameraPoses.py and the Blender scripts), on
+both pose formats and composed into a Pipeline.
+
+    python -m pytest -q test_pose_transforms.py
+
+'''
+
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation as R
+
+from pose_transforms import (FlipShift, Pipeline, PoseTransform, Recenter, Rescale, Shift, matrices_to_tranquots,
+                             tranquots_to_matrices)
+
+NUM_POSES = 200
+
+
+@pytest.fixture
+def tranQuots():
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-5., 5., (NUM_POSES, 3))
+    quots = R.random(NUM_POSES, random_state=1).as_quat()
+    return np.concatenate((positions, quots), axis=1)
+
+def update_camera(cameraInfo, deltaDeg, deltaZ):
+    # the per-row scipy euler round trip of the original updateCamera
+    cameraInfo = [list(row) for row in cameraInfo]
+    for i in range(len(cameraInfo)):
+        rEuler = R.from_quat(cameraInfo[i][3:7]).as_euler('xyz', degrees=True)
+        rFlipped = R.from_euler('xyz', [rEuler[0], rEuler[1]+deltaDeg, rEuler[2]], degrees=True).as_quat()
+
+        newCameraInfo = cameraInfo[i][:2]
+        newCameraInfo.extend([cameraInfo[i][2] + deltaZ])
+        newCameraInfo.extend(rFlipped)
+        cameraInfo[i] = newCameraInfo
+    return np.array(cameraInfo)
+
+def assert_same_poses(a, b):
+    # q and -q are the same rotation
+    a, b = np.array(a), np.array(b)
+    signs = np.sign(np.sum(a[:, 3:] * b[:, 3:], axis=1))
+    b[:, 3:] *= signs[:, None]
+    np.testing.assert_allclose(a, b, atol=1e-9)
+
+@pytest.mark.parametrize('deltaDeg, deltaZ', [(180, 37), (90, 0), (-30, -2.5)])
+def test_flip_shift_matches_update_camera(tranQuots, deltaDeg, deltaZ):
+    assert_same_poses(FlipShift(deltaDeg, deltaZ)(tranQuots), update_camera(tranQuots, deltaDeg, deltaZ))
+
+def test_flip_shift_leaves_input(tranQuots):
+    before = tranQuots.copy()
+    FlipShift(180, 37)(tranQuots)
+    np.testing.assert_array_equal(tranQuots, before)
+
+@pytest.mark.parametrize('rows', [3, 4])
+def test_flip_shift_matrices(tranQuots, rows):
+    matrices = tranquots_to_matrices(tranQuots)[:, :rows]
+    flipped = FlipShift(180, 37)(matrices)
+    assert flipped.shape == matrices.shape
+    expected = tranquots_to_matrices(update_camera(tranQuots, 180, 37))[:, :rows]
+    np.testing.assert_allclose(flipped, expected, atol=1e-9)
+
+def test_matrix_round_trip(tranQuots):
+    assert_same_poses(matrices_to_tranquots(tranquots_to_matrices(tranQuots)), tranQuots)
+
+def test_pipeline_composition(tranQuots):
+    transforms = (FlipShift(180, 37), Shift([1., -2., 0.5]), Recenter(), Rescale(1 / 0.75))
+    pipeline = Pipeline(*transforms)
+
+    stepwise = tranQuots
+    for transform in transforms:
+        stepwise = transform(stepwise)
+    assert_same_poses(pipeline(tranQuots), stepwise)
+
+    # the same poses through the matrix format
+    matrices = pipeline(tranquots_to_matrices(tranQuots))
+    assert matrices.shape == (NUM_POSES, 4, 4)
+    assert_same_poses(matrices_to_tranquots(matrices), stepwise)
+
+def test_pipeline_of_flip_shift_matches_update_camera(tranQuots):
+    pipeline = Pipeline(FlipShift(90, 10), FlipShift(90, 27))
+    assert_same_poses(pipeline(tranQuots), update_camera(update_camera(tranQuots, 90, 10), 90, 27))
+
+def test_rejects_other_shapes():
+    with pytest.raises(ValueError):
+        FlipShift(180, 37)(np.zeros((5, 6)))
+
+def test_transform_needs_apply_matrices():
+    class TranQuotsOnly(PoseTransform):
+        def apply_tranquots(self, tranQuots):
+            return tranQuots
+
+    with pytest.raises(TypeError):
+        TranQuotsOnly()
@@ -0,0 +1,77 @@
+'''
+
+test_volume_rendering.py
+
+render_rays against a direct composite of the same samples, and early ray
+termination against rendering every sample, on the rays of the analytic
+TubeField scene of bench_point_sampling.py.
+
+    python -m pytest -q test_volume_rendering.py
+
+'''
+
+import numpy as np
+import pytest
+
+from bench_point_sampling import tube_cameras
+from point_sampling import points_along_rays, sample_stratified
+from ray_generation import RayGenerator
+from volume_rendering import TRANSMITTANCE_THRESHOLD, TubeField, composite, render_rays
+
+HEIGHT = 24
+WIDTH = 32
+BOUNDS = (0.05, 6.)
+NUM_SAMPLES = 64
+
+
+@pytest.fixture
+def rays():
+    generator = RayGenerator(tube_cameras(2), HEIGHT, WIDTH, float(WIDTH), np.array(BOUNDS))
+    return generator.rays(0, 2 * HEIGHT * WIDTH)
+
+def composite_samples(field, rays, numSamples, whiteBack=False):
+    # evaluates every sample of every ray at once and composites them
+    t = sample_stratified(rays[:, 6], rays[:, 7], numSamples, perturb=False)
+    points = points_along_rays(rays[:, :3], rays[:, 3:6], t).reshape(-1, 3)
+    dirs = np.repeat(rays[:, 3:6], numSamples, axis=0)
+    sigmas, rgbs = field(points, dirs)
+    return composite(sigmas.reshape(t.shape), rgbs.reshape(t.shape + (3,)), t, whiteBack=whiteBack)
+
+
+@pytest.mark.parametrize('chunkSize, sampleChunk', [(1000, 16), (4096, 64), (333, 7)])
+@pytest.mark.parametrize('whiteBack', [False, True])
+def test_no_threshold_matches_composite(rays, chunkSize, sampleChunk, whiteBack):
+    field = TubeField()
+    results = render_rays(field, rays, NUM_SAMPLES, chunkSize=chunkSize, sampleChunk=sampleChunk, threshold=0.,
+                          whiteBack=whiteBack, returnWeights=True)
+    rgb, depth, opacity, weights = composite_samples(field, rays, NUM_SAMPLES, whiteBack)
+
+    np.testing.assert_array_equal(results['samples'], NUM_SAMPLES)
+    np.testing.assert_allclose(results['rgb'], rgb, atol=1e-5)
+    np.testing.assert_allclose(results['depth'], depth, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(results['opacity'], opacity, atol=1e-5)
+    np.testing.assert_allclose(results['weights'], weights, atol=1e-5)
+
+def test_composite_of_uniform_density():
+    # a constant density sigma gives the transmittance exp(-sigma * t) in front of every sample
+    sigma = 0.7
+    t = np.tile(np.linspace(0., 4., 41), (3, 1))
+    rgbs = np.full(t.shape + (3,), 0.5)
+    rgb, depth, opacity, weights = composite(np.full(t.shape, sigma), rgbs, t)
+    np.testing.assert_allclose(weights[:, :-1], np.exp(-sigma * t[:, :-1]) * (1. - np.exp(-sigma * 0.1)), rtol=1e-6)
+    # the last interval reaches to infinity, every ray ends opaque
+    np.testing.assert_allclose(opacity, 1., rtol=1e-6)
+    np.testing.assert_allclose(rgb, 0.5, rtol=1e-6)
+
+@pytest.mark.parametrize('threshold', [TRANSMITTANCE_THRESHOLD, 1e-3])
+def test_early_termination_within_tolerance(rays, threshold):
+    field = TubeField()
+    full = render_rays(field, rays, NUM_SAMPLES, threshold=0.)
+    terminated = render_rays(field, rays, NUM_SAMPLES, threshold=threshold)
+
+    # the rays that hit the opaque wall skip their remaining samples
+    assert terminated['samples'].min() < NUM_SAMPLES and terminated['samples'].mean() < 0.75 * NUM_SAMPLES
+    # the skipped samples add at most threshold to the color and opacity
+    assert np.abs(terminated['rgb'] - full['rgb']).max() <= threshold + 1e-5
+    assert np.abs(terminated['opacity'] - full['opacity']).max() <= threshold + 1e-5
+    assert np.abs(terminated['depth'] - full['depth']).max() <= threshold * BOUNDS[1] + 1e-4
@@ -0,0 +1,181 @@
+'''
+
+transforms2npy.py
+
+Converts the cameras of a Blender render into the poses_bounds.npy format
+expected by the NeRF model (https://github.com/Fyusion/LLFF/issues/10),
+without the detour through an excel file. The cameras are read from
+
+    transforms.json, as written by the render scripts (transform_matrix of
+    every frame), or
+    a render job manifest of render_planner.py (camera locations, plus a
+    rotation_quaternion or a TRACK_TO constraint aiming at --target)
+
+Blender camera-to-world matrices have the columns [right, up, backwards];
+poses_bounds.npy expects [down, right, backwards], so the columns become
+[-up, right, backwards]. The focal length in pixels is
+0.5 * width / tan(0.5 * camera_angle_x). Near/far bounds are estimated per
+frame from the rendered depth maps (see depth_bounds.py); without depth maps
+--near/--far are used for every frame.
+
+Flags:
+    --transforms (transforms.json or render manifest to convert)
+    --output (Path to the directory where the produced poses_bounds.npy file can be placed)
+    --width, --height (Image size in pixels, default 640x480 as in the render scripts)
+    --focal (Focal length in pixels, default is computed from the camera angle)
+    --angle-x (Horizontal field of view in radians, for manifests or transforms.json without one)
+    --target (Point the TRACK_TO cameras of a manifest aim at, default the origin)
+    --depth (Depth store or directory with the depth maps of the frames)
+    --near, --far (Bounds of frames without depth maps)
+
+'''
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from depth_bounds import estimate_bounds, load_depth
+from depth_store import DepthStore, is_depth_store
+from pose_transforms import tranquots_to_matrices
+
+WIDTH = 640
+HEIGHT = 480
+# horizontal field of view of the default Blender camera (50mm lens, 36mm sensor)
+ANGLE_X = 2 * np.arctan(18. / 50.)
+NEAR = 0.75
+FAR = 2.
+DEPTH_SUFFIX = '_depth92.npz'
+
+
+def blender_to_llff(c2w):
+    # (N, 3/4, 4) Blender camera-to-world matrices to (N, 3, 4) with [down, right, backwards] columns
+    c2w = np.asarray(c2w, dtype=float)
+    return np.concatenate((-c2w[:, :3, 1:2], c2w[:, :3, 0:1], c2w[:, :3, 2:4]), axis=2)
+
+def look_at(locations, target=(0., 0., 0.), worldUp=(0., 0., 1.)):
+    '''
+    Camera-to-world matrices of cameras at locations aiming at target, as the
+    TRACK_TO constraint (TRACK_NEGATIVE_Z, UP_Y) of the render scripts.
+
+    Outputs:
+        c2w: (N, 4, 4), columns [right, up, backwards, location]
+    '''
+    locations = np.asarray(locations, dtype=float).reshape(-1, 3)
+    back = locations - np.asarray(target, dtype=float)
+    back /= np.linalg.norm(back, axis=1, keepdims=True)
+
+    right = np.cross(np.asarray(worldUp, dtype=float), back)
+    # cameras looking straight along worldUp use the y axis as reference
+    parallel = np.linalg.norm(right, axis=1) < 1e-9
+    right[parallel] = np.cross((0., 1., 0.), back[parallel])
+    right /= np.linalg.norm(right, axis=1, keepdims=True)
+    up = np.cross(back, right)
+
+    c2w = np.zeros((len(locations), 4, 4))
+    c2w[:, :3, 0] = right
+    c2w[:, :3, 1] = up
+    c2w[:, :3, 2] = back
+    c2w[:, :3, 3] = locations
+    c2w[:, 3, 3] = 1
+    return c2w
+
+def manifest_to_c2w(manifest, target=(0., 0., 0.)):
+    frames = manifest['frames']
+    locations = np.array([frame['location'] for frame in frames], dtype=float).reshape(-1, 3)
+    c2w = look_at(locations, target) if len(frames) else np.zeros((0, 4, 4))
+
+    posed = [k for k, frame in enumerate(frames) if frame['rotation_quaternion'] is not None]
+    if posed:
+        # (w, x, y, z) -> (x, y, z, w)
+        quots = np.array([frames[k]['rotation_quaternion'] for k in posed], dtype=float)[:, [1, 2, 3, 0]]
+        c2w[posed] = tranquots_to_matrices(np.concatenate((locations[posed], quots), axis=1))
+    return c2w
+
+def focal_from_angle(angleX, width):
+    return 0.5 * width / np.tan(0.5 * angleX)
+
+def load_cameras(transformsPath, target=(0., 0., 0.)):
+    '''
+    Outputs:
+        c2w: (N, 4, 4) Blender camera-to-world matrices
+        names: frame names (file name of the image without extension)
+        angleX: horizontal field of view stored in the file, or None
+    '''
+    with open(transformsPath) as f:
+        data = json.load(f)
+
+    frames = data['frames']
+    if frames and 'transform_matrix' not in frames[0]:
+        return manifest_to_c2w(data, target), [frame['name'] for frame in frames], None
+
+    c2w = np.array([frame['transform_matrix'] for frame in frames], dtype=float).reshape(-1, 4, 4)
+    names = [os.path.splitext(os.path.basename(frame['file_path']))[0] for frame in frames]
+    # camera_fov_radians is written by renderFramesBlenderV2.py, camera_angle_x by renderFramesBlender.py
+    angleX = data.get('camera_angle_x', data.get('camera_fov_radians'))
+    return c2w, names, angleX
+
+def iter_frame_depths(names, depthSource):
+    # depth map of every frame, looked up by name in a depth store or a directory of <name>_depth92.npz files
+    store = DepthStore(depthSource) if is_depth_store(depthSource) else None
+    missing = [name for name in names
+               if (name not in store.names if store else not os.path.exists(os.path.join(depthSource, name + DEPTH_SUFFIX)))]
+    if missing:
+        raise IOError('no depth maps for {} frames in {}, e.g. {}'.format(len(missing), depthSource, missing[0]))
+
+    for name in names:
+        yield store.frame(name) if store else load_depth(os.path.join(depthSource, name + DEPTH_SUFFIX))
+
+def convert_transforms(transformsPath, width=WIDTH, height=HEIGHT, focal=None, angleX=None, target=(0., 0., 0.),
+                       depthSource=None, near=NEAR, far=FAR):
+    # returns the (N, 17) poses_bounds rows of all frames
+    c2w, names, fileAngleX = load_cameras(transformsPath, target)
+    if focal is None:
+        focal = focal_from_angle(angleX or fileAngleX or ANGLE_X, width)
+
+    numPoses = len(c2w)
+    poses = np.empty((numPoses, 3, 5))
+    poses[:, :, :4] = blender_to_llff(c2w)
+    poses[:, :, 4] = (height, width, focal)
+
+    posesBounds = np.empty((numPoses, 17))
+    posesBounds[:, :15] = poses.reshape(numPoses, 15)
+    if depthSource:
+        posesBounds[:, 15:] = estimate_bounds(iter_frame_depths(names, depthSource), fallback=(near, far))
+    else:
+        posesBounds[:, 15] = near
+        posesBounds[:, 16] = far
+    return posesBounds
+
+def main(args):
+    if not args.transforms:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    posesBounds = convert_transforms(args.transforms, args.width, args.height, args.focal, args.angle_x, args.target,
+                                     args.depth, args.near, args.far)
+    with open(os.path.join(args.output, 'poses_bounds.npy'), 'wb') as writeFile:
+        np.save(writeFile, posesBounds)
+    print('converted {} frames, focal {:.2f}, near {:.4f} - {:.4f}, far {:.4f} - {:.4f}'.format(
+        len(posesBounds), posesBounds[0, 14] if len(posesBounds) else 0., posesBounds[:, 15].min(initial=np.inf),
+        posesBounds[:, 15].max(initial=-np.inf), posesBounds[:, 16].min(initial=np.inf), posesBounds[:, 16].max(initial=-np.inf)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--transforms', type=str, help='transforms.json or render manifest to convert')
+    parser.add_argument('--output', type=str, default=os.getcwd(), help='Path to directory to place the produced poses_bounds.npy file')
+    parser.add_argument('--width', type=int, default=WIDTH, help='Image width in pixels')
+    parser.add_argument('--height', type=int, default=HEIGHT, help='Image height in pixels')
+    parser.add_argument('--focal', type=float, default=None, help='Focal length in pixels')
+    parser.add_argument('--angle-x', type=float, default=None, help='Horizontal field of view in radians')
+    parser.add_argument('--target', type=float, nargs=3, default=(0., 0., 0.), help='Point the TRACK_TO cameras aim at')
+    parser.add_argument('--depth', type=str, default=None, help='Depth store or directory with the depth maps')
+    parser.add_argument('--near', type=float, default=NEAR, help='Near bound of frames without depth maps')
+    parser.add_argument('--far', type=float, default=FAR, help='Far bound of frames without depth maps')
+
+    args = parser.parse_args()
+
+    main(args)
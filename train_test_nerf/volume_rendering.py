@@ -0,0 +1,182 @@
+'''
+
+volume_rendering.py
+
+Volume rendering of NeRF samples on the CPU, as nerf_pl/models/rendering.py
+does on the GPU. composite turns the (n_rays, n_samples) densities and
+colors of a network into the rendered color, expected depth, opacity and
+the per-sample weights:
+
+    alpha_i = 1 - exp(-sigma_i * delta_i)
+    T_i     = prod_{j < i} (1 - alpha_j)       (transmittance)
+    w_i     = T_i * alpha_i
+
+render_rays renders rays through a radiance field, any callable
+field(points, dirs) -> (sigmas, rgbs) on (m, 3) arrays, e.g. a trained
+network or the analytic TubeField. Rays are rendered in chunks of chunkSize
+and their samples are evaluated in blocks of sampleChunk along the rays; a
+ray whose transmittance drops below threshold is terminated, its remaining
+samples are never evaluated (they could add at most threshold to any
+output). threshold=0 gives the same result as composite.
+
+render_camera_file renders the cameras of a camera json or bundle written by
+poseNpy2json.py (see ray_generation.load_camera_file) frame by frame.
+
+'''
+
+import numpy as np
+
+from point_sampling import points_along_rays, sample_stratified
+from ray_generation import RayGenerator, load_camera_file
+
+CHUNK_SIZE = 32768
+SAMPLE_CHUNK = 16
+TRANSMITTANCE_THRESHOLD = 1e-4
+NUM_SAMPLES = 64
+FAR_DELTA = 1e10   # length of the last sample interval, as in nerf_pl
+
+
+def sample_deltas(t):
+    # distance from every sample to the next one, the last one reaches to infinity
+    deltas = np.empty_like(t)
+    deltas[:, :-1] = t[:, 1:] - t[:, :-1]
+    deltas[:, -1] = FAR_DELTA
+    return deltas
+
+def composite(sigmas, rgbs, t, whiteBack=False, threshold=0.):
+    '''
+    Inputs:
+        sigmas: (n_rays, n_samples) densities
+        rgbs: (n_rays, n_samples, 3) colors
+        t: (n_rays, n_samples) sample distances along unit ray directions
+        whiteBack: composite over a white instead of a black background
+        threshold: samples behind a transmittance below threshold do not contribute
+
+    Outputs:
+        rgb: (n_rays, 3), depth: (n_rays,), opacity: (n_rays,), weights: (n_rays, n_samples)
+    '''
+    alphas = 1. - np.exp(-sample_deltas(t) * np.maximum(sigmas, 0.))
+    # exclusive cumulative product, 1e-10 as in nerf_pl
+    trans = np.ones_like(alphas)
+    np.cumprod(1. - alphas[:, :-1] + 1e-10, axis=1, out=trans[:, 1:])
+    if threshold:
+        trans[trans < threshold] = 0.
+    weights = alphas * trans
+
+    opacity = weights.sum(axis=1)
+    rgb = np.einsum('ns,nsc->nc', weights, rgbs)
+    if whiteBack:
+        rgb += 1. - opacity[:, None]
+    return rgb, (weights * t).sum(axis=1), opacity, weights
+
+
+class TubeField:
+    '''
+    Analytic stand-in for a trained network: an opaque tube of the given
+    radius around the z axis (a smooth density step at the wall), with a
+    striped color pattern on the wall so rendered frames differ between
+    views.
+    '''
+    def __init__(self, radius=1., sigmaMax=100., width=0.02):
+        self.radius = radius
+        self.sigmaMax = sigmaMax
+        self.width = width
+
+    def __call__(self, points, dirs):
+        r = np.sqrt(points[:, 0] ** 2 + points[:, 1] ** 2)
+        sigmas = self.sigmaMax / (1. + np.exp(-(r - self.radius) / self.width))
+        angle = np.arctan2(points[:, 1], points[:, 0])
+        rgbs = np.empty((len(points), 3), dtype=np.float32)
+        rgbs[:, 0] = 0.6 + 0.3 * np.sin(4. * points[:, 2])
+        rgbs[:, 1] = 0.3 + 0.2 * np.sin(3. * angle)
+        rgbs[:, 2] = 0.3 + 0.1 * np.cos(2. * points[:, 2] + angle)
+        return sigmas.astype(np.float32), rgbs
+
+
+def _render_chunk(field, rays, t, sampleChunk, threshold, whiteBack, weights):
+    n, numSamples = t.shape
+    rays_o, rays_d = rays[:, :3], rays[:, 3:6]
+    deltas = sample_deltas(t)
+
+    rgb = np.zeros((n, 3), dtype=np.float32)
+    depth = np.zeros(n, dtype=np.float32)
+    opacity = np.zeros(n, dtype=np.float32)
+    trans = np.ones(n, dtype=np.float32)
+    evaluated = np.zeros(n, dtype=np.int32)
+
+    alive = np.arange(n)
+    for s in range(0, numSamples, sampleChunk):
+        if threshold:
+            alive = alive[trans[alive] >= threshold]
+            if not len(alive):
+                break
+        e = min(s + sampleChunk, numSamples)
+        tBlock = t[alive, s:e]
+        points = points_along_rays(rays_o[alive], rays_d[alive], tBlock).reshape(-1, 3)
+        dirs = np.broadcast_to(rays_d[alive, None, :], (len(alive), e - s, 3)).reshape(-1, 3)
+        sigmas, rgbs = field(points, dirs)
+
+        alphas = 1. - np.exp(-deltas[alive, s:e] * np.maximum(sigmas.reshape(-1, e - s), 0.))
+        # transmittance in front of every sample of the block
+        blockTrans = np.empty_like(alphas)
+        blockTrans[:, 0] = trans[alive]
+        np.cumprod(1. - alphas[:, :-1] + 1e-10, axis=1, out=blockTrans[:, 1:])
+        blockTrans[:, 1:] *= trans[alive, None]
+        if threshold:
+            blockTrans[blockTrans < threshold] = 0.
+        blockWeights = alphas * blockTrans
+
+        rgb[alive] += np.einsum('ns,nsc->nc', blockWeights, rgbs.reshape(-1, e - s, 3))
+        depth[alive] += (blockWeights * tBlock).sum(axis=1)
+        opacity[alive] += blockWeights.sum(axis=1)
+        trans[alive] = blockTrans[:, -1] * (1. - alphas[:, -1] + 1e-10)
+        evaluated[alive] += e - s
+        if weights is not None:
+            weights[alive, s:e] = blockWeights
+
+    if whiteBack:
+        rgb += 1. - opacity[:, None]
+    return rgb, depth, opacity, evaluated
+
+def render_rays(field, rays, numSamples=NUM_SAMPLES, chunkSize=CHUNK_SIZE, sampleChunk=SAMPLE_CHUNK,
+                threshold=TRANSMITTANCE_THRESHOLD, perturb=False, rng=None, whiteBack=False, returnWeights=False):
+    '''
+    Inputs:
+        field: callable (points (m, 3), dirs (m, 3)) -> (sigmas (m,), rgbs (m, 3))
+        rays: (n_rays, 8) rays [origin, direction, near, far] of ray_generation.py
+        numSamples: stratified samples per ray between near and far
+
+    Outputs:
+        dict of rgb (n_rays, 3), depth (n_rays,), opacity (n_rays,),
+        samples (n_rays,) number of evaluated samples and, with returnWeights,
+        weights (n_rays, numSamples) (zero for samples that were not evaluated)
+    '''
+    n = len(rays)
+    results = {'rgb': np.empty((n, 3), dtype=np.float32), 'depth': np.empty(n, dtype=np.float32),
+               'opacity': np.empty(n, dtype=np.float32), 'samples': np.empty(n, dtype=np.int32)}
+    if returnWeights:
+        results['weights'] = np.zeros((n, numSamples), dtype=np.float32)
+
+    for s in range(0, n, chunkSize):
+        e = min(s + chunkSize, n)
+        chunk = rays[s:e]
+        t = sample_stratified(chunk[:, 6], chunk[:, 7], numSamples, perturb=perturb, rng=rng)
+        weights = results['weights'][s:e] if returnWeights else None
+        (results['rgb'][s:e], results['depth'][s:e], results['opacity'][s:e],
+         results['samples'][s:e]) = _render_chunk(field, chunk, t, sampleChunk, threshold, whiteBack, weights)
+    return results
+
+def render_cameras(field, c2w, H, W, focal, bounds, **kwargs):
+    # yields the render_rays results of every camera, reshaped to (H, W, ...) images
+    generator = RayGenerator(c2w, H, W, focal, bounds)
+    buffer = np.empty((generator.raysPerCamera, 8), dtype=np.float32)
+    for cam in range(len(generator.c2w)):
+        start = cam * generator.raysPerCamera
+        rays = generator.rays(start, start + generator.raysPerCamera, out=buffer)
+        results = render_rays(field, rays, **kwargs)
+        yield {key: value.reshape((H, W) + value.shape[1:]) for key, value in results.items()}
+
+def render_camera_file(cameraPath, field, near, far, **kwargs):
+    # renders the cameras of a camera json (or bundle) of poseNpy2json.py, sorted by name as in camera_bundle.py
+    c2w, bounds, H, W, focal = load_camera_file(cameraPath, near, far)
+    return render_cameras(field, c2w, H, W, focal, bounds, **kwargs)
@@ -0,0 +1,81 @@
+'''
+
+bench_camera_bundle.py
+
+Compares the camera json files with the binary camera bundles of
+camera_bundle.py: file size, write time and the time to load the cameras
+into K/W2C arrays (json.load + np.array(...).reshape per camera, as
+visualize_camera_stomach.py used to do, vs. load_bundle).
+
+Flags:
+    --cameras (Numbers of synthetic cameras to test, default 20 10000 100000)
+    --workdir (Directory for the written files, default is a temporary directory)
+
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from camera_bundle import bundle_to_dict, load_bundle, make_bundle, save_bundle
+
+
+def synthetic_bundle(N, seed=0):
+    # random rigid world-to-camera matrices with the intrinsics used by poseNpy2json.py
+    rng = np.random.default_rng(seed)
+    rot, _ = np.linalg.qr(rng.normal(size=(N, 3, 3)))
+    W2C = np.zeros((N, 4, 4))
+    W2C[:, :3, :3] = rot
+    W2C[:, :3, 3] = rng.normal(size=(N, 3))
+    W2C[:, 3, 3] = 1
+    K = np.array([[680., 0, 160, 0], [0, 680., 160, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+    return make_bundle([f'{idx:03d}' for idx in range(N)], K, W2C, [320., 320.])
+
+def load_json_cameras(json_path):
+    camera_dict = json.load(open(json_path))
+    K, W2C = [], []
+    for img_name in sorted(camera_dict.keys()):
+        K.append(np.array(camera_dict[img_name]['K']).reshape((4, 4)))
+        W2C.append(np.array(camera_dict[img_name]['W2C']).reshape((4, 4)))
+    return K, W2C
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_camera_bundle_')
+    os.makedirs(workdir, exist_ok=True)
+
+    print('{:>8}{:>8}{:>12}{:>12}{:>12}'.format('cameras', 'format', 'size (MB)', 'write (s)', 'load (s)'))
+    for N in args.cameras:
+        bundle = synthetic_bundle(N)
+        json_path = os.path.join(workdir, 'cameras_{}.json'.format(N))
+        bundle_path = os.path.join(workdir, 'cameras_{}.npz'.format(N))
+
+        def write_json():
+            with open(json_path, 'w') as f:
+                f.write(json.dumps(bundle_to_dict(bundle)))
+
+        results = [
+            ('json', json_path, timed(write_json), timed(load_json_cameras, json_path)),
+            ('bundle', bundle_path, timed(save_bundle, bundle, bundle_path), timed(load_bundle, bundle_path)),
+        ]
+        for fmt, path, write_time, load_time in results:
+            size = os.path.getsize(path) / (1024.0 * 1024.0)
+            print('{:>8d}{:>8}{:>12.2f}{:>12.4f}{:>12.4f}'.format(N, fmt, size, write_time, load_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--cameras', type=int, nargs='+', default=[20, 10000, 100000], help='Numbers of synthetic cameras')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the written files')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,105 @@
+'''
+
+camera_bundle.py
+
+A binary alternative to the camera json files written by poseNpy2json.py.
+A bundle is an uncompressed .npz file holding contiguous arrays for all
+cameras instead of one dict of float lists per camera:
+
+    version:  () int, BUNDLE_VERSION
+    names:    (N,) str, camera names (the keys of the json file), in order
+    K:        (N, 4, 4) float64 intrinsic matrices
+    W2C:      (N, 4, 4) float64 world-to-camera matrices
+    img_size: (N, 2) float64 [height, width]
+
+Existing json files can be converted in both directions:
+    python camera_bundle.py stomach_camera_original.json stomach_camera_original.npz
+    python camera_bundle.py stomach_camera_original.npz stomach_camera_original.json
+
+'''
+
+import json
+import os
+import sys
+
+import numpy as np
+
+BUNDLE_VERSION = 1
+BUNDLE_KEYS = ('names', 'K', 'W2C', 'img_size')
+
+
+def make_bundle(names, K, W2C, img_size):
+    N = len(names)
+    bundle = {
+        'names': np.asarray(names, dtype=str),
+        'K': np.ascontiguousarray(np.broadcast_to(np.asarray(K, dtype=float).reshape(-1, 4, 4), (N, 4, 4))),
+        'W2C': np.ascontiguousarray(np.asarray(W2C, dtype=float).reshape(N, 4, 4)),
+        'img_size': np.ascontiguousarray(np.broadcast_to(np.asarray(img_size, dtype=float).reshape(-1, 2), (N, 2))),
+    }
+    return bundle
+
+def save_bundle(bundle, bundle_path):
+    # np.savez (not savez_compressed) so loading is a plain read of each array
+    with open(bundle_path, 'wb') as f:
+        np.savez(f, version=np.array(BUNDLE_VERSION), **{key: bundle[key] for key in BUNDLE_KEYS})
+
+def load_bundle(bundle_path):
+    with np.load(bundle_path, allow_pickle=False) as data:
+        version = int(data['version'])
+        if version != BUNDLE_VERSION:
+            raise ValueError('unsupported camera bundle version {} in {}'.format(version, bundle_path))
+        return {key: data[key] for key in BUNDLE_KEYS}
+
+def camera_names(camera_dict):
+    # numeric names (frame indices) in numeric order, so '100' comes before '1000', others in file order
+    names = list(camera_dict.keys())
+    if all(str(name).isdigit() for name in names):
+        return sorted(names, key=int)
+    return names
+
+def bundle_from_dict(camera_dict):
+    # camera dict as stored in the json files, see camera_names for the order of the cameras
+    names = camera_names(camera_dict)
+    K = [camera_dict[name]['K'] for name in names]
+    W2C = [camera_dict[name]['W2C'] for name in names]
+    img_size = [camera_dict[name]['img_size'] for name in names]
+    return make_bundle(names, K, W2C, img_size)
+
+def bundle_to_dict(bundle):
+    K = bundle['K'].reshape(-1, 16).tolist()
+    W2C = bundle['W2C'].reshape(-1, 16).tolist()
+    img_size = bundle['img_size'].tolist()
+    return {str(name): {'K': K[i], 'W2C': W2C[i], 'img_size': img_size[i]}
+            for i, name in enumerate(bundle['names'])}
+
+def load_cameras(camera_path):
+    # bundle of a .npz bundle or of a json camera file
+    if camera_path.endswith('.npz'):
+        return load_bundle(camera_path)
+    with open(camera_path) as f:
+        return bundle_from_dict(json.load(f))
+
+def as_bundle(cameras):
+    # accept either a camera dict (json layout) or a bundle
+    if 'W2C' in cameras and isinstance(cameras['W2C'], np.ndarray):
+        return cameras
+    return bundle_from_dict(cameras)
+
+def json2bundle(json_path, bundle_path):
+    save_bundle(load_cameras(json_path), bundle_path)
+
+def bundle2json(bundle_path, json_path):
+    with open(json_path, 'w') as f:
+        f.write(json.dumps(bundle_to_dict(load_bundle(bundle_path))))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python camera_bundle.py <input .json|.npz> <output .npz|.json>', file=sys.stderr)
+        sys.exit(1)
+
+    src, dst = sys.argv[1:]
+    if os.path.splitext(dst)[1] == '.npz':
+        json2bundle(src, dst)
+    else:
+        bundle2json(src, dst)
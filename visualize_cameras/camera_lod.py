@@ -0,0 +1,144 @@
+'''
+
+camera_lod.py
+
+Level-of-detail decimation of camera sets, so that full-length EndoSLAM
+trajectories stay usable in visualize_camera_stomach.py. Two decimation
+methods are available, both work on the (N, 4, 4) W2C arrays of a camera
+bundle (see camera_bundle.py):
+
+    voxel:       keep the first camera of every occupied voxel of a grid over
+                 the camera centers
+    pose_change: walk along the trajectory and keep a camera whenever the
+                 accumulated motion since the last kept camera exceeds the
+                 translation or the rotation (degrees) threshold
+
+decimate_to_budget picks the voxel size / threshold scale that keeps at most
+a given number of cameras. Every function returns the kept indices together
+with a stats dict describing the decimation that was applied. The decimated
+frustums can be written to .ply or .npz with export_geometry for offline
+inspection.
+
+'''
+
+import json
+
+import numpy as np
+
+from camera_bundle import BUNDLE_KEYS
+from frustum_geometry import w2c_to_c2w
+
+METHODS = ('voxel', 'pose_change')
+
+
+def camera_centers(W2C):
+    return w2c_to_c2w(np.asarray(W2C, dtype=float).reshape(-1, 4, 4))[:, :3, 3]
+
+def relative_angles(W2C):
+    # (N-1,) rotation angle in degrees between consecutive cameras
+    rot = np.asarray(W2C, dtype=float).reshape(-1, 4, 4)[:, :3, :3]
+    # trace(R_i^T R_i+1) = sum of the elementwise product
+    cos = (np.einsum('nij,nij->n', rot[:-1], rot[1:]) - 1.) / 2.
+    return np.rad2deg(np.arccos(np.clip(cos, -1., 1.)))
+
+def decimate_voxel(W2C, voxel_size):
+    centers = camera_centers(W2C)
+    if len(centers) == 0:
+        idx = np.zeros(0, dtype=int)
+    else:
+        cells = np.floor(centers / voxel_size).astype(np.int64)
+        cells -= cells.min(axis=0)
+        dims = cells.max(axis=0) + 1
+        # one int64 key per voxel, much faster to unique than rows of cells
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+        _, first = np.unique(keys, return_index=True)
+        idx = np.sort(first)
+    stats = {'method': 'voxel', 'input_cameras': len(centers), 'kept_cameras': len(idx),
+             'voxel_size': float(voxel_size)}
+    return idx, stats
+
+def _accumulated_motion(W2C, min_translation, min_rotation):
+    # motion between consecutive cameras in units of the thresholds, accumulated along the trajectory
+    centers = camera_centers(W2C)
+    if len(centers) < 2:
+        return np.zeros(len(centers))
+    step = np.maximum(np.linalg.norm(np.diff(centers, axis=0), axis=1) / min_translation,
+                      relative_angles(W2C) / min_rotation)
+    return np.concatenate(([0.], np.cumsum(step)))
+
+def _keep_crossings(motion, scale=1.):
+    # first camera plus every camera where the accumulated motion passes another threshold
+    if len(motion) == 0:
+        return np.zeros(0, dtype=int)
+    level = np.floor(motion / scale)
+    return np.concatenate(([0], np.flatnonzero(np.diff(level) > 0) + 1))
+
+def decimate_pose_change(W2C, min_translation=0.05, min_rotation=5.):
+    motion = _accumulated_motion(W2C, min_translation, min_rotation)
+    idx = _keep_crossings(motion)
+    stats = {'method': 'pose_change', 'input_cameras': len(motion), 'kept_cameras': len(idx),
+             'min_translation': float(min_translation), 'min_rotation_deg': float(min_rotation)}
+    return idx, stats
+
+def decimate_to_budget(W2C, budget, method='voxel', min_translation=0.05, min_rotation=5., iterations=30):
+    '''
+    Decimate to at most budget cameras. For 'voxel' the voxel size is searched,
+    for 'pose_change' both thresholds are scaled by the same factor, keeping
+    their ratio. Cameras are returned as they are if they fit the budget.
+    '''
+    if method not in METHODS:
+        raise ValueError('unknown decimation method: {}'.format(method))
+    W2C = np.asarray(W2C, dtype=float).reshape(-1, 4, 4)
+    N = len(W2C)
+
+    if N <= budget:
+        idx = np.arange(N)
+        stats = {'method': 'none', 'input_cameras': N, 'kept_cameras': N}
+    elif method == 'voxel':
+        centers = camera_centers(W2C)
+        extent = float(np.ptp(centers, axis=0).max()) or 1.
+        # bisect the voxel size on a log scale, larger voxels keep fewer cameras
+        lo, hi = np.log(extent * 1e-5), np.log(extent * 2.)
+        for _ in range(iterations):
+            mid = (lo + hi) / 2.
+            if decimate_voxel(W2C, np.exp(mid))[1]['kept_cameras'] > budget:
+                lo = mid
+            else:
+                hi = mid
+        idx, stats = decimate_voxel(W2C, np.exp(hi))
+    else:
+        motion = _accumulated_motion(W2C, min_translation, min_rotation)
+        # every kept camera after the first needs one threshold of motion
+        scale = max(motion[-1] / max(budget - 1, 1), 1e-12)
+        idx = _keep_crossings(motion, scale)
+        while len(idx) > budget:
+            scale *= 1.01
+            idx = _keep_crossings(motion, scale)
+        stats = {'method': 'pose_change', 'input_cameras': N, 'kept_cameras': len(idx),
+                 'min_translation': float(min_translation * scale), 'min_rotation_deg': float(min_rotation * scale)}
+
+    stats['budget'] = int(budget)
+    return idx, stats
+
+def select_cameras(bundle, idx):
+    # camera bundle with only the cameras in idx
+    return {key: bundle[key][idx] for key in BUNDLE_KEYS}
+
+def export_geometry(path, points, lines, colors, stats=None):
+    # .npz keeps the arrays (and the stats as json), anything else is written as an ascii .ply line set
+    if path.endswith('.npz'):
+        with open(path, 'wb') as f:
+            np.savez(f, points=points, lines=lines, colors=colors, stats=json.dumps(stats or {}))
+        return
+
+    rgb = np.clip(np.round(np.asarray(colors) * 255), 0, 255).astype(int)
+    with open(path, 'w') as f:
+        f.write('ply\nformat ascii 1.0\n')
+        if stats:
+            for key, value in stats.items():
+                f.write('comment {} {}\n'.format(key, value))
+        f.write('element vertex {}\nproperty float x\nproperty float y\nproperty float z\n'.format(len(points)))
+        f.write('element edge {}\nproperty int vertex1\nproperty int vertex2\n'.format(len(lines)))
+        f.write('property uchar red\nproperty uchar green\nproperty uchar blue\nend_header\n')
+        np.savetxt(f, points, fmt='%.6f')
+        np.savetxt(f, np.concatenate((np.asarray(lines, dtype=int), rgb), axis=1), fmt='%d')
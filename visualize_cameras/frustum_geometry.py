@@ -0,0 +1,89 @@
+'''
+
+frustum_geometry.py
+
+Camera frustums for visualize_camera_stomach.py, the per-camera
+get_camera_frustum of nerf++ vectorized. The frustums of all N cameras are
+built in one pass as merged line-set arrays:
+
+    points: (N*5, 3) camera center followed by the 4 image corners per camera
+    lines:  (N*8, 2) int indices into points
+    colors: (N*8, 3) one color per line
+
+Only numpy is needed to build the geometry, open3d is imported by
+to_lineset when the arrays are turned into an o3d.geometry.LineSet.
+
+'''
+
+import numpy as np
+
+# 4 lines from the origin to the image corners, then the image rectangle
+FRUSTUM_LINES = np.array([[0, i] for i in range(1, 5)] + [[i, (i+1)] for i in range(1, 4)] + [[4, 1]])
+
+
+def w2c_to_c2w(W2C):
+    # closed-form inverse of (N, 4, 4) rigid world-to-camera matrices
+    rot = W2C[:, :3, :3]
+    C2W = np.zeros_like(W2C)
+    C2W[:, :3, :3] = rot.transpose(0, 2, 1)
+    C2W[:, :3, 3] = -np.einsum('nji,nj->ni', rot, W2C[:, :3, 3])
+    C2W[:, 3, 3] = 1
+    return C2W
+
+def camera_frustums(K, W2C, img_size, frustum_length=0.5, color=(0., 1., 0.)):
+    '''
+    Inputs:
+        K: (N, 4, 4) or (4, 4) intrinsics
+        W2C: (N, 4, 4) rigid world-to-camera matrices
+        img_size: (N, 2) or (2,) image size, unpacked as W, H
+        color: (3,) color for all cameras or (N, 3) per camera
+
+    Outputs:
+        points (N*5, 3), lines (N*8, 2), colors (N*8, 3)
+    '''
+    W2C = np.asarray(W2C, dtype=float).reshape(-1, 4, 4)
+    N = len(W2C)
+    K = np.broadcast_to(np.asarray(K, dtype=float).reshape(-1, 4, 4), (N, 4, 4))
+    img_size = np.broadcast_to(np.asarray(img_size, dtype=float).reshape(-1, 2), (N, 2))
+
+    # tan(fov / 2) = (size / 2) / focal
+    W, H = img_size[:, 0], img_size[:, 1]
+    half_w = frustum_length * W / 2. / K[:, 0, 0]
+    half_h = frustum_length * H / 2. / K[:, 1, 1]
+
+    # view frustums for cameras (I, 0): origin, top-left, top-right, bottom-right, bottom-left
+    local = np.zeros((N, 5, 3))
+    local[:, 1:, 0] = np.array([-1., 1., 1., -1.]) * half_w[:, None]
+    local[:, 1:, 1] = np.array([-1., -1., 1., 1.]) * half_h[:, None]
+    local[:, 1:, 2] = frustum_length
+
+    # transform view frustums from (I, 0) to (R, t)
+    C2W = w2c_to_c2w(W2C)
+    points = np.einsum('nij,npj->npi', C2W[:, :3, :3], local) + C2W[:, None, :3, 3]
+
+    lines = FRUSTUM_LINES[None] + 5 * np.arange(N)[:, None, None]
+    colors = np.broadcast_to(np.asarray(color, dtype=float).reshape(-1, 1, 3), (N, 8, 3))
+
+    return points.reshape(N*5, 3), lines.reshape(N*8, 2), np.ascontiguousarray(colors).reshape(N*8, 3)
+
+def merge_geometry(geometries):
+    # merge several (points, lines, colors) line sets into one
+    points, lines, colors = [], [], []
+    offset = 0
+    for p, l, c in geometries:
+        points.append(p)
+        lines.append(l + offset)
+        colors.append(c)
+        offset += len(p)
+    if not points:
+        return np.zeros((0, 3)), np.zeros((0, 2), dtype=int), np.zeros((0, 3))
+    return np.concatenate(points), np.concatenate(lines), np.concatenate(colors)
+
+def to_lineset(points, lines, colors):
+    import open3d as o3d
+
+    lineset = o3d.geometry.LineSet()
+    lineset.points = o3d.utility.Vector3dVector(points)
+    lineset.lines = o3d.utility.Vector2iVector(lines)
+    lineset.colors = o3d.utility.Vector3dVector(colors)
+    return lineset
@@ -1,168 +1,200 @@
 import os 
+import sys
 import numpy as np 
 import json 
 
-def normalize(v):
-    """Normalize a vector."""
-    return v/np.linalg.norm(v)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train_test_nerf'))
+from pose_store import PoseStore
+from pose_transforms import center_poses
+from camera_bundle import make_bundle, save_bundle
 
-# this function is borrowed from nerf_pl/datasets/llff.py
-def average_poses(poses):
-    """
-    Calculate the average pose, which is then used to center all poses
-    using @center_poses. Its computation is as follows:
-    1. Compute the center: the average of pose centers.
-    2. Compute the z axis: the normalized average z axis.
-    3. Compute axis y': the average y axis.
-    4. Compute x' = y' cross product z, then normalize it as the x axis.
-    5. Compute the y axis: z cross product x.
-    
-    Note that at step 3, we cannot directly use y' as y axis since it's
-    not necessarily orthogonal to z axis. We need to pass from x to y.
+# construct intrinsic matrix from image height,width and focal length 
+def create_Kmatrix(H, W, focal):
+    K = np.array([
+            [focal, 0, 0.5*W, 0],
+            [0, focal, 0.5*H, 0],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1]])
+    return K 
+
+def c2w_to_w2c(c2w, general_inverse=False):
+    '''
+    Invert all camera-to-world poses at once.
 
     Inputs:
-        poses: (N_images, 3, 4)
+        c2w: (N_images, 3, 4) rigid camera-to-world poses
+        general_inverse: use np.linalg.inv instead of the closed-form rigid inverse,
+                         this reproduces the per-camera np.linalg.inv output bit for bit
 
     Outputs:
-        pose_avg: (3, 4) the average pose
-    """
-    # 1. Compute the center
-    center = poses[..., 3].mean(0) # (3)
-
-    # 2. Compute the z axis
-    z = normalize(poses[..., 2].mean(0)) # (3)
-
-    # 3. Compute axis y' (no need to normalize as it's not the final output)
-    y_ = poses[..., 1].mean(0) # (3)
-
-    # 4. Compute the x axis
-    x = normalize(np.cross(y_, z)) # (3)
-
-    # 5. Compute the y axis (as z and x are normalized, y is already of norm 1)
-    y = np.cross(z, x) # (3)
+        w2c: (N_images, 4, 4) world-to-camera matrices
+    '''
+    N = len(c2w)
+    if general_inverse:
+        c2w_homo = np.zeros((N, 4, 4))
+        c2w_homo[:, :3] = c2w
+        c2w_homo[:, 3, 3] = 1
+        return np.linalg.inv(c2w_homo)
+
+    # [R t]^-1 = [R^T -R^T t]
+    rot = c2w[..., :3]
+    w2c = np.zeros((N, 4, 4))
+    w2c[:, :3, :3] = rot.transpose(0, 2, 1)
+    w2c[:, :3, 3] = -np.einsum('nji,nj->ni', rot, c2w[..., 3])
+    w2c[:, 3, 3] = 1
+    return w2c
+
+def cameras_to_dict(w2c, Kmat, H, W):
+    # the json layout read by visualize_camera_stomach.py, keyed by the zero-padded camera index
+    K_list = Kmat.flatten().tolist()
+    img_size = [float(H), float(W)]
+    w2c_lists = w2c.reshape(len(w2c), 16).tolist()
+    return {f'{idx:03d}': {'K': K_list, 'W2C': w2c_list, 'img_size': img_size}
+            for idx, w2c_list in enumerate(w2c_lists)}
+
+def cameras_to_bundle(w2c, Kmat, H, W):
+    # same cameras as cameras_to_dict, as a binary camera bundle (see camera_bundle.py)
+    names = [f'{idx:03d}' for idx in range(len(w2c))]
+    return make_bundle(names, Kmat, w2c, [H, W])
+
+def write_camera_json(all_camera_info, camera_file):
+    # json.dumps uses the C encoder, json.dump falls back to the pure python one
+    with open(camera_file, 'w') as f: 
+        f.write(json.dumps(all_camera_info))
 
-    pose_avg = np.stack([x, y, z, center], 1) # (3, 4)
 
-    return pose_avg
+# json file written for each camera variant
+VARIANT_FILES = {
+    'original': 'stomach_camera_original.json',             # poses as given in poses_bounds.npy
+    'recenter': 'stomach_camera_recenter_noscale.json',     # re-centered with center_poses
+    'recenter_scale': 'stomach_camera_recenter.json',       # re-centered and scaled as in nerf_pl (used in training)
+    'ndc': 'stomach_camera_ndc.json',                       # re-centered, scaled and mapped to NDC
+}
 
-# this function is borrowed from nerf_pl/datasets/llff.py, which is used to re-center the cameras
-def center_poses(poses):
+def ndc_poses(poses, H, W, focal, near=1.0):
     """
-    Center the poses so that we can use NDC.
-    See https://github.com/bmild/nerf/issues/34
+    Move the cameras into normalized device coordinates, as done for the rays in
+    nerf_pl/datasets/ray_utils.py (get_ndc_rays). The camera center is shifted along
+    its viewing direction onto the near plane and then projected into NDC. NDC is not
+    a rigid space, so the rotations are kept as they are; this is meant for visualizing
+    where the cameras end up, not for rendering.
 
     Inputs:
-        poses: (N_images, 3, 4)
+        poses: (N_images, 3, 4) "right up back" camera-to-world poses
 
     Outputs:
-        poses_centered: (N_images, 3, 4) the centered poses
-        pose_avg: (3, 4) the average pose
+        poses_ndc: (N_images, 3, 4)
     """
+    rays_o = poses[..., 3]
+    rays_d = -poses[..., 2] # cameras look along -z
 
-    pose_avg = average_poses(poses) # (3, 4)
-    pose_avg_homo = np.eye(4)
-    pose_avg_homo[:3] = pose_avg # convert to homogeneous coordinate for faster computation
-                                 # by simply adding 0, 0, 0, 1 as the last row
-    last_row = np.tile(np.array([0, 0, 0, 1]), (len(poses), 1, 1)) # (N_images, 1, 4)
-    poses_homo = \
-        np.concatenate([poses, last_row], 1) # (N_images, 4, 4) homogeneous coordinate
-
-    poses_centered = np.linalg.inv(pose_avg_homo) @ poses_homo # (N_images, 4, 4)
-    poses_centered = poses_centered[:, :3] # (N_images, 3, 4)
+    # shift ray origins to near plane
+    t = -(near + rays_o[:, 2]) / rays_d[:, 2]
+    rays_o = rays_o + t[:, None] * rays_d
 
-    return poses_centered, np.linalg.inv(pose_avg_homo)
-
-# construct intrinsic matrix from image height,width and focal length 
-def create_Kmatrix(H, W, focal):
-    K = np.array([
-            [focal, 0, 0.5*W, 0],
-            [0, focal, 0.5*H, 0],
-            [0, 0, 1, 0],
-            [0, 0, 0, 1]])
-    return K 
+    poses_ndc = poses.copy()
+    poses_ndc[:, 0, 3] = -1./(W/(2.*focal)) * rays_o[:, 0] / rays_o[:, 2]
+    poses_ndc[:, 1, 3] = -1./(H/(2.*focal)) * rays_o[:, 1] / rays_o[:, 2]
+    poses_ndc[:, 2, 3] = 1. + 2. * near / rays_o[:, 2]
+    return poses_ndc
 
+def export_cameras(data_file='poses_bounds.npy', variants=('original', 'recenter_scale'), output_dir='.',
+                   focal=680, general_inverse=False, write=True, fmt='json'):
+    """
+    Load poses_bounds.npy once and build the camera json of every requested variant
+    (see VARIANT_FILES) from the same intermediates.
 
-def main(recenter_scale=False):
-    # the path for camera info file 
-    data_file = 'poses_bounds.npy'
-    # load it in array
-    data = np.load(data_file)
-    # check the dimensions
-    print(data.shape)
+    Inputs:
+        data_file: path to poses_bounds.npy
+        variants: any of 'original', 'recenter', 'recenter_scale', 'ndc'
+        output_dir: folder for the json files
+        focal: focal length used for K (the value in poses_bounds.npy is in mm)
+        general_inverse: see c2w_to_w2c
+        write: False only returns the cameras
+        fmt: 'json' for the camera json files, 'bundle' for binary camera bundles (.npz)
 
+    Outputs:
+        cameras: {variant: camera dict as written to the json file, or the camera bundle}
+    """
+    if fmt not in ('json', 'bundle'):
+        raise ValueError('unknown camera file format: {}'.format(fmt))
+    unknown = set(variants) - set(VARIANT_FILES)
+    if unknown:
+        raise ValueError('unknown camera variants: {}'.format(sorted(unknown)))
 
-    poses = data[:, :15].reshape(-1, 3, 5) # (N_images, 3, 5) # poses for cameras given in the data file 
-    bounds = data[:, -2:] # (N_images, 2) # near and far given in the data file
-    print('original bounds are', bounds)
-    #bounds[:, 0] = 0.75
-    print('now bounds are ', bounds)
-    H, W, focal = poses[0, :, -1] # get camera intrinsics, same for all images  
-    print('height and width: ', H, W)
-    focal = 680
+    # open it memory-mapped, poses/bounds below are views of the file
+    store = PoseStore(data_file)
+    H, W, _ = store.hwf[0] # get camera intrinsics, same for all images  
 
     # construct K matrix for all cameras 
-    Kmat = create_Kmatrix(H, W, focal )
-    K_list = list(Kmat.flatten())
-    K_list = [float(item) for item in K_list]
+    Kmat = create_Kmatrix(H, W, focal)
 
     #Original poses has rotation in form "down right back", change to "right up back"
+    poses = store.poses
     poses = np.concatenate([poses[..., 1:2], -poses[..., :1], poses[..., 2:4]], -1)
-    
-    if recenter_scale:
-        '''
-        Begin the re-center process of the camera poses. (which is used in nerf_pl/datasets/llff.py for preprocessing the data before training)
-        '''
-        # to see how the camera poses change after re-normalization (the operation in nerf_pl, llff.py)
-        poses, pose_avg = center_poses(poses) 
-        distances_from_center = np.linalg.norm(poses[..., 3], axis=1)
-        val_idx = np.argmin(distances_from_center) # choose val image as the closest to
-                                                    # center image
-
-        # Step 3: correct scale so that the nearest depth is at a little more than 1.0
-        # See https://github.com/bmild/nerf/issues/34
-        near_original = bounds.min() 
-        print('near_original is ', near_original)
-        scale_factor = near_original*0.75 # 0.75 is the default parameter
-                                            # the nearest depth is at 1/0.75=1.33
-        bounds /= scale_factor
-        print('bounds is', bounds)
-        poses[..., 3] /= scale_factor
-
-        '''
-        end of the re-center process
-        '''
-    else:
-        pass 
-
-    all_camera_info = {} # a container for storing the camera infos, which will be saved into the final json file 
-    # get camera2world matrix for each camera 
-
-    for idx in range(data.shape[0]):
-        c2w_mat = poses[idx, ...]
-        last_row = np.array([0, 0, 0, 1]).reshape((1, 4))
-
-        c2w_mat = np.concatenate([c2w_mat, last_row], axis=0)
-
-        print(c2w_mat.shape)
-        w2c_mat = np.linalg.inv(c2w_mat)
-        w2c_list = list(w2c_mat.flatten())
-        w2c_list = [float(item) for item in w2c_list]
-
-        cur_item = {'K': K_list, 'W2C': w2c_list, 'img_size':[H, W]}
-        all_camera_info[f'{idx:03d}'] = cur_item  
-
-    
-    if recenter_scale:
-        camera_file = 'stomach_camera_recenter.json' 
-    else:
-        camera_file = 'stomach_camera_original.json'
-
-    with open(camera_file, 'w') as f: 
-        json.dump(all_camera_info, f)
-
 
+    # shared by the re-centered variants, computed on first use
+    poses_centered = None
+    poses_scaled = None
+
+    cameras = {}
+    for variant in variants:
+        if variant == 'original':
+            c2w = poses
+        else:
+            if poses_centered is None:
+                # the re-center process used in nerf_pl/datasets/llff.py for preprocessing the data before training
+                poses_centered, _ = center_poses(poses)
+            c2w = poses_centered
+
+        if variant in ('recenter_scale', 'ndc'):
+            if poses_scaled is None:
+                # correct scale so that the nearest depth is at a little more than 1.0
+                # See https://github.com/bmild/nerf/issues/34
+                scale_factor = store.bounds.min()*0.75 # 0.75 is the default parameter
+                                                        # the nearest depth is at 1/0.75=1.33
+                poses_scaled = poses_centered.copy()
+                poses_scaled[..., 3] /= scale_factor
+            c2w = poses_scaled
+
+        if variant == 'ndc':
+            c2w = ndc_poses(c2w, H, W, focal)
+
+        # get world2camera matrix for all cameras at once
+        w2c = c2w_to_w2c(c2w, general_inverse)
+        camera_file = os.path.join(output_dir, VARIANT_FILES[variant])
+
+        if fmt == 'json':
+            cameras[variant] = cameras_to_dict(w2c, Kmat, H, W)
+            if write:
+                write_camera_json(cameras[variant], camera_file)
+        else:
+            cameras[variant] = cameras_to_bundle(w2c, Kmat, H, W)
+            if write:
+                save_bundle(cameras[variant], os.path.splitext(camera_file)[0] + '.npz')
+
+    return cameras
+
+def main(recenter_scale=False, general_inverse=False):
+    # create stomach_camera_recenter.json if recenter_scale, else stomach_camera_original.json
+    variant = 'recenter_scale' if recenter_scale else 'original'
+    export_cameras(variants=(variant,), general_inverse=general_inverse)
 
 
 if __name__ == '__main__':
-    main()   # create a file for original cameras from poses_bounds.npy
-    main(True) # create a file for recen-tered cameras from poses_bounds.npy (the re-centering process is used in nerf_pl for data preprocessing)
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--npy', type=str, default='poses_bounds.npy', help='Path to poses_bounds.npy file')
+    parser.add_argument('--output', type=str, default='.', help='Path to directory to place the camera json files')
+    parser.add_argument('--variants', type=str, nargs='+', default=['original', 'recenter_scale'],
+                        choices=sorted(VARIANT_FILES), help='Camera variants to export')
+    parser.add_argument('--focal', type=float, default=680, help='Focal length used for the K matrix')
+    parser.add_argument('--general-inverse', action='store_true', help='Invert the poses with np.linalg.inv')
+    parser.add_argument('--format', type=str, default='json', choices=['json', 'bundle'],
+                        help='Write json camera files or binary camera bundles (.npz)')
+    args = parser.parse_args()
+
+    # by default creates a file for the original cameras and one for the re-centered cameras
+    # (the re-centering process is used in nerf_pl for data preprocessing), loading poses_bounds.npy once
+    export_cameras(args.npy, args.variants, args.output, args.focal, args.general_inverse, fmt=args.format)
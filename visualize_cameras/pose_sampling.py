@@ -0,0 +1,141 @@
+'''
+
+pose_sampling.py
+
+Picks a subset of the poses of a full EndoSLAM trajectory, e.g. the training
+views for NeRF, and writes them as poses_bounds.npy. All selections work on
+the (N, 7) [trans_x, trans_y, trans_z, quot_x, quot_y, quot_z, quot_w] array
+of the whole trajectory:
+
+    stride:   every step-th pose
+    distance: a pose whenever the camera traveled another min_distance along
+              the trajectory
+    rotation: a pose whenever the camera turned another min_rotation degrees
+              along the trajectory
+    farthest: farthest-point sampling in pose space (translation distance plus
+              rotation_weight * rotation angle in radians), maximizing coverage
+
+distance/rotation accept a count instead of a threshold, the threshold is then
+chosen so that about count poses are selected. The first pose is always kept.
+
+Flags:
+    --xlsx / --csv (Path to the EndoSLAM pose file, read through its pose cache)
+    --mode (stride, distance, rotation or farthest)
+    --count (Number of poses to select, default 20)
+    --step / --min-distance / --min-rotation (Thresholds of the stride/distance/rotation modes)
+    --rotation-weight (Weight of the rotation angle for farthest)
+    --output (Directory for poses_bounds.npy and sampled_indices.txt)
+
+'''
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train_test_nerf'))
+from convert2npy import CSV_POSE_COLS, XLSX_POSE_COLS, convert_to_poses_bounds, save_poses_bounds
+from pose_cache import load_pose_table
+
+MODES = ('stride', 'distance', 'rotation', 'farthest')
+
+
+def quat_angles(quots_a, quots_b):
+    # rotation angle (radians) between (x, y, z, w) quaternions, q and -q are the same rotation
+    quots_a = quots_a / np.linalg.norm(quots_a, axis=-1, keepdims=True)
+    quots_b = quots_b / np.linalg.norm(quots_b, axis=-1, keepdims=True)
+    dot = np.abs(np.sum(quots_a * quots_b, axis=-1))
+    return 2. * np.arccos(np.clip(dot, 0., 1.))
+
+def select_stride(numPoses, step, count=None, start=0):
+    idx = np.arange(start, numPoses, step)
+    return idx if count is None else idx[:count]
+
+def _select_accumulated(steps, threshold, count):
+    # keep the first pose and every pose where the accumulated steps pass another threshold
+    accumulated = np.concatenate(([0.], np.cumsum(steps)))
+    if threshold is None:
+        if count is None:
+            raise ValueError('either a threshold or a count is needed')
+        threshold = accumulated[-1] / max(count - 1, 1) if accumulated[-1] > 0 else 1.
+    level = np.floor(accumulated / threshold)
+    idx = np.concatenate(([0], np.flatnonzero(np.diff(level) > 0) + 1))
+    return idx if count is None else idx[:count]
+
+def select_distance(tranQuots, min_distance=None, count=None):
+    steps = np.linalg.norm(np.diff(tranQuots[:, :3], axis=0), axis=1)
+    return _select_accumulated(steps, min_distance, count)
+
+def select_rotation(tranQuots, min_rotation=None, count=None):
+    # min_rotation in degrees
+    steps = np.rad2deg(quat_angles(tranQuots[:-1, 3:], tranQuots[1:, 3:]))
+    return _select_accumulated(steps, min_rotation, count)
+
+def select_farthest(tranQuots, count, rotation_weight=1., first=0):
+    numPoses = len(tranQuots)
+    count = min(count, numPoses)
+    idx = np.empty(count, dtype=int)
+    min_dist = np.full(numPoses, np.inf)
+
+    selected = first
+    for i in range(count):
+        idx[i] = selected
+        # distance of all poses to the newly selected one, keep the distance to the closest selected pose
+        dist = np.linalg.norm(tranQuots[:, :3] - tranQuots[selected, :3], axis=1)
+        if rotation_weight:
+            dist += rotation_weight * quat_angles(tranQuots[:, 3:], tranQuots[selected, 3:])
+        np.minimum(min_dist, dist, out=min_dist)
+        selected = int(np.argmax(min_dist))
+
+    return np.sort(idx)
+
+def sample_poses(tranQuots, mode='stride', count=20, step=25, min_distance=None, min_rotation=None, rotation_weight=1.):
+    # indices of the selected poses in tranQuots
+    if mode not in MODES:
+        raise ValueError('unknown sampling mode: {}'.format(mode))
+    tranQuots = np.asarray(tranQuots, dtype=float)
+
+    if mode == 'stride':
+        return select_stride(len(tranQuots), step, count)
+    if mode == 'distance':
+        return select_distance(tranQuots, min_distance, count)
+    if mode == 'rotation':
+        return select_rotation(tranQuots, min_rotation, count)
+    return select_farthest(tranQuots, count, rotation_weight)
+
+def load_tranQuots(posePath, useCache=True):
+    table = load_pose_table(posePath, useCache=useCache)
+    poseCols = CSV_POSE_COLS if posePath.lower().endswith('.csv') else XLSX_POSE_COLS
+    return np.asarray(table[:, poseCols], dtype=float)
+
+def main(args):
+    posePath = args.xlsx or args.csv
+    if not posePath:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    tranQuots = load_tranQuots(posePath, not args.no_cache)
+    idx = sample_poses(tranQuots, args.mode, args.count, args.step, args.min_distance, args.min_rotation, args.rotation_weight)
+
+    save_poses_bounds(convert_to_poses_bounds(tranQuots[idx]), args.output)
+    np.savetxt(os.path.join(args.output, 'sampled_indices.txt'), idx, fmt='%d')
+    print('selected {} of {} poses'.format(len(idx), len(tranQuots)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--xlsx', type=str, help='Path to poses excel file')
+    parser.add_argument('--csv', type=str, help='Path to poses csv file')
+    parser.add_argument('--mode', type=str, default='stride', choices=MODES, help='How to select the poses')
+    parser.add_argument('--count', type=int, default=20, help='Number of poses to select')
+    parser.add_argument('--step', type=int, default=25, help='Stride of the stride mode')
+    parser.add_argument('--min-distance', type=float, default=None, help='Traveled distance between poses (distance mode)')
+    parser.add_argument('--min-rotation', type=float, default=None, help='Rotation in degrees between poses (rotation mode)')
+    parser.add_argument('--rotation-weight', type=float, default=1., help='Weight of the rotation angle (farthest mode)')
+    parser.add_argument('--output', type=str, default=os.getcwd(), help='Path to directory to place poses_bounds.npy')
+    parser.add_argument('--no-cache', action='store_true', help='Parse the pose file without using its pose cache')
+
+    args = parser.parse_args()
+
+    main(args)
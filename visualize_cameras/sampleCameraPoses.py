@@ -1,6 +1,13 @@
 import os
+import sys
+import numpy as np
 import openpyxl as opx
-from scipy.spatial.transform import Rotation as R
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train_test_nerf'))
+from pose_cache import load_pose_table
+from convert2npy import XLSX_POSE_COLS, convert_to_poses_bounds, save_poses_bounds
+from pose_sampling import sample_poses
+from pose_transforms import FlipShift
 
 
 XLSX_PATH = '/Downloads/nerf_related/HighCam/Stomach-III/TumorfreeTrajectory_4/Poses/low_high_pose_stom3_teste4_high_images.xlsx'
@@ -8,35 +15,43 @@ SAVE_PATH = '/Downloads/nerf_related'
 
 CAMERA_INFO = []
 STEPS = 25
+NUM_FRAMES = 20
+
+# how the frames are picked, see pose_sampling.py ('stride' uses STEPS)
+SAMPLING_MODE = 'stride'
+# also write the sampled (not updated) poses as poses_bounds.npy to SAVE_PATH
+WRITE_POSES_BOUNDS = False
+
+# read the excel file through its pose cache (see train_test_nerf/pose_cache.py)
+USE_POSE_CACHE = True
+REBUILD_POSE_CACHE = False
 
 
 def readXlsxInfo2Lst():
-    workbook = opx.load_workbook(XLSX_PATH)
-    sheet = workbook.active
+    table = load_pose_table(XLSX_PATH, useCache=USE_POSE_CACHE, rebuild=REBUILD_POSE_CACHE)
+    tranQuots = np.asarray(table[:, XLSX_POSE_COLS])
 
-    count = 0
+    idx = sample_poses(tranQuots, SAMPLING_MODE, count=NUM_FRAMES, step=STEPS)
+    if len(idx) < NUM_FRAMES:
+        return False
 
-    for row in sheet.iter_rows(min_row=2):
-        if row[0].value%STEPS == 0 and count < 20:
-            CAMERA_INFO.append([cell.value for cell in row])
-            count += 1
+    for row in table[idx]:
+        # index columns back to int, pose columns as floats
+        # blank (or non-numeric) index cells are nan in the pose cache and are written back as empty cells
+        CAMERA_INFO.append([None if np.isnan(value) else int(value) for value in row[:3]] + row[3:].tolist())
 
-            if row[0].value+STEPS > sheet.max_row:
-                return False
+    if WRITE_POSES_BOUNDS:
+        save_poses_bounds(convert_to_poses_bounds(tranQuots[idx]), SAVE_PATH)
 
-    workbook.close()
     return True
 
 def updateCamera(deltaDeg, deltaZ):
-    for i in range(len(CAMERA_INFO)):
-        cameraInfo = CAMERA_INFO[i]
-        rEuler = R.from_quat([cameraInfo[6], cameraInfo[7], cameraInfo[8], cameraInfo[9]]).as_euler('xyz', degrees=True)
-        rFlipped = R.from_euler('xyz', [rEuler[0], rEuler[1]+deltaDeg, rEuler[2]], degrees=True).as_quat()
-
-        newCameraInfo = CAMERA_INFO[i][:5]
-        newCameraInfo.extend([CAMERA_INFO[i][5] + deltaZ])
-        newCameraInfo.extend(rFlipped)
-        CAMERA_INFO[i] = newCameraInfo
+    # flip/shift all cameras at once, see train_test_nerf/pose_transforms.py
+    tranQuots = np.array([cameraInfo[3:10] for cameraInfo in CAMERA_INFO], dtype=float)
+    tranQuots = FlipShift(deltaDeg, deltaZ)(tranQuots)
+
+    for i, tranQuot in enumerate(tranQuots.tolist()):
+        CAMERA_INFO[i] = CAMERA_INFO[i][:3] + tranQuot
 
 def saveCameraInfo2Excel():
     workbook = opx.Workbook()
@@ -0,0 +1,64 @@
+'''
+
+test_camera_lod.py
+
+LOD selection on a json camera dict has to match the selection on the same
+cameras as a .npz bundle, also with more than 1000 cameras, where the json
+names do not sort as strings in frame order.
+
+    python -m pytest -q test_camera_lod.py
+
+'''
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from camera_bundle import as_bundle, bundle_to_dict, load_cameras, make_bundle, save_bundle
+from camera_lod import decimate_to_budget
+
+NUM_CAMERAS = 1200
+
+
+def trajectory_bundle(numCameras=NUM_CAMERAS):
+    # cameras along a helix, turning around their z axis as they go
+    t = np.linspace(0., 4. * np.pi, numCameras)
+    W2C = np.tile(np.eye(4), (numCameras, 1, 1))
+    W2C[:, 0, 0] = W2C[:, 1, 1] = np.cos(t)
+    W2C[:, 0, 1], W2C[:, 1, 0] = -np.sin(t), np.sin(t)
+    W2C[:, :3, 3] = np.stack((np.cos(t), np.sin(t), 0.1 * t), axis=-1)
+    names = [str(i) for i in range(numCameras)]
+    return make_bundle(names, np.eye(4), W2C, [480., 640.])
+
+@pytest.fixture
+def camera_files(tmp_path):
+    bundle = trajectory_bundle()
+    npzPath = os.path.join(str(tmp_path), 'cameras.npz')
+    jsonPath = os.path.join(str(tmp_path), 'cameras.json')
+    save_bundle(bundle, npzPath)
+    with open(jsonPath, 'w') as f:
+        # names in string order in the file: '0', '1', '10', '100', '1000', ...
+        json.dump(bundle_to_dict(bundle), f, sort_keys=True)
+    return jsonPath, npzPath
+
+def test_json_cameras_in_frame_order(camera_files):
+    jsonPath, npzPath = camera_files
+    fromJson, fromNpz = load_cameras(jsonPath), load_cameras(npzPath)
+    assert list(fromJson['names']) == list(fromNpz['names'])
+    np.testing.assert_array_equal(fromJson['W2C'], fromNpz['W2C'])
+
+@pytest.mark.parametrize('method', ['voxel', 'pose_change'])
+def test_lod_json_matches_npz(camera_files, method):
+    jsonPath, npzPath = camera_files
+    with open(jsonPath) as f:
+        fromJson = as_bundle(json.load(f))
+    fromNpz = as_bundle(load_cameras(npzPath))
+
+    jsonIdx, jsonStats = decimate_to_budget(fromJson['W2C'], 100, method=method)
+    npzIdx, npzStats = decimate_to_budget(fromNpz['W2C'], 100, method=method)
+    assert len(npzIdx) <= 100
+    np.testing.assert_array_equal(jsonIdx, npzIdx)
+    assert list(fromJson['names'][jsonIdx]) == list(fromNpz['names'][npzIdx])
+    assert jsonStats == npzStats
@@ -0,0 +1,100 @@
+'''
+
+test_frustum_geometry.py
+
+The batched camera_frustums of frustum_geometry.py against the per-camera
+get_camera_frustum of nerf++ that visualize_camera_stomach.py used before,
+for cameras with different intrinsics, image sizes and colors.
+
+    python -m pytest -q test_frustum_geometry.py
+
+'''
+
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation as R
+
+from frustum_geometry import camera_frustums, merge_geometry, w2c_to_c2w
+
+NUM_CAMERAS = 40
+
+
+def get_camera_frustum(img_size, K, W2C, frustum_length=0.5, color=[0., 1., 0.]):
+    # the original per-camera geometry, borrowed from nerf++
+    W, H = img_size
+    hfov = np.rad2deg(np.arctan(W / 2. / K[0, 0]) * 2.)
+    vfov = np.rad2deg(np.arctan(H / 2. / K[1, 1]) * 2.)
+    half_w = frustum_length * np.tan(np.deg2rad(hfov / 2.))
+    half_h = frustum_length * np.tan(np.deg2rad(vfov / 2.))
+
+    frustum_points = np.array([[0., 0., 0.],
+                               [-half_w, -half_h, frustum_length],
+                               [half_w, -half_h, frustum_length],
+                               [half_w, half_h, frustum_length],
+                               [-half_w, half_h, frustum_length]])
+    frustum_lines = np.array([[0, i] for i in range(1, 5)] + [[i, (i+1)] for i in range(1, 4)] + [[4, 1]])
+    frustum_colors = np.tile(np.array(color).reshape((1, 3)), (frustum_lines.shape[0], 1))
+
+    C2W = np.linalg.inv(W2C)
+    frustum_points = np.dot(np.hstack((frustum_points, np.ones_like(frustum_points[:, 0:1]))), C2W.T)
+    frustum_points = frustum_points[:, :3] / frustum_points[:, 3:4]
+
+    return frustum_points, frustum_lines, frustum_colors
+
+def frustums_per_camera(K, W2C, img_size, frustum_length, colors):
+    # the old loop over the cameras, merged as frustums2lineset did
+    return merge_geometry([get_camera_frustum(img_size[i], K[i], W2C[i], frustum_length, colors[i])
+                           for i in range(len(W2C))])
+
+@pytest.fixture
+def cameras():
+    rng = np.random.default_rng(0)
+    W2C = np.tile(np.eye(4), (NUM_CAMERAS, 1, 1))
+    W2C[:, :3, :3] = R.random(NUM_CAMERAS, random_state=1).as_matrix()
+    W2C[:, :3, 3] = rng.uniform(-3., 3., (NUM_CAMERAS, 3))
+    K = np.tile(np.eye(4), (NUM_CAMERAS, 1, 1))
+    K[:, 0, 0] = rng.uniform(200., 800., NUM_CAMERAS)
+    K[:, 1, 1] = K[:, 0, 0] * rng.uniform(0.9, 1.1, NUM_CAMERAS)
+    K[:, 0, 2], K[:, 1, 2] = 320., 240.
+    img_size = np.stack((rng.integers(320, 1280, NUM_CAMERAS), rng.integers(240, 960, NUM_CAMERAS)), axis=1)
+    return K, W2C, img_size
+
+
+@pytest.mark.parametrize('frustum_length', [0.1, 0.5])
+def test_matches_per_camera(cameras, frustum_length):
+    K, W2C, img_size = cameras
+    colors = np.random.default_rng(2).random((NUM_CAMERAS, 3))
+    points, lines, lineColors = camera_frustums(K, W2C, img_size, frustum_length=frustum_length, color=colors)
+    expected = frustums_per_camera(K, W2C, img_size, frustum_length, colors)
+
+    np.testing.assert_allclose(points, expected[0], atol=1e-12)
+    np.testing.assert_array_equal(lines, expected[1])
+    np.testing.assert_array_equal(lineColors, expected[2])
+
+def test_shared_intrinsics_and_color(cameras):
+    K, W2C, img_size = cameras
+    color = [1., 0.6, 0.2]
+    points, lines, lineColors = camera_frustums(K[0], W2C, img_size[0], frustum_length=0.1, color=color)
+    expected = frustums_per_camera([K[0]] * NUM_CAMERAS, W2C, [img_size[0]] * NUM_CAMERAS, 0.1, [color] * NUM_CAMERAS)
+    np.testing.assert_allclose(points, expected[0], atol=1e-12)
+    np.testing.assert_array_equal(lines, expected[1])
+    np.testing.assert_array_equal(lineColors, expected[2])
+
+def test_w2c_to_c2w(cameras):
+    _, W2C, _ = cameras
+    np.testing.assert_allclose(w2c_to_c2w(W2C), np.linalg.inv(W2C), atol=1e-12)
+
+def test_merge_offsets(cameras):
+    K, W2C, img_size = cameras
+    first = camera_frustums(K[:10], W2C[:10], img_size[:10])
+    second = camera_frustums(K[10:], W2C[10:], img_size[10:])
+    merged = merge_geometry([first, second])
+    whole = camera_frustums(K, W2C, img_size)
+    for a, b in zip(merged, whole):
+        np.testing.assert_allclose(a, b)
+    assert merge_geometry([])[0].shape == (0, 3)
+
+def test_visualizer_imports_without_open3d():
+    # the geometry of the visualizer is built headless, open3d is only needed to draw it
+    import visualize_camera_stomach
+    assert visualize_camera_stomach.camera_frustums is camera_frustums
@@ -1,55 +1,16 @@
-import open3d as o3d
-import json
-import numpy as np
-
-
-# plot camera frustum, borrowed from nerf++
-def get_camera_frustum(img_size, K, W2C, frustum_length=0.5, color=[0., 1., 0.]):
-    W, H = img_size
-    hfov = np.rad2deg(np.arctan(W / 2. / K[0, 0]) * 2.)
-    vfov = np.rad2deg(np.arctan(H / 2. / K[1, 1]) * 2.)
-    half_w = frustum_length * np.tan(np.deg2rad(hfov / 2.))
-    half_h = frustum_length * np.tan(np.deg2rad(vfov / 2.))
-
-    # build view frustum for camera (I, 0)
-    frustum_points = np.array([[0., 0., 0.],                          # frustum origin
-                               [-half_w, -half_h, frustum_length],    # top-left image corner
-                               [half_w, -half_h, frustum_length],     # top-right image corner
-                               [half_w, half_h, frustum_length],      # bottom-right image corner
-                               [-half_w, half_h, frustum_length]])    # bottom-left image corner
-    frustum_lines = np.array([[0, i] for i in range(1, 5)] + [[i, (i+1)] for i in range(1, 4)] + [[4, 1]])
-    frustum_colors = np.tile(np.array(color).reshape((1, 3)), (frustum_lines.shape[0], 1))
-
-    # frustum_colors = np.vstack((np.tile(np.array([[1., 0., 0.]]), (4, 1)),
-    #                            np.tile(np.array([[0., 1., 0.]]), (4, 1))))
-
-    # transform view frustum from (I, 0) to (R, t)
-    C2W = np.linalg.inv(W2C)
-    frustum_points = np.dot(np.hstack((frustum_points, np.ones_like(frustum_points[:, 0:1]))), C2W.T)
-    frustum_points = frustum_points[:, :3] / frustum_points[:, 3:4]
-
-    return frustum_points, frustum_lines, frustum_colors
-
-def frustums2lineset(frustums):
-    N = len(frustums)
-    merged_points = np.zeros((N*5, 3))      # 5 vertices per frustum
-    merged_lines = np.zeros((N*8, 2))       # 8 lines per frustum
-    merged_colors = np.zeros((N*8, 3))      # each line gets a color
-
-    for i, (frustum_points, frustum_lines, frustum_colors) in enumerate(frustums):
-        merged_points[i*5:(i+1)*5, :] = frustum_points
-        merged_lines[i*8:(i+1)*8, :] = frustum_lines + i*5
-        merged_colors[i*8:(i+1)*8, :] = frustum_colors
-
-    lineset = o3d.geometry.LineSet()
-    lineset.points = o3d.utility.Vector3dVector(merged_points)
-    lineset.lines = o3d.utility.Vector2iVector(merged_lines)
-    lineset.colors = o3d.utility.Vector3dVector(merged_colors)
-
-    return lineset
+from camera_bundle import as_bundle, load_cameras
+from frustum_geometry import camera_frustums, merge_geometry, to_lineset
+from camera_lod import decimate_to_budget, export_geometry, select_cameras
+
 
 # draw cameras
-def visualize_cameras(colored_camera_dicts, sphere_radius, camera_size=0.1, geometry_file=None, geometry_type='mesh'):
+# max_cameras: draw at most this many cameras per camera dict, decimated with lod_method (see camera_lod.py)
+# export_path: also write the drawn camera frustums to a .ply/.npz file
+def visualize_cameras(colored_camera_dicts, sphere_radius, camera_size=0.1, geometry_file=None, geometry_type='mesh',
+                      max_cameras=None, lod_method='voxel', export_path=None):
+    # only drawing needs open3d, the camera geometry is plain numpy
+    import open3d as o3d
+
     # create a sphere (centered at (0, 0, 0))
     sphere = o3d.geometry.TriangleMesh.create_sphere(radius=sphere_radius, resolution=10)
     sphere = o3d.geometry.LineSet.create_from_triangle_mesh(sphere)
@@ -58,21 +19,23 @@ def visualize_cameras(colored_camera_dicts, sphere_radius, camera_size=0.1, geom
     coord_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.5, origin=[0., 0., 0.])  # create axis arrows (r, g, b) -> (x, y, z)
     things_to_draw = [sphere, coord_frame]
 
-    idx = 0
+    # frustums of all cameras are built at once, see frustum_geometry.py
+    frustums = []
+    lod_stats = []
     for color, camera_dict in colored_camera_dicts:
-        idx += 1
-
-        cnt = 0
-        frustums = []
-        for img_name in sorted(camera_dict.keys()):
-            K = np.array(camera_dict[img_name]['K']).reshape((4, 4))
-            W2C = np.array(camera_dict[img_name]['W2C']).reshape((4, 4))
-            C2W = np.linalg.inv(W2C)
-            img_size = camera_dict[img_name]['img_size']
-            frustums.append(get_camera_frustum(img_size, K, W2C, frustum_length=camera_size, color=color))
-            cnt += 1
-        cameras = frustums2lineset(frustums)
-        things_to_draw.append(cameras)
+        # camera_dict is either a json camera dict or a camera bundle, cameras are ordered by name
+        bundle = as_bundle(camera_dict)
+        if max_cameras is not None:
+            idx, stats = decimate_to_budget(bundle['W2C'], max_cameras, method=lod_method)
+            print('camera decimation:', stats)
+            bundle = select_cameras(bundle, idx)
+            lod_stats.append(stats)
+        frustums.append(camera_frustums(bundle['K'], bundle['W2C'], bundle['img_size'], frustum_length=camera_size, color=color))
+    merged = merge_geometry(frustums)
+    things_to_draw.append(to_lineset(*merged))
+
+    if export_path is not None:
+        export_geometry(export_path, *merged, stats={'camera_size': camera_size, 'lod': lod_stats})
 
     if geometry_file is not None:
         if geometry_type == 'mesh':
@@ -96,8 +59,9 @@ if __name__ == '__main__':
 
     sphere_radius = 1.0 # a auxiliary sphere for better visualization
 
-    train_cam_dict = json.load(open(os.path.join(data_dir, 'stomach_camera_original.json')))  # read the cameras from original data 
-    train_cam_dict_recenter = json.load(open(os.path.join(data_dir, 'stomach_camera_recenter.json'))) # read the cameras after re-centered by nerf_pl (which are used in training)
+    # use the .npz camera bundles instead if poseNpy2json.py was run with --format bundle
+    train_cam_dict = load_cameras(os.path.join(data_dir, 'stomach_camera_original.json'))  # read the cameras from original data 
+    train_cam_dict_recenter = load_cameras(os.path.join(data_dir, 'stomach_camera_recenter.json')) # read the cameras after re-centered by nerf_pl (which are used in training)
 
     camera_size = 0.1 * sphere_radius # set the size for visualization (just used for visualization)
 
@@ -107,5 +71,7 @@ if __name__ == '__main__':
 
     ]
 
+    max_cameras = None  # e.g. 2000 to decimate long trajectories before drawing them
+
     visualize_cameras(colored_camera_dicts, sphere_radius, 
-                       camera_size=camera_size)
\ No newline at end of file
+                       camera_size=camera_size, max_cameras=max_cameras)
\ No newline at end of file